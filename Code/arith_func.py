@@ -9,11 +9,19 @@ operations from arith1 cd and factorial from integer1
 #   imports   #
 ###############
 
-from fractions import gcd
+from math import gcd, comb, isfinite, isqrt, prod
+from bisect import bisect_right
+from fractions import Fraction
 from functools import reduce
+from itertools import accumulate, compress
 import operator
 import types
 
+try:
+    import numpy
+except ImportError:
+    numpy = None    # the vectorized evaluator is disabled
+
 
 ####################################
 #   python functions and symbols   #
@@ -21,7 +29,9 @@ import types
 #     mathematical definitions     #
 ####################################
 
-def plus(a, b):
+def plus(a, b, *rest):
+    if rest:
+        return reduce(operator.add, rest, a + b)
     return a + b
 
 
@@ -29,7 +39,9 @@ def minus(a, b):
     return a - b
 
 
-def times(a, b):
+def times(a, b, *rest):
+    if rest:
+        return balancedReduce(operator.mul, (a, b) + rest, 1)
     return a * b
 
 
@@ -44,10 +56,12 @@ def root(number, order):
 
 
 def unary_minus(a):
-    return (0 - a)
+    return (-a)
 
 
-def lcm(a, b):
+def lcm(a, b, *rest):
+    if rest:
+        return balancedReduce(lcm, (a, b) + rest, 1)
     return (a*b // gcd (a, b))
 
 
@@ -57,8 +71,18 @@ def ar_sum(function, interval):
     applies function to all elements of interval
     returns their subsequent sum
 
+    over an integer interval, a polynomial function is summed in
+    closed form and other functions are evaluated vectorized if possible
+
     """
     func = flatten(function)
+    bounds = integerBounds(interval)
+    if bounds:
+        coeffs = getattr(func, 'polynomial', None)
+        if coeffs is not None:
+            return polynomialSum(coeffs, bounds[0], bounds[1])
+        if useVector(bounds):
+            return vectorReduce(func, bounds[0], bounds[1], True)
     return sum(map(func, interval))
 
 
@@ -70,11 +94,45 @@ def ar_product(function, interval):
 
     """
     func = flatten(function)
+    bounds = integerBounds(interval)
+    if bounds and useVector(bounds):
+        return vectorReduce(func, bounds[0], bounds[1], False)
     return product(map(func, interval))
 
 
 def factorial(n):
-    return product(range(1, n+1))
+    """
+    returns n! for an integer n >= 0, from a table for small n and
+    by the prime swing algorithm otherwise
+
+    """
+    checkNatural(n, 'factorial')
+    if n < SMALL_FACTORIAL:
+        return smallFactorials[n]
+    primes = primesUpTo(n)
+    return primeSwingFactorial(n, primes)
+
+
+def factorial_mod(n, m):
+    """
+    returns n! modulo the integer m > 0, by the prime swing algorithm
+    with every product reduced modulo m
+
+    """
+    checkNatural(n, 'factorial_mod')
+    if not (type(m) == int and m > 0):
+        raise ValueError("factorial_mod modulus must be an integer > 0")
+    if n >= m:
+        return 0        # m is one of the factors
+    return primeSwingFactorialMod(n, primesUpTo(n), m)
+
+
+def power_mod(a, b, m):
+    """
+    returns a to the power of b modulo m (b < 0 for the inverse of a)
+
+    """
+    return pow(a, b, m)
 
 
 
@@ -85,6 +143,55 @@ def factorial(n):
 # list of names of the functions that only have one argument
 singleArg = ['unary_minus','abs','factorial']
 
+# list of names of the functions that have three arguments
+threeArgs = ['power_mod']
+
+# list of names of the functions that have any number of arguments
+naryArg = ['plus','times','gcd','lcm']
+
+# value of each n-ary function applied to no argument
+naryEmpty = {'plus' : 0, 'times' : 1, 'gcd' : 0, 'lcm' : 1}
+
+
+def applyNary(f, args):
+    """
+    applies the n-ary function f (see naryArg) to the list args,
+    which may hold any number of values
+
+    """
+    if len(args) > 1 or f is gcd:
+        return f(*args)
+    if args:
+        return args[0]
+    return naryEmpty[f.__name__]
+
+
+def balancedReduce(f, iterable, initial):
+    """
+    returns f (associative) applied to all the values of iterable, in
+    order, combining values of the same size in a balanced tree rather
+    than folding from the left, initial if iterable is empty
+
+    the product of many big integers is much faster this way, as most
+    multiplications are between numbers of similar sizes
+    only a logarithmic number of partial results is kept
+
+    """
+    stack = []      # (partial result, number of values), sizes decreasing
+    for x in iterable:
+        n = 1
+        while stack and stack[-1][1] == n:
+            y, m = stack.pop()
+            x = f(y, x)
+            n += m
+        stack.append((x, n))
+    if not stack:
+        return initial
+    x = stack.pop()[0]
+    while stack:
+        x = f(stack.pop()[0], x)
+    return x
+
 
 def flatten (func):
     """
@@ -92,10 +199,28 @@ def flatten (func):
     returns a flat function
 
     """
-    # if function is nested, its application will yield another function
-    if type(func(0)) == types.FunctionType:
-        return flatten (lambda x: func(x)(x))
-    # if not nested just return it
+    n = getattr(func, 'variables', None)
+    if n is None:
+        # unknown number of variables, the application of a nested
+        # function will yield another function
+        if type(func(0)) == types.FunctionType:
+            return flatten (lambda x: func(x)(x))
+        # if not nested just return it
+        return func
+    if n == 1:
+        return func
+    flat = lambda x: applyAll(func, n, x)
+    flat.polynomial = getattr(func, 'polynomial', None)
+    return flat
+
+
+def applyAll(func, n, x):
+    """
+    applies the nested function func to x, n times
+
+    """
+    for _ in range(n):
+        func = func(x)
     return func
 
 
@@ -104,7 +229,256 @@ def product(iterable):
     returns the product of all the values in iterable
 
     """
-    return reduce(operator.mul, iterable, 1)
+    return balancedReduce(operator.mul, iterable, 1)
+
+
+def integerBounds(interval):
+    """
+    returns the first and last value of a non empty interval of
+    consecutive integers, or None if interval is not such an interval
+
+    """
+    interval = getattr(interval, 'range', interval)   # IntegerInterval
+    if isinstance(interval, range):
+        if interval.step == 1 and len(interval) > 0:
+            return interval[0], interval[-1]
+        return None
+    if not isinstance(interval, list) or len(interval) == 0:
+        return None
+    first = interval[0]
+    if not type(first) == int:
+        return None
+    for i, x in enumerate(interval):
+        if not (type(x) == int and x == first + i):
+            return None
+    return first, interval[-1]
+
+
+#################
+#   factorial   #
+#################
+
+# factorials below this are read from smallFactorials
+SMALL_FACTORIAL = 256
+
+# built once here: the table is read by the threads of the server
+smallFactorials = list(accumulate(range(1, SMALL_FACTORIAL), operator.mul,
+                                  initial=1))
+
+
+def checkNatural(n, name):
+    if not (type(n) == int and n >= 0):
+        raise ValueError("%s is only defined for integers >= 0" % name)
+
+
+def primesUpTo(n):
+    """
+    returns the list of the primes up to n (sieve of Eratosthenes)
+
+    """
+    if n < 2:
+        return []
+    sieve = bytearray([1]) * (n+1)
+    sieve[0] = sieve[1] = 0
+    for p in range(2, int(n ** 0.5) + 1):
+        if sieve[p]:
+            sieve[p*p::p] = bytes(len(range(p*p, n+1, p)))
+    return list(compress(range(n+1), sieve))
+
+
+def swingFactors(n, primes):
+    """
+    returns the list of the prime powers whose product is the swinging
+    factorial n! / ((n//2)!)^2 of n, primes being the primes up to n
+
+    """
+    root = bisect_right(primes, isqrt(n))
+    half = bisect_right(primes, n // 2)
+    factors = []
+    for p in primes[:root]:
+        q = n
+        e = 0
+        while q:
+            q //= p
+            e += q & 1
+        if e:
+            factors.append(p if e == 1 else p ** e)
+    # above the square root of n the exponent is 0 or 1
+    factors.extend(p for p in primes[root:half] if (n // p) & 1)
+    # every prime in (n/2, n] appears once
+    factors.extend(primes[half:bisect_right(primes, n)])
+    return factors
+
+
+def primeSwing(n, primes):
+    """
+    returns the swinging factorial of n, see swingFactors
+
+    """
+    return balancedReduce(operator.mul, swingFactors(n, primes), 1)
+
+
+def primeSwingFactorial(n, primes):
+    """
+    returns n! = ((n//2)!)^2 * swing(n), see primeSwing
+
+    """
+    if n < SMALL_FACTORIAL:
+        return factorial(n)
+    half = primeSwingFactorial(n // 2, primes)
+    return half * half * primeSwing(n, primes)
+
+
+def primeSwingFactorialMod(n, primes, m):
+    """
+    returns n! modulo m, see primeSwingFactorial
+
+    """
+    if n < SMALL_FACTORIAL:
+        return factorial(n) % m
+    half = primeSwingFactorialMod(n // 2, primes, m)
+    return half * half % m * productMod(swingFactors(n, primes), m) % m
+
+
+# number of factors multiplied together before a reduction modulo m
+# in productMod
+MOD_CHUNK = 16
+
+
+def productMod(values, m):
+    """
+    returns the product of the list values modulo m: the products of
+    chunks of MOD_CHUNK values, reduced modulo m, are multiplied in a
+    balanced tree reduced modulo m at each level
+
+    """
+    chunks = (prod(values[i:i+MOD_CHUNK]) % m
+              for i in range(0, len(values), MOD_CHUNK))
+    return balancedReduce(lambda a, b: a * b % m, chunks, 1 % m)
+
+
+######################################
+#   closed form sum of polynomials   #
+######################################
+
+# Bernoulli numbers B0, B1, ... (with B1 = +1/2), extended as needed
+bernoulli = [Fraction(1), Fraction(1, 2)]
+
+
+def bernoulliNumber(m):
+    """
+    returns the m-th Bernoulli number, with B1 = +1/2
+
+    """
+    while len(bernoulli) <= m:
+        k = len(bernoulli)
+        # sum of C(k+1, j) * Bj for j = 0..k is 0, with B1 = -1/2
+        s = sum(comb(k+1, j) * b for j, b in enumerate(bernoulli)) \
+            - comb(k+1, 1)      # replaces +1/2 by -1/2 for B1
+        bernoulli.append(-s / (k+1))
+    return bernoulli[m]
+
+
+def powerSum(k, n):
+    """
+    returns Faulhaber's polynomial for 1^k + 2^k + ... + n^k,
+    evaluated at any integer n
+
+    """
+    total = sum(comb(k+1, j) * bernoulliNumber(j) * n**(k+1-j)
+                for j in range(k+1))
+    return total / (k+1)
+
+
+def polynomialSum(coeffs, first, last):
+    """
+    returns the sum of the polynomial with integer coefficients coeffs
+    over all the integers from first to last (included)
+
+    """
+    total = Fraction(0)
+    for k, c in enumerate(coeffs):
+        if c:
+            total += c * (powerSum(k, last) - powerSum(k, first-1))
+    return int(total)
+
+
+#########################
+#   vectorized reduce   #
+#########################
+
+# intervals shorter than this are evaluated one element at a time
+VECTOR_MIN = 4096
+
+# number of elements evaluated at once by the vectorized evaluator
+VECTOR_CHUNK = 1 << 16
+
+
+def useVector(bounds):
+    """
+    returns True if the interval with the given bounds should be
+    evaluated with the vectorized evaluator
+
+    """
+    return numpy is not None and bounds[1] - bounds[0] + 1 >= VECTOR_MIN \
+        and -2**53 < bounds[0] and bounds[1] < 2**53
+
+
+def vectorReduce(func, first, last, is_sum):
+    """
+    returns the sum (or product) of func applied to all the integers
+    from first to last, evaluating func on NumPy arrays chunk by chunk
+
+    a chunk which cannot be evaluated exactly with machine numbers
+    (unsupported operation, int64 overflow, ...) is evaluated again
+    with Python numbers
+
+    """
+    total = 0 if is_sum else 1
+    for lo in range(first, last+1, VECTOR_CHUNK):
+        hi = min(lo + VECTOR_CHUNK, last+1)
+        part = vectorChunk(func, lo, hi, is_sum)
+        if part is None:
+            values = map(func, range(lo, hi))
+            part = sum(values) if is_sum else product(values)
+        total = total + part if is_sum else total * part
+    return total
+
+
+def vectorChunk(func, lo, hi, is_sum):
+    """
+    returns the sum (or product) of func applied to the integers
+    from lo to hi (excluded) using NumPy arrays,
+    or None if the result could not be computed exactly
+
+    """
+    xs = numpy.arange(lo, hi, dtype=numpy.int64)
+    try:
+        with numpy.errstate(all='ignore'):
+            values = func(xs)
+            if not isinstance(values, numpy.ndarray) or \
+                    not values.shape == xs.shape or \
+                    not values.dtype.kind in 'if':
+                return None
+            # int64 arithmetic wraps around silently (also in the
+            # intermediate values of a float result), compare against
+            # the same computation with floats to detect an overflow
+            shadow = func(xs.astype(numpy.float64))
+            if values.dtype.kind == 'f':
+                if not numpy.allclose(values, shadow, rtol=1e-9, atol=0):
+                    return None
+                part = float(values.sum() if is_sum else values.prod())
+                # nan or inf stand for a Python error or complex value
+                return part if isfinite(part) else None
+    except (TypeError, ValueError, ArithmeticError):
+        return None
+    limit = min(2**53, 2**62 // len(xs)) if is_sum else 2**53
+    if not (numpy.array_equal(values, shadow) and
+            float(numpy.abs(shadow).max()) < limit):
+        return None
+    if is_sum:
+        return int(values.sum())
+    return product(values.tolist())
 
 
 arithmetic_func = {}
@@ -120,5 +494,7 @@ arithmetic_func['root']                 = root
 arithmetic_func['gcd']                  = gcd
 arithmetic_func['lcm']                  = lcm
 arithmetic_func['abs']                  = abs
+arithmetic_func['factorial_mod']        = factorial_mod
+arithmetic_func['power_mod']            = power_mod
 arithmetic_func['sum']                  = ar_sum
 arithmetic_func['product']              = ar_product
@@ -0,0 +1,824 @@
+"""
+
+Module contains benchmarks for the OpenMath evaluator
+
+each benchmark compares the current implementation of an operation
+with the one it replaced and prints the timings
+
+the benchmark suite measures parsing, serialisation, process() and the
+server on generated workloads, and saves the results as JSON so that
+two commits can be compared:
+
+    python benchmark.py suite [-r repeat] [-o results.json] [workload ...]
+    python benchmark.py compare old.json new.json
+
+"""
+
+###############
+#   imports   #
+###############
+
+import asyncio
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
+import fractions
+import xml.etree.ElementTree as ET
+from openmath import *
+from omclient import evaluate_many, percentile
+from omprotocol import sendFrame, recvFrame
+from omserver import OMServer
+
+
+#################
+#   workloads   #
+#################
+
+SUM_LAMBDA = """
+<OMBIND>
+  <OMS cd="fns1" name="lambda"/>
+  <OMBVAR>
+    <OMV name="x"/>
+  </OMBVAR>
+  <OMA>
+    <OMS cd="arith1" name="plus"/>
+    <OMA>
+      <OMS cd="arith1" name="unary_minus"/>
+      <OMV name="x"/>
+    </OMA>
+    <OMA>
+      <OMS cd="arith1" name="times"/>
+      <OMA>
+        <OMS cd="arith1" name="plus"/>
+        <OMI> 1 </OMI>
+        <OMI> 1 </OMI>
+      </OMA>
+      <OMV name="x"/>
+    </OMA>
+  </OMA>
+</OMBIND>
+"""
+
+ABS_LAMBDA = """
+<OMBIND>
+  <OMS cd="fns1" name="lambda"/>
+  <OMBVAR>
+    <OMV name="x"/>
+  </OMBVAR>
+  <OMA>
+    <OMS cd="arith1" name="abs"/>
+    <OMA>
+      <OMS cd="arith1" name="minus"/>
+      <OMV name="x"/>
+      <OMI> 1000 </OMI>
+    </OMA>
+  </OMA>
+</OMBIND>
+"""
+
+
+#########################
+#   timing functions    #
+#########################
+
+def timed(label, func, *args):
+    """
+    runs func on args, prints the time it took and returns its result
+
+    """
+    start = time.perf_counter()
+    result = func(*args)
+    print("%-40s %10.3f s" % (label, time.perf_counter() - start))
+    return result
+
+
+##################
+#   benchmarks   #
+##################
+
+def bench_lambda_sum(n=10**6):
+    """
+    sum over n terms of a lambda body, interpreted (evalBody walks the
+    OM tree on every application) against compiled (compileBody)
+
+    """
+    node = ET.fromstring(SUM_LAMBDA)
+    variables, body = node[1], node[2]
+    name = variables[0].get('name')
+    interpreted = lambda x: evalBody(body, updateEnv(name, x, {}))
+    compiled = ParseOMBIND(node)
+    interval = range(1, n+1)
+    a = timed("lambda sum, interpreted (n=%d)" % n,
+              lambda: sum(map(interpreted, interval)))
+    b = timed("lambda sum, compiled    (n=%d)" % n,
+              lambda: sum(map(compiled, interval)))
+    assert a == b
+
+
+def bench_interval_sum(n=10**7):
+    """
+    sum over the integer interval 1..n of a polynomial lambda body
+    (closed form) and of a body with abs (vectorized when NumPy is
+    installed), against applying the compiled lambda to each element
+
+    """
+    node = ET.fromstring(SUM_LAMBDA)
+    func = ParseOMBIND(node)
+    interval = IntegerInterval(1, n)
+    a = timed("polynomial sum, per element (n=%d)" % n,
+              lambda: sum(map(func, interval)))
+    b = timed("polynomial sum, closed form (n=%d)" % n,
+              ar_sum, func, interval)
+    assert a == b
+    func = ParseOMBIND(ET.fromstring(ABS_LAMBDA))
+    a = timed("abs sum, per element        (n=%d)" % n,
+              lambda: sum(map(func, interval)))
+    b = timed("abs sum, vectorized         (n=%d)" % n,
+              ar_sum, func, interval)
+    assert a == b
+
+
+def OMprettystringConcat( obj, level ):
+    """
+    OMprettystring as it was, concatenating strings through the recursion
+
+    """
+    string = '\n' + level * 4 * ' ' + '<' + obj.tag
+    for value,key in obj.attrib.items():
+        string += ' {}=\'{}\''.format(value,key)
+    if obj.text:
+        string += '>'
+        string += str(obj.text)
+        string += '</' + obj.tag + '>'
+    elif obj:
+        string += '>'
+        for child in obj:
+            string += OMprettystringConcat( child, level+1 )
+        string += '\n' + level * 4 * ' ' + '</' + obj.tag + '>'
+    else:
+        string += " />"
+    return string
+
+
+def bench_matrix_print(n=1000):
+    """
+    pretty printing of an n x n matrix, by string concatenation
+    against the chunk writer (OMwrite)
+
+    """
+    matrix = Matrix([MatrixRow(list(range(i*n, (i+1)*n))) for i in range(n)])
+    omobj = OMobject(matrix)
+    a = timed("matrix print, concatenation (n=%d)" % n,
+              OMprettystringConcat, omobj, 0)
+    b = timed("matrix print, chunk writer  (n=%d)" % n,
+              OMprettystring, omobj, 0)
+    assert a == b
+
+
+def peak(label, func, *args):
+    """
+    runs func on args, prints the peak memory it allocated
+
+    """
+    tracemalloc.start()
+    result = func(*args)
+    print("%-40s %10.1f MB" % (label, tracemalloc.get_traced_memory()[1] / 1e6))
+    tracemalloc.stop()
+    return result
+
+
+def bench_serialize(n=10**6):
+    """
+    serialisation of a list of n integers and of a sqrt(n) x sqrt(n)
+    matrix through OM elements (OMobject) against the direct writer
+    (OMtext)
+
+    """
+    m = int(n ** 0.5)
+    values = [("list", list(range(n))),
+              ("matrix", Matrix([MatrixRow(list(range(i*m, (i+1)*m)))
+                                 for i in range(m)]))]
+    for name, x in values:
+        a = timed("%s, OM elements (n=%d)" % (name, n),
+                  lambda: OMprettystring(OMobject(x), 0))
+        b = timed("%s, direct writer (n=%d)" % (name, n), OMtext, x)
+        assert a == b
+        peak("%s, OM elements memory" % name,
+             lambda: OMprettystring(OMobject(x), 0))
+        peak("%s, direct writer memory" % name, OMtext, x)
+
+
+def OMelementChain(x):
+    """
+    OMelement as it was, testing the type of x in turn
+
+    """
+    if isinstance(x, Matrix):
+        return OMMatrix(x)
+    if isinstance(x, IntegerInterval):
+        return OMInterval(x)
+    if isinstance(x, OMErrorObj):
+        return OMError(x)
+    t = type (x)
+    if t == int:
+        return OMInt(x)
+    elif t == list:
+        return OMList(x)
+    elif t == str:
+        return OMStr(x)
+    elif t == float:
+        return OMFloat(x)
+    elif t == complex:
+        return OMComplex(x)
+    elif t == bool:
+        return OMBool(x)
+    elif t == fractions.Fraction:
+        return OMRational(x)
+
+
+def bench_encode(number=200000):
+    """
+    cost per value of encoding values of several types, with the chain of
+    type tests against the dispatch table (OMelement) and the text writer
+
+    """
+    values = [7, 2.5, "s", True, fractions.Fraction(1, 3)]
+    ignore = lambda chunk: None
+    for x in values:
+        for label, func in [("chain", lambda: OMelementChain(x)),
+                            ("table", lambda: OMelement(x)),
+                            ("writer", lambda: writeValue(x, ignore, '', ''))]:
+            t = timeit.timeit(func, number=number)
+            print("%-40s %10.0f ns" % ("encode %s, %s" % (type(x).__name__,
+                                                         label),
+                                       t / number * 1e9))
+
+
+def bench_stream_parse(n=10**6, path="/tmp/bench_list.xml"):
+    """
+    parsing of a file holding a list of n integers, building the whole
+    tree (ParseOMfile) against evaluating it while reading (ParseOMstream)
+
+    """
+    with builtins.open(path, "w") as f:
+        OMwriteObject(list(range(n)), f.write)
+    a = timed("list file, whole tree (n=%d)" % n, ParseOMfile, path)
+    b = timed("list file, streaming (n=%d)" % n, ParseOMstream, path)
+    assert a == b
+    peak("list file, whole tree memory", ParseOMfile, path)
+    peak("list file, streaming memory", ParseOMstream, path)
+    os.remove(path)
+
+
+def ParseOMArecursive(node):
+    """
+    ParseOMA as it was, parsing nested elements by recursion
+
+    """
+    f = ParseOMelementRecursive(node[0])
+    if isinstance(f, OMErrorObj):
+        return f
+    return f([ParseOMelementRecursive(child) for child in node[1:]])
+
+
+def ParseOMelementRecursive(obj):
+    if obj.tag == 'OMA':
+        return ParseOMArecursive(obj)
+    return ParseOMelement(obj)
+
+
+def deepPlus(n):
+    """
+    returns an OMA element nesting n applications of arith1.plus
+
+    """
+    return ET.fromstring(deepPlusString(n))
+
+
+def deepPlusString(n):
+    return '<OMA><OMS cd="arith1" name="plus"/>' * n + '<OMI>1</OMI>' + \
+           '<OMI>1</OMI></OMA>' * n
+
+
+def bench_deep(n=10**5, shallow=300, repeat=100):
+    """
+    parsing of nested arith1.plus applications, recursive against
+    iterative (ParseOMA), at a depth both can handle (shallow) and at
+    depth n
+
+    """
+    node = deepPlus(shallow)
+    a = timed("nested plus, recursive (depth=%d, x%d)" % (shallow, repeat),
+              lambda: [ParseOMArecursive(node) for _ in range(repeat)])
+    b = timed("nested plus, iterative (depth=%d, x%d)" % (shallow, repeat),
+              lambda: [ParseOMA(node) for _ in range(repeat)])
+    assert a == b
+    node = deepPlus(n)
+    try:
+        timed("nested plus, recursive (depth=%d)" % n, ParseOMArecursive, node)
+    except RecursionError:
+        print("%-40s %12s" % ("nested plus, recursive (depth=%d)" % n,
+                              "RecursionError"))
+    timed("nested plus, iterative (depth=%d)" % n, ParseOMA, node)
+
+
+def bench_binary(n=10**6):
+    """
+    round trip of lists of n integers and of n floats, as OpenMath
+    strings (OMtext, ParseOMstring) against binary encoded OpenMath
+    objects (OMbinary, ParseOMbinary)
+
+    """
+    values = [("int list", list(range(-n // 2, n // 2))),
+              ("float list", [i / 7 for i in range(n)])]
+    for name, x in values:
+        text = timed("%s, write text (n=%d)" % (name, n), OMtext, x, False)
+        data = timed("%s, write binary (n=%d)" % (name, n), OMbinary, x)
+        a = timed("%s, parse text (n=%d)" % (name, n), ParseOMstring, text)
+        b = timed("%s, parse binary (n=%d)" % (name, n), ParseOMbinary, data)
+        assert a == b == x
+        print("%-40s %10d / %d bytes" % ("%s, text / binary size" % name,
+                                         len(text), len(data)))
+
+
+def bench_mapped(n=10**6, path="/tmp/bench_mapped"):
+    """
+    parsing of files holding a list of n integers, as an OpenMath string
+    and as a binary encoded OpenMath object, read into memory against
+    mapped in memory (ParseOMfile, ParseOMstream with mapped True)
+
+    """
+    x = list(range(n))
+    with builtins.open(path + ".xml", "w") as f:
+        OMwriteObject(x, f.write)
+    with builtins.open(path + ".om", "wb") as f:
+        f.write(OMbinary(x))
+    for name, func, fname in [("text", ParseOMstream, path + ".xml"),
+                              ("binary", ParseOMfile, path + ".om")]:
+        a = timed("%s file, read (n=%d)" % (name, n), func, fname)
+        b = timed("%s file, mapped (n=%d)" % (name, n),
+                  lambda: func(fname, mapped=True))
+        assert a == b == x
+        peak("%s file, read memory" % name, func, fname)
+        peak("%s file, mapped memory" % name,
+             lambda: func(fname, mapped=True))
+        os.remove(fname)
+
+
+def held(label, func):
+    """
+    prints the memory still allocated by func once it has returned
+
+    """
+    tracemalloc.start()
+    result = func()
+    print("%-40s %10.1f MB" % (label, tracemalloc.get_traced_memory()[0] / 1e6))
+    tracemalloc.stop()
+    return result
+
+
+def bench_matrix_memory(n=2000):
+    """
+    memory held by an n x n integer matrix, as lists of Python ints against
+    the array backed Matrix
+
+    """
+    rows = lambda: [list(range(i*n, (i+1)*n)) for i in range(n)]
+    held("matrix, lists of ints (n=%d)" % n, rows)
+    held("matrix, Matrix (n=%d)" % n, lambda: Matrix(rows()))
+
+
+def bench_matmul(n=200):
+    """
+    product of two n x n integer matrices, in pure Python (blocked)
+    and with NumPy when it is installed
+
+    """
+    import linalg_func
+    a = Matrix([list(range(i*n, (i+1)*n)) for i in range(n)])
+    b = linalg_func.transpose(a)
+    numpy = linalg_func.numpy
+    linalg_func.numpy = None
+    try:
+        p = timed("matrix product, pure Python (n=%d)" % n, lambda: a * b)
+    finally:
+        linalg_func.numpy = numpy
+    if numpy is not None:
+        q = timed("matrix product, NumPy (n=%d)" % n, lambda: a * b)
+        assert p == q
+    timed("matrix determinant, Bareiss (n=%d)" % (n // 4),
+          linalg_func.determinant, Matrix(
+              [[(i * j + 1) % 7 for j in range(n // 4)] for i in range(n // 4)]))
+
+
+def bench_nary_times(n=2000, bits=2000):
+    """
+    product of n random integers of the given size, folding from the
+    left against the balanced reduction of arith1.times
+
+    """
+    import functools, operator, random
+    values = [random.getrandbits(bits) for _ in range(n)]
+    a = timed("times, left fold (n=%d, %d bits)" % (n, bits),
+              functools.reduce, operator.mul, values, 1)
+    b = timed("times, balanced (n=%d, %d bits)" % (n, bits),
+              oms_arith1_times, values)
+    assert a == b
+
+
+def factorialFold(n):
+    """
+    factorial as it was, a left fold of the product of 1..n
+
+    """
+    import functools, operator
+    return functools.reduce(operator.mul, range(1, n+1), 1)
+
+
+def bench_factorial(sizes=(10**5, 10**6)):
+    """
+    n! by the left fold it was computed with, by the prime swing algorithm
+    (factorial) and by math.factorial
+
+    """
+    import math
+    for n in sizes:
+        a = timed("factorial, left fold (n=%d)" % n, factorialFold, n)
+        b = timed("factorial, prime swing (n=%d)" % n, factorial, n)
+        c = timed("factorial, math.factorial (n=%d)" % n, math.factorial, n)
+        assert a == b == c
+
+
+def bench_memo(n=5000, repeat=20):
+    """
+    evaluation of a document applying factorial to n repeat times, with
+    and without the memoization of symbol applications
+
+    """
+    import omparse
+    fact = '<OMA><OMS cd="integer1" name="factorial"/><OMI>%d</OMI></OMA>' % n
+    doc = '<OMOBJ><OMA><OMS cd="arith1" name="plus"/>%s</OMA></OMOBJ>' \
+          % (fact * repeat)
+    max_entries = omparse.memo.max_entries
+    omparse.memo.max_entries = 0
+    try:
+        a = timed("repeated factorial, no memo (x%d)" % repeat,
+                  ParseOMstring, doc)
+    finally:
+        omparse.memo.max_entries = max_entries
+    omparse.memo.clear()
+    b = timed("repeated factorial, memo (x%d)" % repeat, ParseOMstring, doc)
+    assert a == b
+
+
+#######################
+#   benchmark suite   #
+#######################
+
+def intListDoc(n):
+    return OMtext(list(range(n)))
+
+
+def matrixDoc(n):
+    return OMtext(Matrix([MatrixRow(list(range(i*n, (i+1)*n)))
+                          for i in range(n)]))
+
+
+def deepNestDoc(n):
+    return '<OMOBJ>' + deepPlusString(n) + '</OMOBJ>'
+
+
+def sumLambdaDoc(n):
+    return ('<OMOBJ><OMA><OMS cd="arith1" name="sum"/>'
+            '<OMA><OMS cd="interval1" name="integer_interval"/>'
+            '<OMI>1</OMI><OMI>%d</OMI></OMA>%s</OMA></OMOBJ>'
+            % (n, ABS_LAMBDA))
+
+
+def factorialDoc(n):
+    return ('<OMOBJ><OMA><OMS cd="integer1" name="factorial"/>'
+            '<OMI>%d</OMI></OMA></OMOBJ>' % n)
+
+
+# workloads of the suite: name -> (function returning the OM string of
+# the workload of a size, size)
+SUITE_WORKLOADS = {
+    'int_list'      : (intListDoc, 10**5),
+    'matrix'        : (matrixDoc, 200),
+    'deep_nest'     : (deepNestDoc, 10**4),
+    'sum_lambda'    : (sumLambdaDoc, 10**6),
+    'factorial'     : (factorialDoc, 2 * 10**4),
+}
+
+# requests sent to the server, one at a time for the latency and
+# pipelined for the throughput
+SERVER_REQUESTS = 1000
+
+
+def measure(func, repeat=5):
+    """
+    returns the statistics of the time (seconds) of a call of func:
+    func is called number times in each of repeat runs, number being
+    chosen so that a run lasts at least 0.2 s (see timeit.Timer.autorange)
+
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    times = [t / number for t in timer.repeat(repeat, number)]
+    return {'min'       : min(times),
+            'median'    : statistics.median(times),
+            'mean'      : statistics.mean(times),
+            'stdev'     : statistics.stdev(times) if repeat > 1 else 0.0,
+            'runs'      : repeat,
+            'number'    : number}
+
+
+def latencies(times):
+    """
+    returns the statistics of the list of latencies times (seconds)
+
+    """
+    times = sorted(times)
+    return {'p50'       : percentile(times, 50),
+            'p95'       : percentile(times, 95),
+            'p99'       : percentile(times, 99),
+            'mean'      : statistics.mean(times),
+            'max'       : times[-1],
+            'requests'  : len(times)}
+
+
+class memoDisabled:
+    """
+    returns a context in which symbol applications are not memoized,
+    so that every run of a benchmark evaluates its workload
+
+    """
+    def __enter__(self):
+        self.max_entries = memo.max_entries
+        memo.max_entries = 0
+        memo.clear()
+
+    def __exit__(self, *exc):
+        memo.max_entries = self.max_entries
+
+
+class LocalServer:
+    """
+    returns a context running an OMServer on a free local port, in a
+    thread, evaluating in threads without result cache
+    (the context value is the server)
+
+    """
+    def __enter__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       daemon=True)
+        self.thread.start()
+        self.server = OMServer('localhost', 0, cache_size=0,
+                               executor='thread')
+        asyncio.run_coroutine_threadsafe(self.server.start(),
+                                         self.loop).result()
+        return self.server
+
+    def __exit__(self, *exc):
+        asyncio.run_coroutine_threadsafe(self.server.stop(),
+                                         self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+def corpus(directory=None):
+    """
+    returns the list of the contents (bytes) of the OM files of directory
+    (tst by default)
+
+    """
+    if directory is None:
+        directory = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 'tst')
+    documents = []
+    for name in sorted(os.listdir(directory)):
+        with builtins.open(os.path.join(directory, name), 'rb') as f:
+            documents.append(f.read())
+    return documents
+
+
+def suiteWorkload(name, doc, directory, repeat):
+    """
+    returns the results of the suite for the workload name, given by the
+    OM string doc: parsing (ParseOMstring, which evaluates), conversion
+    to OM elements (OMobject), pretty printing (OMprettystring) and
+    processing as a file (process)
+
+    """
+    value = ParseOMstring(doc)
+    element = OMobject(value)
+    fileIN = os.path.join(directory, name + '.xml')
+    fileOUT = os.path.join(directory, name + '.out.xml')
+    with builtins.open(fileIN, 'w') as f:
+        f.write(doc)
+    return {'parse'         : measure(lambda: ParseOMstring(doc), repeat),
+            'omobject'      : measure(lambda: OMobject(value), repeat),
+            'prettystring'  : measure(lambda: OMprettystring(element, 0),
+                                      repeat),
+            'process'       : measure(lambda: process(fileIN, fileOUT),
+                                      repeat)}
+
+
+def suiteServer(documents, requests=SERVER_REQUESTS):
+    """
+    returns the results of the suite for a local server answering the
+    documents (bytes) in turn: latency of requests sent one at a time,
+    throughput of requests pipelined on one connection
+
+    """
+    documents = [documents[i % len(documents)] for i in range(requests)]
+    with LocalServer() as server:
+        times = []
+        sock = socket.create_connection((server.host, server.port))
+        try:
+            for doc in documents:
+                start = time.perf_counter()
+                sendFrame(sock, doc)
+                recvFrame(sock)
+                times.append(time.perf_counter() - start)
+        finally:
+            sock.close()
+        start = time.perf_counter()
+        evaluate_many(documents, server.host, server.port)
+        seconds = time.perf_counter() - start
+    return {'latency'       : latencies(times),
+            'throughput'    : {'requests_per_second' : requests / seconds,
+                               'requests'            : requests,
+                               'seconds'             : seconds}}
+
+
+def gitCommit():
+    """
+    returns the commit the benchmarks run on, None if it is unknown
+
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def suite(workloads=None, repeat=5, server=True):
+    """
+    runs the benchmark suite on the workloads named (all the ones of
+    SUITE_WORKLOADS if None) and on a local server if server is True,
+    prints the results and returns them as a dictionary:
+
+        {'meta' : {...}, 'results' : {'workload/operation' : {...}}}
+
+    every time is in seconds, symbol applications are not memoized
+
+    """
+    import linalg_func
+    if workloads is None:
+        workloads = list(SUITE_WORKLOADS)
+    results = {}
+    directory = tempfile.mkdtemp(prefix='omsuite-')
+    try:
+        with memoDisabled():
+            for name in workloads:
+                make, size = SUITE_WORKLOADS[name]
+                measured = suiteWorkload(name, make(size), directory, repeat)
+                for operation, stats in measured.items():
+                    key = "%s/%s" % (name, operation)
+                    results[key] = dict(stats, size=size)
+                    print("%-40s %10.3f ms" % (key, stats['median'] * 1000))
+            if server:
+                for operation, stats in suiteServer(corpus()).items():
+                    results["server/" + operation] = stats
+                latency = results["server/latency"]
+                print("%-40s %10.3f / %.3f / %.3f ms"
+                      % ("server/latency p50 / p95 / p99",
+                         latency['p50'] * 1000, latency['p95'] * 1000,
+                         latency['p99'] * 1000))
+                print("%-40s %10.0f requests/s"
+                      % ("server/throughput", results["server/throughput"]
+                         ['requests_per_second']))
+    finally:
+        shutil.rmtree(directory)
+    meta = {'commit'    : gitCommit(),
+            'python'    : platform.python_version(),
+            'platform'  : platform.platform(),
+            'numpy'     : linalg_func.numpy.__version__
+                          if linalg_func.numpy is not None else None,
+            'date'      : time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'repeat'    : repeat}
+    return {'meta' : meta, 'results' : results}
+
+
+def suiteTime(stats):
+    """
+    returns the time (seconds) of a result of the suite, compared between
+    runs: the median time, the median latency or the time per request
+
+    """
+    if 'median' in stats:
+        return stats['median']
+    if 'p50' in stats:
+        return stats['p50']
+    return 1 / stats['requests_per_second']
+
+
+def compare(old, new, threshold=0.05):
+    """
+    prints the ratio of the times of the suite results new to old
+    (dictionaries returned by suite), marking the ones more than
+    threshold slower or faster
+    returns the number of slower results
+
+    """
+    slower = 0
+    for key, stats in new['results'].items():
+        if not key in old['results']:
+            continue
+        ratio = suiteTime(stats) / suiteTime(old['results'][key])
+        mark = ''
+        if ratio > 1 + threshold:
+            mark = 'slower'
+            slower += 1
+        elif ratio < 1 - threshold:
+            mark = 'faster'
+        print("%-40s %10.3f x  %s" % (key, ratio, mark))
+    return slower
+
+
+def main(args=()):
+    """
+    runs the benchmarks from the command line, see the module documentation
+    without arguments, compares the implementations of the operations
+
+    """
+    args = list(args)
+    if not args:
+        bench_lambda_sum()
+        bench_interval_sum()
+        bench_matrix_print()
+        bench_serialize()
+        bench_encode()
+        bench_stream_parse()
+        bench_deep()
+        bench_binary()
+        bench_mapped()
+        bench_matrix_memory()
+        bench_matmul()
+        bench_nary_times()
+        bench_factorial()
+        bench_memo()
+        return 0
+    command = args.pop(0)
+    if command == 'compare' and len(args) == 2:
+        with builtins.open(args[0]) as f:
+            old = json.load(f)
+        with builtins.open(args[1]) as f:
+            new = json.load(f)
+        return 1 if compare(old, new) else 0
+    if command == 'suite':
+        repeat = 5
+        output = None
+        unknown = []
+        while args and args[0].startswith('-'):
+            option = args.pop(0)
+            if option == '-r' and args and args[0].isdigit():
+                repeat = int(args.pop(0))
+            elif option == '-o' and args:
+                output = args.pop(0)
+            else:
+                unknown.append(option)
+                break
+        unknown += [name for name in args if not name in SUITE_WORKLOADS]
+        if not unknown:
+            results = suite(args or None, repeat)
+            if output is not None:
+                with builtins.open(output, 'w') as f:
+                    json.dump(results, f, indent=2)
+            return 0
+    print(__doc__)
+    return 2
+
+
+######################
+#   run benchmarks   #
+######################
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,459 @@
+"""
+
+module contains the matrix type and the pure mathematical functions
+on matrices: arith1 operations (plus, minus, times, unary_minus, power)
+applied to matrices, and transpose, determinant and identity from the
+linalg cds
+
+the arith1 operations are the operators of Matrix, so the functions of
+arith_func apply to matrices as they are
+
+"""
+
+###############
+#   imports   #
+###############
+
+import array
+import operator
+from fractions import Fraction
+
+try:
+    import numpy
+except ImportError:
+    numpy = None    # matrices are computed in pure Python
+
+
+###############
+#   classes   #
+###############
+
+class Matrix:
+    """
+    returns a matrix given the list of its rows (MatrixRow or lists)
+
+    the cells are kept row after row in one buffer: an array of 64 bit
+    integers (dtype 'int64') or floats ('float64') when all the cells are
+    such numbers, a list otherwise ('object')
+
+    """
+    __slots__ = ('data', 'shape', 'dtype')
+
+    def __init__ (self, ls):
+        rows = [r if isinstance(r, MatrixRow) else MatrixRow(r) for r in ls]
+        ncols = len(rows[0]) if rows else 0
+        if any(not len(r) == ncols for r in rows):
+            raise ValueError("matrix rows of different lengths")
+        dtypes = set(r.dtype for r in rows)
+        if len(dtypes) == 1 and not 'object' in dtypes:
+            self.dtype = dtypes.pop()
+            self.data = array.array(TYPECODES[self.dtype])
+            for r in rows:
+                self.data.extend(r.data)
+        else:
+            self.dtype = 'object' if rows else 'int64'
+            self.data = [x for r in rows for x in r] if rows \
+                        else array.array('q')
+        self.shape = (len(rows), ncols)
+
+    @property
+    def rows(self):
+        """
+        returns the list of the rows, views on the buffer
+
+        """
+        return [self.row(i) for i in range(self.shape[0])]
+
+    def row(self, i):
+        """
+        returns row i, a view on the buffer (a copy for an 'object' matrix)
+
+        """
+        n = self.shape[1]
+        data = self.data
+        if not self.dtype == 'object':
+            data = memoryview(data)
+        return rowView(data[i*n:(i+1)*n], self.dtype)
+
+    def cell(self, i, j):
+        return self.data[i*self.shape[1] + j]
+
+    def tolist(self):
+        """
+        returns the list of the rows, each a list of values
+
+        """
+        return [r.tolist() for r in self.rows]
+
+    def asarray(self):
+        """
+        returns the matrix as a NumPy array sharing the buffer
+        (a copy for an 'object' matrix), None if NumPy is not installed
+
+        """
+        if numpy is None:
+            return None
+        if self.dtype == 'object':
+            return numpy.array(self.data, dtype=object).reshape(self.shape)
+        return numpy.frombuffer(self.data, dtype=self.dtype) \
+                    .reshape(self.shape)
+
+    # arith1 operations
+
+    def __add__(self, other):
+        if isinstance(other, Matrix):
+            return matrixPlus(self, other)
+        return NotImplemented
+
+    def __sub__(self, other):
+        if isinstance(other, Matrix):
+            return matrixMinus(self, other)
+        return NotImplemented
+
+    def __mul__(self, other):
+        if isinstance(other, Matrix):
+            return matrixTimes(self, other)
+        if isScalar(other):
+            return matrixScale(self, other)
+        return NotImplemented
+
+    def __rmul__(self, other):
+        if isScalar(other):
+            return matrixScale(self, other)
+        return NotImplemented
+
+    def __neg__(self):
+        return matrixScale(self, -1)
+
+    def __pow__(self, n):
+        if isinstance(n, int) and not isinstance(n, bool):
+            return matrixPower(self, n)
+        return NotImplemented
+
+    def __eq__ (self,other):
+        if isinstance(other,self.__class__):
+            return self.shape == other.shape and \
+                   list(self.data) == list(other.data)
+
+    def __repr__(self):
+        return "Matrix(%r)" % self.tolist()
+
+
+class MatrixRow:
+    """
+    returns a matrix row given the list of the values in that row
+
+    the values are kept in an array of 64 bit integers or floats when
+    they all are such numbers (see Matrix)
+
+    """
+    __slots__ = ('data', 'dtype')
+
+    def __init__(self,ls):
+        self.data, self.dtype = packCells(ls)
+
+    @property
+    def cells(self):
+        return self.data
+
+    def tolist(self):
+        return list(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __getitem__(self, i):
+        return self.data[i]
+
+    def __eq__ (self,other):
+        if isinstance(other,self.__class__):
+            return list(self.data) == list(other.data)
+
+    def __repr__(self):
+        return "MatrixRow(%r)" % self.tolist()
+
+
+########################################
+#   auxiliary functions & constructs   #
+########################################
+
+# array typecode of each numeric dtype
+TYPECODES = { 'int64' : 'q', 'float64' : 'd' }
+
+INT64_MIN = -2**63
+INT64_MAX = 2**63 - 1
+
+# number of columns of the right operand multiplied at once in
+# the pure Python matrix product
+BLOCK = 64
+
+
+def packCells(ls):
+    """
+    returns (buffer, dtype) holding the values of the list ls
+
+    """
+    ls = list(ls)
+    types = set(map(type, ls))
+    if types <= {int} and \
+       all(INT64_MIN <= x <= INT64_MAX for x in ls):
+        return array.array('q', ls), 'int64'
+    if types == {float}:
+        return array.array('d', ls), 'float64'
+    return ls, 'object'
+
+
+def rowView(data, dtype):
+    """
+    returns a MatrixRow over data (no copy)
+
+    """
+    row = MatrixRow.__new__(MatrixRow)
+    row.data = data
+    row.dtype = dtype
+    return row
+
+
+def newMatrix(data, dtype, shape):
+    """
+    returns the matrix of the given shape over the buffer data (no copy)
+
+    """
+    m = Matrix.__new__(Matrix)
+    m.data = data
+    m.dtype = dtype
+    m.shape = shape
+    return m
+
+
+def packMatrix(values, shape):
+    """
+    returns the matrix of the given shape holding the values (row after row)
+
+    """
+    data, dtype = packCells(values)
+    return newMatrix(data, dtype, shape)
+
+
+def fromArray(a):
+    """
+    returns the matrix holding the 2 dimensional NumPy array a
+
+    """
+    if a.dtype == numpy.int64 or a.dtype == numpy.float64:
+        data = array.array(TYPECODES[a.dtype.name])
+        data.frombytes(numpy.ascontiguousarray(a).tobytes())
+        return newMatrix(data, a.dtype.name, a.shape)
+    return packMatrix(a.ravel().tolist(), a.shape)
+
+
+def isScalar(x):
+    return isinstance(x, (int, float, complex, Fraction))
+
+
+def magnitude(m):
+    """
+    returns the largest absolute value of a cell of the 'int64' matrix m
+
+    """
+    if len(m.data) == 0:
+        return 0
+    return max(-min(m.data), max(m.data))
+
+
+def useNumpy(a, b, bound):
+    """
+    returns True if an operation on the matrices a and b can be computed
+    exactly with NumPy: both are numeric, and if both hold integers the
+    results are bounded by bound(magnitude of a, magnitude of b) which
+    must fit in 64 bits
+
+    """
+    if numpy is None or 'object' in (a.dtype, b.dtype):
+        return False
+    if a.dtype == 'int64' and b.dtype == 'int64':
+        return bound(magnitude(a), magnitude(b)) <= INT64_MAX
+    return True
+
+
+def checkShape(a, b):
+    if not a.shape == b.shape:
+        raise ValueError("matrices of different shapes %s and %s"
+                         % (a.shape, b.shape))
+
+
+def checkSquare(m):
+    if not m.shape[0] == m.shape[1]:
+        raise ValueError("matrix of shape %s is not square" % (m.shape,))
+
+
+##########################
+#   arith1 on matrices   #
+##########################
+
+def matrixPlus(a, b):
+    checkShape(a, b)
+    if useNumpy(a, b, operator.add):
+        return fromArray(a.asarray() + b.asarray())
+    return packMatrix(map(operator.add, a.data, b.data), a.shape)
+
+
+def matrixMinus(a, b):
+    checkShape(a, b)
+    if useNumpy(a, b, operator.add):
+        return fromArray(a.asarray() - b.asarray())
+    return packMatrix(map(operator.sub, a.data, b.data), a.shape)
+
+
+def matrixScale(m, k):
+    """
+    returns the matrix m multiplied by the scalar k
+
+    """
+    if numpy is not None and not m.dtype == 'object' and \
+       (type(k) == float or
+        type(k) == int and abs(k) * magnitude(m) <= INT64_MAX):
+        return fromArray(m.asarray() * k)
+    return packMatrix([k * x for x in m.data], m.shape)
+
+
+def matrixTimes(a, b):
+    """
+    returns the matrix product of a and b
+
+    """
+    n, m = a.shape
+    if not m == b.shape[0]:
+        raise ValueError("matrices of shapes %s and %s cannot be multiplied"
+                         % (a.shape, b.shape))
+    p = b.shape[1]
+    if useNumpy(a, b, lambda x, y: m * x * y):
+        return fromArray(numpy.matmul(a.asarray(), b.asarray()))
+    rows = [a.data[i*m:(i+1)*m] for i in range(n)]
+    columns = [b.data[j::p] for j in range(p)]
+    out = [0] * (n*p)
+    # a block of columns of b is multiplied by every row of a in turn
+    for j0 in range(0, p, BLOCK):
+        block = columns[j0:j0+BLOCK]
+        for i, row in enumerate(rows):
+            k = i*p + j0
+            for column in block:
+                out[k] = sum(map(operator.mul, row, column))
+                k += 1
+    return packMatrix(out, (n, p))
+
+
+def matrixPower(m, n):
+    """
+    returns the square matrix m to the power of the integer n >= 0
+
+    """
+    checkSquare(m)
+    if n < 0:
+        raise ValueError("negative power of a matrix")
+    result = identity(m.shape[0])
+    while n:
+        if n & 1:
+            result = matrixTimes(result, m)
+        n >>= 1
+        if n:
+            m = matrixTimes(m, m)
+    return result
+
+
+########################
+#   linalg1, linalg5   #
+########################
+
+def transpose(m):
+    n, p = m.shape
+    if m.dtype == 'object':
+        data = []
+    else:
+        data = array.array(TYPECODES[m.dtype])
+    for j in range(p):
+        data.extend(m.data[j::p])
+    return newMatrix(data, m.dtype, (p, n))
+
+
+def determinant(m):
+    """
+    returns the determinant of the square matrix m, exact for integer
+    and rational cells (Bareiss elimination), by LU decomposition for
+    floating point cells
+
+    """
+    checkSquare(m)
+    n = m.shape[0]
+    if n == 0:
+        return 1
+    if m.dtype == 'float64' and numpy is not None:
+        return float(numpy.linalg.det(m.asarray()))
+    rows = m.tolist()
+    exact = all(isinstance(x, (int, Fraction)) for x in m.data)
+    if not exact:
+        return floatDeterminant(rows)
+    sign = 1
+    previous = 1
+    for k in range(n-1):
+        if rows[k][k] == 0:
+            # swap with a row below with a non zero pivot
+            for i in range(k+1, n):
+                if not rows[i][k] == 0:
+                    rows[k], rows[i] = rows[i], rows[k]
+                    sign = -sign
+                    break
+            else:
+                return 0
+        pivot = rows[k][k]
+        for i in range(k+1, n):
+            ri = rows[i]
+            rk = rows[k]
+            for j in range(k+1, n):
+                value = ri[j] * pivot - ri[k] * rk[j]
+                # the division is exact
+                ri[j] = value // previous if type(value) == int and \
+                        type(previous) == int else value / previous
+        previous = pivot
+    return sign * rows[n-1][n-1]
+
+
+def floatDeterminant(rows):
+    """
+    returns the determinant of the square matrix given by its rows,
+    by Gaussian elimination with partial pivoting
+
+    """
+    n = len(rows)
+    det = 1
+    for k in range(n):
+        i = max(range(k, n), key=lambda i: abs(rows[i][k]))
+        if rows[i][k] == 0:
+            return 0.0
+        if not i == k:
+            rows[k], rows[i] = rows[i], rows[k]
+            det = -det
+        pivot = rows[k][k]
+        det *= pivot
+        for i in range(k+1, n):
+            f = rows[i][k] / pivot
+            if f:
+                ri = rows[i]
+                rk = rows[k]
+                for j in range(k+1, n):
+                    ri[j] -= f * rk[j]
+    return det
+
+
+def identity(n):
+    """
+    returns the n x n identity matrix
+
+    """
+    data = array.array('q', bytes(8 * n * n))
+    for i in range(n):
+        data[i*(n+1)] = 1
+    return newMatrix(data, 'int64', (n, n))
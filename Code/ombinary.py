@@ -0,0 +1,538 @@
+"""
+
+Module contains methods for converting between Python objects and the
+binary encoding of OpenMath objects
+
+every OpenMath construct is a token (one byte) possibly followed by its
+contents; the token identifies the construct in its 5 low bits, bit 0x80
+marks the long form (4 byte lengths or values, instead of 1 byte), bit
+0x40 marks a reference to a symbol, variable or string already met in the
+object (followed by its index in order of first occurrence) and bit 0x20
+marks a construct with an id (not supported)
+
+    OMI         1 small integer (signed byte, or 4 bytes if long)
+                2 big integer (length, sign '+' or '-', base byte 0 for
+                  decimal or 0x40 for hexadecimal digits, digits)
+    OMF         3 IEEE 754 double, big-endian
+    OMV         5 length, name
+    OMSTR       6 length, ISO-8859-1 characters
+                7 length (bytes), UTF-16 big-endian characters
+    OMS         8 length of cd, length of name, cd, name
+    OMA         16 begin, 17 end
+    OME         22 begin, 23 end
+    OMOBJ       24 begin, 25 end
+    OMBIND      26 begin, 27 end
+    OMBVAR      28 begin, 29 end
+
+numbers are converted to and from Python numbers directly, without
+going through their text representation
+
+"""
+
+###############
+#   imports   #
+###############
+
+import fractions
+import struct
+import xml.etree.ElementTree as ET
+Element = ET.Element
+
+from omparse import *
+from omput import OMencoders, OMInt, intText
+
+##############
+#   tokens   #
+##############
+
+TOKEN_INT           = 1
+TOKEN_BIGINT        = 2
+TOKEN_FLOAT         = 3
+TOKEN_VARIABLE      = 5
+TOKEN_STRING8       = 6
+TOKEN_STRING16      = 7
+TOKEN_SYMBOL        = 8
+TOKEN_APP           = 16
+TOKEN_APP_END       = 17
+TOKEN_ERROR         = 22
+TOKEN_ERROR_END     = 23
+TOKEN_OBJECT        = 24
+TOKEN_OBJECT_END    = 25
+TOKEN_BIND          = 26
+TOKEN_BIND_END      = 27
+TOKEN_BVAR          = 28
+TOKEN_BVAR_END      = 29
+
+LONG = 0x80
+SHARED = 0x40
+IDENTIFIED = 0x20
+KIND = 0x1f
+
+# base byte of a big integer, and the base of its digits
+# (the values 10 and 16 of some implementations are accepted too)
+BIGINT_BASES = { 0 : 10, 0x40 : 16, 10 : 10, 16 : 16 }
+BIGINT_DECIMAL = 0
+
+INT32 = struct.Struct('>i')
+UINT32 = struct.Struct('>I')
+DOUBLE = struct.Struct('>d')
+
+# OM element tag of each token opening (or closing) an element
+BEGIN_TAGS = {  TOKEN_APP       : 'OMA',
+                TOKEN_ERROR     : 'OME',
+                TOKEN_BIND      : 'OMBIND',
+                TOKEN_BVAR      : 'OMBVAR'
+             }
+END_TOKENS = {  TOKEN_APP_END, TOKEN_ERROR_END, TOKEN_BIND_END,
+                TOKEN_BVAR_END }
+END_OF = {      'OMA'           : TOKEN_APP_END,
+                'OME'           : TOKEN_ERROR_END,
+                'OMBIND'        : TOKEN_BIND_END,
+                'OMBVAR'        : TOKEN_BVAR_END
+         }
+
+
+def isBinary(data):
+    """
+    returns True if data (bytes) is a binary encoded OpenMath object
+
+    """
+    return len(data) > 0 and data[0] & KIND == TOKEN_OBJECT
+
+
+##############
+#   reader   #
+##############
+
+class BinaryReader:
+    """
+    returns a reader of the binary encoded OpenMath object data (bytes
+    or any buffer)
+    parse() evaluates it, as ParseOMroot evaluates an OM element
+
+    elements are only built for the OMBIND and OME constructs, which are
+    evaluated from their whole subtree
+
+    """
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.pos = 0
+        self.symbols = []       # shared constructs, in order of occurrence
+        self.variables = []
+        self.strings = []
+        self.parsed = {}        # parsed value of each symbol (cd, name)
+
+    # low level reading
+
+    def byte(self):
+        if self.pos >= len(self.data):
+            raise ProgramErrorObj("binary_truncated", self.pos)
+        b = self.data[self.pos]
+        self.pos += 1
+        return b
+
+    def bytes(self, n):
+        if self.pos + n > len(self.data):
+            raise ProgramErrorObj("binary_truncated", self.pos)
+        b = self.data[self.pos:self.pos+n]
+        self.pos += n
+        return b
+
+    def length(self, token):
+        if token & LONG:
+            return UINT32.unpack(self.bytes(4))[0]
+        return self.byte()
+
+    def shared(self, token, table):
+        """
+        returns the construct referenced by a token with the shared bit
+
+        """
+        index = self.length(token)
+        if index >= len(table):
+            raise ProgramErrorObj("binary_bad_reference", index)
+        return table[index]
+
+    # constructs
+
+    def integer(self, token):
+        if token & LONG:
+            return INT32.unpack(self.bytes(4))[0]
+        b = self.byte()
+        return b - 256 if b > 127 else b
+
+    def bigInteger(self, token):
+        n = self.length(token)
+        sign = self.byte()
+        code = self.byte()
+        base = BIGINT_BASES.get(code)
+        if base is None:
+            raise ProgramErrorObj("binary_unknown_base", code)
+        digits = str(self.bytes(n), 'ascii')
+        value = textInt(digits) if base == 10 else int(digits, 16)
+        return -value if sign == ord('-') else value
+
+    def string(self, token):
+        kind = token & KIND
+        if token & SHARED:
+            return self.shared(token, self.strings)
+        n = self.length(token)
+        encoding = 'latin-1' if kind == TOKEN_STRING8 else 'utf-16-be'
+        s = str(self.bytes(n), encoding)
+        self.strings.append(s)
+        return s
+
+    def variable(self, token):
+        if token & SHARED:
+            return self.shared(token, self.variables)
+        name = str(self.bytes(self.length(token)), 'utf-8')
+        self.variables.append(name)
+        return name
+
+    def symbol(self, token):
+        if token & SHARED:
+            return self.shared(token, self.symbols)
+        if token & LONG:
+            ncd, nname = UINT32.unpack(self.bytes(4))[0], \
+                         UINT32.unpack(self.bytes(4))[0]
+        else:
+            ncd, nname = self.byte(), self.byte()
+        cd = str(self.bytes(ncd), 'utf-8')
+        name = str(self.bytes(nname), 'utf-8')
+        self.symbols.append((cd, name))
+        return cd, name
+
+    def leaf(self, token):
+        """
+        reads the construct of a token that does not open an element
+        returns (tag, contents)
+
+        """
+        kind = token & KIND
+        if kind == TOKEN_INT:
+            return 'OMI', self.integer(token)
+        if kind == TOKEN_BIGINT:
+            return 'OMI', self.bigInteger(token)
+        if kind == TOKEN_FLOAT:
+            return 'OMF', DOUBLE.unpack(self.bytes(8))[0]
+        if kind in (TOKEN_STRING8, TOKEN_STRING16):
+            return 'OMSTR', self.string(token)
+        if kind == TOKEN_VARIABLE:
+            return 'OMV', self.variable(token)
+        if kind == TOKEN_SYMBOL:
+            return 'OMS', self.symbol(token)
+        raise ProgramErrorObj("binary_unknown_token", token)
+
+    def leafElement(self, tag, contents):
+        """
+        returns the OM element for the contents of a leaf construct
+
+        """
+        if tag == 'OMI':
+            return OMInt(contents)
+        if tag == 'OMF':
+            return Element('OMF', {'dec' : repr(contents)})
+        if tag == 'OMSTR':
+            elt = Element('OMSTR')
+            elt.text = contents
+            return elt
+        if tag == 'OMV':
+            return Element('OMV', {'name' : contents})
+        return Element('OMS', {'cd' : contents[0], 'name' : contents[1]})
+
+    def leafValue(self, tag, contents):
+        """
+        returns the python object for the contents of a leaf construct
+
+        """
+        if tag == 'OMS':
+            if not contents in self.parsed:
+                self.parsed[contents] = \
+                    ParseOMS(self.leafElement(tag, contents))
+            return self.parsed[contents]
+        if tag == 'OMV':
+            return ProgramErrorObj("unknown_tag", tag)
+        return contents
+
+    def parse(self):
+        """
+        returns the python object for the binary OpenMath object
+
+        """
+        token = self.byte()
+        if not token & KIND == TOKEN_OBJECT:
+            return ProgramErrorObj("unknown_tag", token)
+        values = [[]]       # values of the children of each open OMA
+        elements = []       # open elements of an OMBIND or OME subtree
+        while True:
+            token = self.byte()
+            kind = token & KIND
+            if token & IDENTIFIED:
+                raise ProgramErrorObj("binary_unsupported_id", token)
+            if elements:
+                # building the subtree of an OMBIND or OME element
+                if kind in BEGIN_TAGS:
+                    elt = Element(BEGIN_TAGS[kind])
+                    elements[-1].append(elt)
+                    elements.append(elt)
+                elif kind in END_TOKENS:
+                    if not END_OF[elements[-1].tag] == kind:
+                        raise ProgramErrorObj("binary_unexpected_end", kind)
+                    elt = elements.pop()
+                    if not elements:
+                        values[-1].append(ParseOMelement(elt))
+                else:
+                    elements[-1].append(self.leafElement(*self.leaf(token)))
+            elif kind == TOKEN_APP:
+                values.append([])
+            elif kind in (TOKEN_BIND, TOKEN_ERROR):
+                elements.append(Element(BEGIN_TAGS[kind]))
+            elif kind == TOKEN_APP_END:
+                if len(values) < 2:
+                    raise ProgramErrorObj("binary_unexpected_end", kind)
+                elts = values.pop()
+                f = elts[0]
+                values[-1].append(f if isinstance(f, OMErrorObj)
+                                  else applySymbol(f, elts[1:]))
+            elif kind == TOKEN_OBJECT_END:
+                if len(values) > 1:
+                    raise ProgramErrorObj("binary_unexpected_end", kind)
+                if values[0]:
+                    return values[0][0]
+                return ProgramErrorObj("nothing_to_parse", 'OMOBJ')
+            elif kind in BEGIN_TAGS or kind in END_TOKENS:
+                raise ProgramErrorObj("unknown_tag", BEGIN_TAGS.get(kind, kind))
+            else:
+                values[-1].append(self.leafValue(*self.leaf(token)))
+
+
+def ParseOMbinary(data):
+    """
+    converts a binary encoded OpenMath object (bytes, or any buffer such
+    as a memory mapped file, read in place) to a python object
+
+    """
+    reader = BinaryReader(data)
+    with reader.data:
+        return reader.parse()
+
+
+##############
+#   writer   #
+##############
+
+class BinaryWriter:
+    """
+    returns a writer of python objects as binary encoded OpenMath objects
+    symbols, variables and strings met more than once are shared
+
+    """
+    def __init__(self):
+        self.out = bytearray()
+        self.symbols = {}
+        self.variables = {}
+        self.strings = {}
+
+    def token(self, kind, n):
+        """
+        writes token kind for a length (or index) n, in long form if needed
+
+        """
+        if n > 255:
+            self.out.append(kind | LONG)
+            self.out += UINT32.pack(n)
+        else:
+            self.out.append(kind)
+            self.out.append(n)
+
+    def share(self, kind, table, key):
+        """
+        writes a reference to key if it was met before and returns True,
+        otherwise records it and returns False
+
+        """
+        index = table.get(key)
+        if index is not None:
+            self.token(kind | SHARED, index)
+            return True
+        table[key] = len(table)
+        return False
+
+    def integer(self, x):
+        if -128 <= x <= 127:
+            self.out.append(TOKEN_INT)
+            self.out.append(x & 0xff)
+        elif -2**31 <= x < 2**31:
+            self.out.append(TOKEN_INT | LONG)
+            self.out += INT32.pack(x)
+        else:
+            digits = intText(abs(x)).encode('ascii')
+            self.token(TOKEN_BIGINT, len(digits))
+            self.out.append(ord('-') if x < 0 else ord('+'))
+            self.out.append(BIGINT_DECIMAL)
+            self.out += digits
+
+    def float(self, x):
+        self.out.append(TOKEN_FLOAT)
+        self.out += DOUBLE.pack(x)
+
+    def string(self, x):
+        if self.share(TOKEN_STRING8, self.strings, x):
+            return
+        try:
+            data = x.encode('latin-1')
+            self.token(TOKEN_STRING8, len(data))
+        except UnicodeEncodeError:
+            data = x.encode('utf-16-be')
+            self.token(TOKEN_STRING16, len(data))
+        self.out += data
+
+    def variable(self, name):
+        if self.share(TOKEN_VARIABLE, self.variables, name):
+            return
+        data = name.encode('utf-8')
+        self.token(TOKEN_VARIABLE, len(data))
+        self.out += data
+
+    def symbol(self, cd, name):
+        if self.share(TOKEN_SYMBOL, self.symbols, (cd, name)):
+            return
+        cd = cd.encode('utf-8')
+        name = name.encode('utf-8')
+        if len(cd) > 255 or len(name) > 255:
+            self.out.append(TOKEN_SYMBOL | LONG)
+            self.out += UINT32.pack(len(cd)) + UINT32.pack(len(name))
+        else:
+            self.out.append(TOKEN_SYMBOL)
+            self.out.append(len(cd))
+            self.out.append(len(name))
+        self.out += cd
+        self.out += name
+
+    def application(self, cd, name, args):
+        self.out.append(TOKEN_APP)
+        self.symbol(cd, name)
+        for arg in args:
+            self.value(arg)
+        self.out.append(TOKEN_APP_END)
+
+    def element(self, elt):
+        """
+        writes an OM element (and its subtree)
+
+        """
+        tag = elt.tag
+        if tag == 'OMI':
+            self.integer(textInt(elt.text))
+        elif tag == 'OMF':
+            self.float(float(elt.get('dec')))
+        elif tag == 'OMSTR':
+            self.string(str(elt.text or ''))
+        elif tag == 'OMV':
+            self.variable(elt.get('name'))
+        elif tag == 'OMS':
+            self.symbol(elt.get('cd'), elt.get('name'))
+        elif tag in END_OF:
+            self.out.append(END_OF[tag] - 1)    # the begin token
+            for child in elt:
+                self.element(child)
+            self.out.append(END_OF[tag])
+        else:
+            raise ProgramErrorObj("unknown_tag", tag)
+
+    def value(self, x):
+        """
+        dispatches the binary writer dependently on the type of x
+
+        """
+        t = type(x)
+        try:
+            writer = resolvedBinaryWriters[t]
+        except KeyError:
+            writer = resolvedBinaryWriters[t] = resolveBinaryWriter(t)
+        if writer is None:
+            raise ProgramErrorObj("unsupported_python_object", x)
+        writer(self, x)
+
+
+def binaryComplex(w, x):
+    real= int(x.real) if ((x.real).is_integer()) else x.real
+    imag= int(x.imag) if ((x.imag).is_integer()) else x.imag
+    w.application('complex1', 'complex_cartesian', (real, imag))
+
+
+def binaryMatrix(w, x):
+    w.out.append(TOKEN_APP)
+    w.symbol('linalg2', 'matrix')
+    for row in x.rows:
+        w.application('linalg2', 'matrixrow', row.cells)
+    w.out.append(TOKEN_APP_END)
+
+
+def binaryError(w, x):
+    w.out.append(TOKEN_ERROR)
+    w.symbol('error', x.name)
+    w.element(x.context)
+    w.out.append(TOKEN_ERROR_END)
+
+
+# binary writer of each Python type, types without one are written
+# through the OM element built by their encoder (see omput.register_encoder)
+binaryWriters = {   int                 : BinaryWriter.integer,
+                    float               : BinaryWriter.float,
+                    str                 : BinaryWriter.string,
+                    bool                : lambda w, x: w.symbol(
+                                            'logic1', 'true' if x else 'false'),
+                    complex             : binaryComplex,
+                    list                : lambda w, x: w.application(
+                                            'list1', 'list', x),
+                    fractions.Fraction  : lambda w, x: w.application(
+                                            'nums1', 'rational',
+                                            (x.numerator, x.denominator)),
+                    Matrix              : binaryMatrix,
+                    IntegerInterval     : lambda w, x: w.application(
+                                            'interval1', 'integer_interval',
+                                            (x.first, x.last)),
+                    OMErrorObj          : binaryError
+                }
+
+# writer found for each type written so far (None if unsupported)
+resolvedBinaryWriters = {}
+
+
+def resolveBinaryWriter(t):
+    """
+    returns the binary writer for the type t: the one registered for t or
+    else for its nearest base class, or a writer of the element built by
+    the OM element converter when one is registered first
+
+    """
+    for base in t.__mro__:
+        if base in binaryWriters:
+            return binaryWriters[base]
+        if base in OMencoders:
+            encoder = OMencoders[base]
+            return lambda w, x: w.element(encoder(x))
+    return None
+
+
+def register_binary_writer(t, writer):
+    """
+    registers writer(binary writer, value) as the binary writer
+    of the Python type t and of its subclasses
+
+    """
+    binaryWriters[t] = writer
+    resolvedBinaryWriters.clear()
+
+
+def OMbinary(x):
+    """
+    returns the binary encoded OpenMath object for x (bytes)
+
+    """
+    w = BinaryWriter()
+    w.out.append(TOKEN_OBJECT)
+    w.value(x)
+    w.out.append(TOKEN_OBJECT_END)
+    return bytes(w.out)
@@ -2,14 +2,32 @@
 
 Network client that connects to a server and sends file contents.
 
+    python omclient.py
+
+asks for files to send, one at a time, and
+
+    python omclient.py load [-c connections] [-n requests] [-r rate]
+                            [-i corpus] [-e expected] [host [port]]
+
+replays the files of corpus (tst) to a server as a load generator,
+checks the results against the files of expected (tst_out) and reports
+the throughput, the latency and the errors (see load_test).
+
 """
 
 ###############
 #   imports   #
 ###############
 
+import itertools
+import math
+import os
 import socket
 import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from omprotocol import *
 
 
 #######################
@@ -43,12 +61,16 @@ def run():
             if not filename:
                 break
             # Read file
-            message = open(filename).read()
+            message = open(filename, 'rb').read()
             # Send data
             print("Sending \"%s\"..." % filename)
-            sock.sendall(message.encode())
+            sendFrame(sock, message)
             # Receive data
-            result = sock.recv(4096).decode()
+            result = recvFrame(sock)
+            if result is None:
+                print("Disconnected from server!")
+                break
+            result = result.decode()
             # Write result to file if required
             if result.startswith("error:"):
                 _, msg = result.split("error:")
@@ -61,7 +83,7 @@ def run():
                     write_to_file(result)
         except (FileNotFoundError, IsADirectoryError):
             print("Please enter a valid filename!")
-        except socket.error:
+        except (socket.error, ProtocolError):
             print("Disconnected from server!")
             break
         except EOFError:
@@ -70,6 +92,54 @@ def run():
     print('Closing socket...')
     sock.close()
 
+def evaluate_many(documents, host='localhost', port=10000, window=64,
+                  batch=1, binary=False):
+    """
+    sends the OpenMath strings (bytes) of the list documents to a server
+    on a single connection, keeping up to window requests in flight,
+    each request carrying batch documents
+    returns the list of the results (strings), in the order of documents
+
+    if binary is True the results are binary encoded OpenMath objects
+    (bytes, see ombinary.ParseOMbinary), and documents may be as well
+
+    """
+    groups = [documents[i:i+batch] for i in range(0, len(documents), batch)]
+    results = [None] * len(groups)
+    sock = socket.create_connection((host, port))
+    try:
+        if binary:
+            sendFrame(sock, encodeMessage(ENCODING, 0, b'binary'))
+            kind, _, answer = decodeMessage(recvFrame(sock))
+            if not kind == ENCODING or not bytes(answer) == b'binary':
+                raise ProtocolError("encoding_refused", bytes(answer))
+        sent = received = 0
+        while received < len(groups):
+            if sent < len(groups) and sent - received < window:
+                if batch == 1:
+                    message = encodeMessage(SINGLE, sent, groups[sent][0])
+                else:
+                    message = encodeMessage(BATCH, sent, groups[sent])
+                sendFrame(sock, message)
+                sent += 1
+                continue
+            payload = recvFrame(sock)
+            if payload is None:
+                raise ProtocolError("connection_closed", received)
+            kind, request_id, answer = decodeMessage(payload)
+            if kind is None:
+                raise ProtocolError(bytes(answer).decode(), received)
+            if kind == SINGLE:
+                answer = [answer]
+            if binary:
+                results[request_id] = [bytes(r) for r in answer]
+            else:
+                results[request_id] = [bytes(r).decode() for r in answer]
+            received += 1
+    finally:
+        sock.close()
+    return [r for group in results for r in group]
+
 def getinput(prompt):
     """
     gets a line of input from stdin and returns the value stripped
@@ -102,9 +172,191 @@ def write_to_file(string):
             break
 
 
+######################
+#   load generator   #
+######################
+
+def load_test(corpus='tst', expected='tst_out', host='localhost',
+              port=10000, connections=8, requests=1000, rate=None):
+    """
+    replays the OM files of the directory corpus to a server, in turn,
+    on connections concurrent connections until requests results have
+    been received, as fast as the server answers or at rate requests
+    per second
+    each result is checked against the file of the same name in the
+    directory expected, if there is one (see sameOM)
+
+    returns a report (dictionary) of the results 'received', of the ones
+    that were 'ok', 'mismatched' or 'errors' (an "error:" result, a lost
+    connection), of the 'seconds' taken, the 'throughput' (results per
+    second) and the latency 'p50', 'p95', 'p99' and 'max' (seconds)
+
+    at a given rate, the latency of a request is counted from the time
+    it was due, so a server falling behind shows in the latencies
+
+    """
+    files = corpusFiles(corpus, expected)
+    if not files:
+        raise ValueError("no OM files in %s" % corpus)
+    return loadTest(files, host, port, connections, requests, rate)
+
+
+def corpusFiles(corpus, expected):
+    """
+    returns the list of (name, OM file content, expected result or None)
+    for the files of the directory corpus
+
+    """
+    files = []
+    for name in sorted(os.listdir(corpus)):
+        fname = os.path.join(corpus, name)
+        if not os.path.isfile(fname):
+            continue
+        with open(fname, 'rb') as f:
+            document = f.read()
+        result = None
+        if expected is not None and \
+           os.path.isfile(os.path.join(expected, name)):
+            with open(os.path.join(expected, name), 'rb') as f:
+                result = f.read()
+        files.append((name, document, result))
+    return files
+
+
+def loadTest(files, host, port, connections, requests, rate):
+    """
+    runs load_test for the list files of corpusFiles, on a thread per
+    connection
+
+    """
+    report = {'received' : 0, 'ok' : 0, 'mismatched' : 0, 'errors' : 0}
+    times = []
+    # requests are taken in turn by the connections, with their index
+    jobs = enumerate(itertools.islice(itertools.cycle(files), requests))
+    lock = threading.Lock()     # guards jobs, report and times
+    start = time.perf_counter()
+    threads = [threading.Thread(target=loadConnection,
+                                args=(host, port, jobs, start, rate,
+                                      report, times, lock))
+               for _ in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    times.sort()
+    report['seconds'] = seconds
+    report['throughput'] = report['received'] / seconds
+    for p in (50, 95, 99):
+        report['p%d' % p] = percentile(times, p)
+    report['max'] = times[-1] if times else None
+    return report
+
+
+def loadConnection(host, port, jobs, start, rate, report, times, lock):
+    """
+    sends the requests of jobs on a new connection, one at a time,
+    and records their results in report and their latency in times
+    (jobs, report and times are shared with the other connections,
+    under lock)
+
+    """
+    try:
+        sock = socket.create_connection((host, port))
+    except OSError:
+        with lock:
+            report['errors'] += 1
+        return
+    try:
+        while True:
+            with lock:
+                job = next(jobs, None)
+            if job is None:
+                break
+            i, (name, document, expected) = job
+            if rate:
+                due = start + i / rate
+                time.sleep(max(0, due - time.perf_counter()))
+            else:
+                due = time.perf_counter()
+            sendFrame(sock, document)
+            result = recvFrame(sock)
+            if result is None:
+                raise ProtocolError("connection_closed", name)
+            latency = time.perf_counter() - due
+            with lock:
+                times.append(latency)
+                report['received'] += 1
+                if result.startswith(b"error:"):
+                    report['errors'] += 1
+                elif expected is None or sameOM(result, expected):
+                    report['ok'] += 1
+                else:
+                    report['mismatched'] += 1
+    except (OSError, ProtocolError):
+        with lock:
+            report['errors'] += 1   # the other connections take the requests
+    finally:
+        sock.close()
+
+
+def sameOM(a, b):
+    """
+    returns True if the OpenMath strings (bytes) a and b are the same
+    up to white space, comments and the order of attributes
+
+    """
+    try:
+        return ET.canonicalize(a.decode('utf-8'), strip_text=True) == \
+               ET.canonicalize(b.decode('utf-8'), strip_text=True)
+    except (ET.ParseError, UnicodeDecodeError):
+        return a == b
+
+
+def percentile(values, p):
+    """
+    returns the p-th percentile (nearest rank) of the sorted list values
+
+    """
+    if not values:
+        return None
+    return values[max(0, math.ceil(len(values) * p / 100) - 1)]
+
+
+def load(args):
+    """
+    runs load_test from the command line arguments args (see the module
+    documentation), prints its report
+
+    """
+    options = {}
+    names = {'-c' : 'connections', '-n' : 'requests', '-r' : 'rate',
+             '-i' : 'corpus', '-e' : 'expected'}
+    while args and args[0] in names:
+        name = names[args.pop(0)]
+        value = args.pop(0)
+        options[name] = value if name in ('corpus', 'expected') \
+                        else float(value) if name == 'rate' else int(value)
+    if args:
+        options['host'] = args.pop(0)
+    if args:
+        options['port'] = int(args.pop(0))
+    report = load_test(**options)
+    print("%d results in %.3f s, %.0f results/s"
+          % (report['received'], report['seconds'], report['throughput']))
+    if report['received']:
+        print("latency p50 %.3f ms, p95 %.3f ms, p99 %.3f ms, max %.3f ms"
+              % tuple(report[k] * 1000 for k in ('p50', 'p95', 'p99', 'max')))
+    print("%d ok, %d mismatched, %d errors"
+          % (report['ok'], report['mismatched'], report['errors']))
+    return 1 if report['mismatched'] or not report['received'] else 0
+
+
 #################
 #  Run client   #
 #################
 
 if __name__ == '__main__':
+    if sys.argv[1:2] == ['load']:
+        sys.exit(load(sys.argv[2:]))
     run()
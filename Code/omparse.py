@@ -9,36 +9,49 @@ Module contains methods for converting OM strings into Python objects
 #   imports   #
 ###############
 
+from collections import OrderedDict
+from contextlib import contextmanager
 from fractions import Fraction
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
 import arith_func
 from arith_func import *
+from linalg_func import Matrix, MatrixRow, transpose, determinant, identity
 
 ###############
 #   classes   #
 ###############
 
-class Matrix:
+class IntegerInterval:
     """
-    returns a matrix given the list of its rows
+    returns the interval of all the integers from first to last (included)
+    the integers are produced on demand, the interval is never materialised
 
     """
-    def __init__ (self, ls):
-        self.rows = ls
+    def __init__(self, first, last):
+        self.first = first
+        self.last = last
+        self.range = range(first, last+1)
+    def __len__(self):
+        return len(self.range)
+    def __iter__(self):
+        return iter(self.range)
+    def __contains__(self, x):
+        return x in self.range
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            r = self.range[i]
+            if not r.step == 1:
+                return list(r)
+            return IntegerInterval(r.start, r.stop-1)
+        return self.range[i]
     def __eq__ (self,other):
         if isinstance(other,self.__class__):
-            return self.rows == other.rows
-
-
-class MatrixRow:
-    """
-    returns a matrix row given the list of the values in that row
-
-    """
-    def __init__(self,ls):
-        self.cells = ls
-    def __eq__ (self,other):
-        if isinstance(other,self.__class__):
-            return self.cells == other.cells
+            return self.range == other.range
+    def __repr__(self):
+        return "IntegerInterval(%d, %d)" % (self.first, self.last)
 
 
 class OMErrorObj:
@@ -99,12 +112,31 @@ def oms_linalg2_matrix(ls):
     m = Matrix(ls)
     return m
 
-# linalg2.matrixrRow
+# linalg2.matrixrow
 def oms_linalg2_matrixRow(ls):
-    s= set(ls)
-    mr = MatrixRow(s)
+    mr = MatrixRow(ls)
     return mr
 
+################
+#   linalg1    #
+################
+
+# linalg1.transpose
+def oms_linalg1_transpose(ls):
+    return transpose(ls[0])
+
+# linalg1.determinant
+def oms_linalg1_determinant(ls):
+    return determinant(ls[0])
+
+################
+#   linalg5    #
+################
+
+# linalg5.identity
+def oms_linalg5_identity(ls):
+    return identity(ls[0])
+
 ##############
 #   nums1    #
 ##############
@@ -125,9 +157,24 @@ def oms_nums1_rational(list):
 def oms_integer1_factorial(ls):
     return factorial(ls[0])
 
+#################
+#   modular1    #
+#################
+
+# modular1 is a private CD of this package, not a standard OpenMath CD
+# (see doc/modular1.ocd)
+
+# modular1.factorial_mod
+def oms_modular1_factorial_mod(ls):
+    return factorial_mod(ls[0], ls[1])
+
+# modular1.power_mod
+def oms_modular1_power_mod(ls):
+    return power_mod(ls[0], ls[1], ls[2])
+
 # interval1.interval
 def oms_interval1_interval(ls):
-    return list(range(ls[0],ls[1]+1))
+    return IntegerInterval(ls[0],ls[1])
 
 ##################
 #     arith1     #
@@ -136,7 +183,7 @@ def oms_interval1_interval(ls):
 
 # arith1.plus
 def oms_arith1_plus (ls):
-    return plus (ls[0],ls[1])
+    return applyNary(plus, ls)
 
 # arith1.minus
 def oms_arith1_minus (ls):
@@ -144,7 +191,7 @@ def oms_arith1_minus (ls):
 
 # arith1.times
 def oms_arith1_times (ls):
-    return times(ls[0],ls[1])
+    return applyNary(times, ls)
 
 # arith1.divide
 def oms_arith1_divide (ls):
@@ -168,11 +215,11 @@ def oms_arith1_unary_minus(ls):
 
 # arith1.gcd
 def oms_arith1_gcd(ls):
-    return gcd(ls[0],ls[1])
+    return applyNary(gcd, ls)
 
 # arith1.lcm
 def oms_arith1_lcm(ls):
-    return  lcm(ls[0], ls[1])
+    return applyNary(lcm, ls)
 
 # arith1.sum
 def oms_arith1_sum (ls):
@@ -192,10 +239,9 @@ def oms_fns1_lambda(children):
     equivalent to the OMS representation
 
     """
-    env={}
     variables = children[0] # list of children of ombvar
     body = children[1]
-    return eval(variables,body,env)
+    return eval(variables,body,())
 
 
 #####################################
@@ -208,9 +254,12 @@ omdicts['logic1'] = {}
 omdicts['nums1']={}
 omdicts['complex1']={}
 omdicts['interval1'] ={}
+omdicts['linalg1'] ={}
 omdicts['linalg2'] ={}
+omdicts['linalg5'] ={}
 omdicts['arith1']={}
 omdicts['integer1']={}
+omdicts['modular1']={}
 omdicts['fns1']={}
 omdicts['arith2']={}
 
@@ -223,6 +272,9 @@ omdicts['complex1']['complex_cartesian']=oms_complex1_cartesian
 omdicts['interval1']['integer_interval']=oms_interval1_interval
 omdicts['linalg2']['matrixrow'] = oms_linalg2_matrixRow
 omdicts['linalg2']['matrix'] = oms_linalg2_matrix
+omdicts['linalg1']['transpose'] = oms_linalg1_transpose
+omdicts['linalg1']['determinant'] = oms_linalg1_determinant
+omdicts['linalg5']['identity'] = oms_linalg5_identity
 omdicts['arith1']['plus'] = oms_arith1_plus
 omdicts['arith1']['minus'] = oms_arith1_minus
 omdicts['arith1']['times'] = oms_arith1_times
@@ -237,6 +289,8 @@ omdicts['arith1']['lcm'] = oms_arith1_lcm
 omdicts['arith1']['sum'] = oms_arith1_sum
 omdicts['arith1']['product'] = oms_arith1_product
 omdicts['integer1']['factorial'] = oms_integer1_factorial
+omdicts['modular1']['factorial_mod'] = oms_modular1_factorial_mod
+omdicts['modular1']['power_mod'] = oms_modular1_power_mod
 omdicts['fns1']['lambda'] = oms_fns1_lambda
 omdicts['arith2']['inverse'] = OMErrorObj("not implemented",None)
 
@@ -250,7 +304,66 @@ def ParseOMI(node):
     returns the integer value represented by OMI node
 
     """
-    return int(node.text)
+    return textInt(node.text)
+
+
+# integers with more digits than this are converted from and to text
+# by parts (Python refuses to convert them at once), and the server
+# refuses integers with more digits (see limitDigits)
+MAX_DIGITS = 4000
+
+# limit on the digits of the integers read in each thread
+inputLimits = threading.local()
+
+
+@contextmanager
+def limitDigits(max_digits):
+    """
+    returns a context in which textInt refuses the integers of more than
+    max_digits digits, in this thread only
+
+    """
+    previous = getattr(inputLimits, 'digits', None)
+    inputLimits.digits = max_digits
+    try:
+        yield
+    finally:
+        inputLimits.digits = previous
+
+
+def textInt(text):
+    """
+    returns the integer written in decimal in text
+
+    as for int, the number of digits is limited by the interpreter
+    (sys.set_int_max_str_digits, no limit if 0), and by limitDigits,
+    a ValueError is raised above the limit
+
+    """
+    text = text.strip()
+    digits = len(text.lstrip('+-'))
+    for limit in (getattr(inputLimits, 'digits', None),
+                  sys.get_int_max_str_digits()):
+        if limit and digits > limit:
+            raise ValueError("integer of %d digits, more than the limit of %d"
+                             % (digits, limit))
+    return partsInt(text)
+
+
+def partsInt(text):
+    """
+    returns the integer written in decimal in text, converted by parts
+    of at most MAX_DIGITS digits
+
+    """
+    if len(text) <= MAX_DIGITS:
+        return int(text)
+    if text[0] in '+-':
+        value = partsInt(text[1:])
+        return -value if text[0] == '-' else value
+    k = len(text) // 2
+    return partsInt(text[:-k]) * 10**k + partsInt(text[-k:])
+
 
 def ParseOMF(node):
     """
@@ -293,25 +406,65 @@ def ParseOMS(node):
     return func
 
 
+def applySymbol(f, args):
+    """
+    returns f(args), the function of a symbol applied to the list args
+    (memoized, see MemoCache), or a domain_error OMErrorObj if the
+    arguments are not in the domain of the function
+
+    """
+    try:
+        return memo.apply(f, args)
+    except (ValueError, ArithmeticError):
+        return OMErrorObj("domain_error", symbolElement(f))
+
+
+def symbolElement(f):
+    """
+    returns the OMS element of the symbol whose function is f
+
+    """
+    for cd, names in omdicts.items():
+        for name, g in names.items():
+            if g is f:
+                return ET.Element('OMS', {'cd' : cd, 'name' : name})
+    return ET.Element('OMS', {'cd' : 'unknown', 'name' : 'unknown'})
+
+
 def ParseOMA(node):
     """
     retrieves the functions associated with the OMS element
     applies it to the following elements
     or returns and Error Object
 
+    nested OMA elements are parsed with an explicit stack rather than
+    by recursion, so the nesting depth is not limited
+
     """
-    oms = node[0]
-    f = ParseOMelement(oms)
-    # check if parsing the symbol doesn't return an error object
-    if isinstance(f, OMErrorObj):
-        return f
-    # if not error object, then it must have returned a function
-    # parse the rest of the elements
-    elts = []
-    for child in node[1:]:
-        elts.append( ParseOMelement(child) )
-    # apply function to the rest of the OM elements
-    return f(elts)
+    # each entry holds the children still to parse of an OMA element
+    # and the values of the ones already parsed
+    stack = [(iter(node), [])]
+    while True:
+        children, elts = stack[-1]
+        child = next(children, None)
+        if child is not None and child.tag == 'OMA':
+            stack.append((iter(child), []))
+            continue
+        if child is not None:
+            elts.append(ParseOMelement(child))
+            if not (len(elts) == 1 and isinstance(elts[0], OMErrorObj)):
+                continue
+        # all the elements are parsed, or the symbol is an error object
+        stack.pop()
+        f = elts[0]
+        value = f if isinstance(f, OMErrorObj) else applySymbol(f, elts[1:])
+        if not stack:
+            return value
+        children, elts = stack[-1]
+        elts.append(value)
+        if len(elts) == 1 and isinstance(value, OMErrorObj):
+            # the symbol of the enclosing element is an error object
+            stack[-1] = (iter(()), elts)
 
 
 def ParseOMBIND(node):
@@ -337,9 +490,9 @@ def ParseOME(node):
     returns an OMErrorObj associated with the OME element
 
     """
-    # the second child is the original erroneous OMS node
-    # parsing it will produce an OMErrorObj, see ParseOMS
-    return ParseOMS(node[1])
+    # the first child is the error symbol, the second the node in error
+    # (for the errors of ParseOMS, parsing it again gives the same error)
+    return OMErrorObj(node[0].get('name'), node[1])
 
 
 def ParseOMelement(obj):
@@ -366,6 +519,337 @@ def ParseOMroot(root):
         return ProgramErrorObj("nothing_to_parse", root.tag)
 
 
+####################################
+#   memoization of applications    #
+####################################
+
+class MemoCache:
+    """
+    returns a cache of the values of symbol applications, keyed on the
+    symbol and on the values of the arguments, so an application met
+    again (in the same OM object or in another one) is not evaluated
+
+    max_entries         :   bound on the number of cached values
+    max_bytes           :   bound on the approximate size of the cached
+                            values and arguments
+    the least recently used entries are evicted
+
+    the symbols of omdicts are taken to be pure (the same arguments give
+    the same value), except the ones of memoExcluded
+    applications to arguments without a key (e.g. functions, see
+    valueKey) are evaluated as usual, and the value of an application
+    is only kept if it was long to evaluate or its arguments are large
+    (see MEMO_MIN_SECONDS), the decision is taken for each call
+
+    """
+    def __init__(self, max_entries=4096, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()    # (function, key) -> (value, cost)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.symbols = None             # function -> (cd, name)
+        self.counters = {}              # (cd, name) ->
+                                        #   [calls, hits, seconds, stored]
+
+    def apply(self, f, args):
+        """
+        returns f(args), the cached value if there is one
+
+        """
+        if self.symbols is None:
+            self.symbols = memoSymbols()
+        symbol = self.symbols.get(f)
+        if symbol is None or self.max_entries == 0:
+            return f(args)
+        key, cost = valueKey(args, MEMO_MAX_ITEMS)
+        if key is None:
+            return f(args)
+        key = (f, key)
+        with self.lock:
+            counters = self.counters.setdefault(symbol, [0, 0, 0.0, 0])
+            counters[0] += 1
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                counters[1] += 1
+                return entry[0]
+        start = time.perf_counter()
+        value = f(args)
+        elapsed = time.perf_counter() - start
+        # cheaper to evaluate again than to keep: not stored
+        worth = elapsed >= MEMO_MIN_SECONDS or cost >= MEMO_MIN_BYTES
+        cost += valueSize(value)
+        with self.lock:
+            counters[2] += elapsed
+            if worth and cost <= self.max_bytes and \
+               not isinstance(value, OMErrorObj):
+                counters[3] += 1
+                self.store(key, value, cost)
+        return value
+
+    def store(self, key, value, cost):
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[1]
+        self.entries[key] = (value, cost)
+        self.size += cost
+        while len(self.entries) > self.max_entries or \
+              self.size > self.max_bytes:
+            _, (_, old) = self.entries.popitem(last=False)
+            self.size -= old
+
+    def clear(self):
+        """
+        empties the cache, the list of pure symbols is read again from
+        omdicts on next use
+
+        """
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.symbols = None
+
+    def stats(self):
+        """
+        returns the counters of each symbol applied so far, as a
+        dictionary (cd, name) -> {'calls', 'hits', 'seconds', 'stored'}
+        where seconds is the time spent evaluating the misses and stored
+        the number of values put in the cache
+
+        """
+        with self.lock:
+            return {symbol : {'calls'   : c[0],
+                              'hits'    : c[1],
+                              'seconds' : c[2],
+                              'stored'  : c[3]}
+                    for symbol, c in self.counters.items()}
+
+
+# applications of these symbols are never cached: constructors of
+# values holding their arguments as they are (nothing to save), and
+# impure symbols (see register_impure)
+memoExcluded = { ('list1', 'list'),
+                 ('linalg2', 'matrix'),
+                 ('linalg2', 'matrixrow') }
+
+# symbols whose applications may give different values for the same
+# arguments (see register_impure)
+impureSymbols = set()
+
+# applications with more values than this in their arguments are not
+# cached, building their key would cost as much as evaluating them
+MEMO_MAX_ITEMS = 256
+
+# nor applications to lists nested deeper than this
+MEMO_MAX_DEPTH = 32
+
+# the value of an application is cached if its evaluation took at least
+# MEMO_MIN_SECONDS, or if its arguments take at least MEMO_MIN_BYTES
+# (see valueKey), cheaper applications are evaluated again
+MEMO_MIN_SECONDS = 10e-6
+MEMO_MIN_BYTES = 1024
+
+
+def register_impure(cd, name):
+    """
+    marks the symbol cd.name as impure: its applications are never cached
+    (nor the responses of the server to the requests applying it)
+
+    """
+    impureSymbols.add((cd, name))
+    memoExcluded.add((cd, name))
+    memo.clear()
+
+
+def memoSymbols():
+    """
+    returns the dictionary function -> (cd, name) of the symbols of
+    omdicts whose applications may be cached
+
+    """
+    symbols = {}
+    for cd, names in omdicts.items():
+        for name, f in names.items():
+            if callable(f) and not (cd, name) in memoExcluded:
+                symbols[f] = (cd, name)
+    return symbols
+
+
+def valueKey(x, budget, depth=MEMO_MAX_DEPTH):
+    """
+    returns (key, size) for the value x: a hashable key equal for equal
+    values of the same type (hash-consing by structure), and the
+    approximate size of x in bytes
+    the key is None if x has no key, holds more than budget values or
+    lists nested more than depth times
+
+    """
+    t = type(x)
+    if t in (int, bool, str):
+        return (t, x), valueSize(x)
+    if t == float:
+        return (t, x.hex()), 24     # tells 0.0 from -0.0
+    if t == complex:
+        return (t, x.real.hex(), x.imag.hex()), 32
+    if t == Fraction:
+        return (t, x.numerator, x.denominator), valueSize(x)
+    if t == IntegerInterval:
+        return (t, x.first, x.last), 64
+    if t == Matrix:
+        if len(x.data) > budget:
+            return None, 0
+        key, size = valueKey(list(x.data), budget, depth)
+        if key is None:
+            return None, 0
+        return (t, x.shape, key), size
+    if t == list:
+        if len(x) > budget or depth == 0:
+            return None, 0
+        keys = []
+        total = 56
+        for item in x:
+            key, size = valueKey(item, budget - len(keys), depth - 1)
+            if key is None:
+                return None, 0
+            keys.append(key)
+            total += size + 8
+        return (t, tuple(keys)), total
+    return None, 0
+
+
+def valueSize(x):
+    """
+    returns the approximate size in bytes of the value x
+    (nested lists are walked without recursion, they may be deep)
+
+    """
+    size = 0
+    stack = [x]
+    while stack:
+        x = stack.pop()
+        t = type(x)
+        if t == int or t == bool:
+            size += 28 + x.bit_length() // 8
+        elif t == str:
+            size += 49 + len(x)
+        elif t == Fraction:
+            size += 56
+            stack += [x.numerator, x.denominator]
+        elif t == Matrix:
+            size += 64 + 8 * len(x.data)
+        elif t == list:
+            size += 56 + 8 * len(x)
+            stack += x
+        else:
+            size += 64
+    return size
+
+
+# values of the applications evaluated so far
+memo = MemoCache()
+
+
+##########################
+#   streaming parser     #
+##########################
+
+class OMEventParser:
+    """
+    returns a parser evaluating an OM object from the (event, element)
+    pairs of an incremental XML parser (ET.iterparse or ET.XMLPullParser,
+    with events 'start' and 'end')
+
+    an element is evaluated as soon as its end tag arrives, from the
+    values of its children, then it is removed from the tree, so only
+    the elements not yet complete are kept in memory
+    OMBIND and OME elements are evaluated from their whole subtree
+    the arguments of an OMA element whose symbol is an error object
+    are not evaluated (as by ParseOMA)
+
+    once done is True, result holds the value of the OM object
+    (as ParseOMroot would return it)
+
+    """
+    def __init__(self):
+        self.values = []        # values of the children of each open element
+        self.elements = []      # open elements
+        self.whole = 0          # depth inside an OMBIND or OME element
+        self.skipped = 0        # depth inside an argument not evaluated
+        self.done = False
+        self.result = None
+
+    def event(self, event, elem):
+        if event == 'start':
+            self.start(elem)
+        else:
+            self.end(elem)
+
+    def start(self, elem):
+        if self.whole or self.skipped:
+            self.whole += bool(self.whole)
+            self.skipped += bool(self.skipped)
+            return
+        if self.elements and self.elements[-1].tag == 'OMA' and \
+           self.values[-1] and isinstance(self.values[-1][0], OMErrorObj):
+            # the symbol is an error object, the OMA element is that error
+            self.skipped = 1
+            return
+        if not self.elements and not elem.tag == 'OMOBJ':
+            self.finish(ProgramErrorObj("unknown_tag", elem.tag))
+            return
+        self.elements.append(elem)
+        if elem.tag in ('OMBIND', 'OME'):
+            self.whole = 1
+        else:
+            self.values.append([])
+
+    def end(self, elem):
+        if self.skipped:
+            self.skipped -= 1
+            if not self.skipped:
+                del self.elements[-1][-1]
+            return
+        if self.whole > 1:
+            self.whole -= 1
+            return
+        if self.whole == 1:
+            # the subtree is complete, parse it as a whole
+            self.whole = 0
+            value = ParseOMelement(elem)
+        else:
+            value = self.evaluate(elem, self.values.pop())
+        self.elements.pop()
+        if not self.elements:
+            self.finish(value)
+            return
+        # the element is no longer needed, it is the last child of its parent
+        del self.elements[-1][-1]
+        self.values[-1].append(value)
+
+    def evaluate(self, elem, values):
+        """
+        returns the value of elem given the values of its children
+
+        """
+        tag = elem.tag
+        if tag == 'OMA':
+            f = values[0]
+            if isinstance(f, OMErrorObj):
+                return f
+            return applySymbol(f, values[1:])
+        if tag == 'OMOBJ' and not self.elements[:-1]:
+            if values:
+                return values[0]
+            return ProgramErrorObj("nothing_to_parse", tag)
+        return ParseOMelement(elem)
+
+    def finish(self, result):
+        self.done = True
+        self.result = result
+        self.elements = []
+        self.values = []
+
+
 #################
 #   auxiliary   #
 #################
@@ -380,22 +864,44 @@ ParseOMelementHandler = {   'OMI'       : ParseOMI,
                         }
 
 
-def eval(vs,body,env):
+def eval(vs,body,frame):
     """
-    reads variable declarations (vs) and populates the variable environment (env)
-    returns a function given its body (body)
+    reads variable declarations (vs) and returns a function given its body (body)
+
+    variables are resolved to slots of an immutable frame (tuple) when the
+    body is compiled, each application builds its own frame, so the
+    function may be applied re-entrantly (nested sums, several threads)
 
     """
-    if len(vs)>0: # i.e. we still have a child node inside OMBVAR - a variable
-        varname = vs[0].get('name')         # extract the name of the variable
-        # create a pointer for this variable -x and add it to the environment
-        # continue to evaluate either other varible declarations or the function body
-        vs = [] if (len(vs)==1) else vs[1:]
-        return lambda x: eval(vs, body,updateEnv(varname,x,env))
+    names = [v.get('name') for v in vs]
+    slots = {}
+    for i, name in enumerate(names):
+        slots[name] = i     # a repeated name is bound to its last slot
+    func = bindVars(len(names), compileBody(body, slots), frame)
+    if len(names)>0:
+        # describe the function for arith_func.flatten and the
+        # closed-form sum (see arith_func.ar_sum)
+        func.variables = len(names)
+        func.polynomial = polynomialBody(body)
+    return func
 
-    # no more variable declarations at this point, so we can start evaluating the function
-    # body given the populated environment env
-    return evalBody(body,env)
+
+def bindVars(n, code, frame):
+    """
+    returns a (possibly nested) lambda function binding n more variables,
+    each application extends the frame, then runs the compiled body code
+
+    """
+    if n>1:
+        return lambda x: bindVars(n-1,code,frame+(x,))
+    if n==1:
+        # innermost variable, the application runs the body directly
+        if len(frame)==0:
+            return lambda x: code((x,))
+        return lambda x: code(frame+(x,))
+
+    # no variable declarations at all, the body is evaluated straight away
+    return code(frame)
 
 
 def evalBody(body,env):
@@ -403,31 +909,331 @@ def evalBody(body,env):
     returns the function (or part of the function) with
     a given function body description in OMS format
 
-    """
-    if body.tag== "OMA":
-        # evaluate both sides of the expression
-        f_name = body[0].get('name') # name of arith1 function
-        f= arithmetic_func[f_name]   # get the arithmetic function
-                                     # corresponding to OMS element
-        arg1 = evalBody (body[1],env)
-        if f.__name__ in singleArg:  # if f requires only one arg
-            return f(arg1)
-        arg2 = evalBody (body[2], env)
-        return f(arg1,arg2)
+    nested OMA elements are evaluated with an explicit stack
 
+    """
     if body.tag =="OMV":
          # return pointer associated with that variable name
         name = body.get('name')
         return env[name]
-    # parse any other element like int, float etc.
-    return ParseOMelement(body)
+    if not body.tag == "OMA":
+        # parse any other element like int, float etc.
+        return ParseOMelement(body)
+
+    # each entry holds an OMA element, its arithmetic function,
+    # its number of arguments and the values of the arguments evaluated
+    stack = [bodyFrame(body)]
+    while True:
+        elt, f, nargs, args = stack[-1]
+        if len(args) < nargs:
+            arg = elt[1+len(args)]
+            if arg.tag == "OMA":
+                stack.append(bodyFrame(arg))
+            elif arg.tag == "OMV":
+                args.append(env[arg.get('name')])
+            else:
+                args.append(ParseOMelement(arg))
+            continue
+        stack.pop()
+        value = f(*args)
+        if not stack:
+            return value
+        stack[-1][3].append(value)
+
+
+def bodyFrame(body):
+    """
+    returns the evaluation stack entry for the OMA element body
+
+    """
+    f, nargs = bodyFunction(body)
+    return (body, f, nargs, [])
+
+
+def bodyFunction(body):
+    """
+    returns the arithmetic function applied by the OMA element body
+    and its number of arguments
+
+    """
+    f_name = body[0].get('name') # name of arith1 function
+    f= arithmetic_func[f_name]   # get the arithmetic function
+                                 # corresponding to OMS element
+    if f.__name__ in singleArg:
+        return f, 1
+    if f.__name__ in threeArgs:
+        return f, 3
+    if not f.__name__ in naryArg:
+        return f, 2
+    nargs = len(body) - 1
+    if nargs < 2:
+        return (lambda *args: applyNary(f, args)), nargs
+    return f, nargs
+
+
+def bodyDepth(body):
+    """
+    returns the nesting depth of the OMA elements of body
+
+    """
+    depth = 0
+    stack = [(body, 1)]
+    while stack:
+        elt, d = stack.pop()
+        if elt.tag == "OMA":
+            depth = max(depth, d)
+            stack.extend((child, d+1) for child in elt)
+    return depth
 
 
 def updateEnv(name, var, env):
     """
-    adds a new name - pointer relation to the variable environment (dictionary)
-    returns the updated environment
+    returns a copy of the variable environment (dictionary)
+    with a new name - pointer relation added to it
+
+    the given environment is left unchanged, so it can be shared
 
     """
+    env = dict(env)
     env[name] = var
     return env
+
+
+###################################
+#   lambda body compiler (fns1)   #
+###################################
+
+def compileBody(body, slots):
+    """
+    compiles a function body description in OMS format into a Python
+    function of the variable frame, slots maps each variable name
+    to its index in the frame
+
+    subexpressions that do not depend on any variable are evaluated
+    once, at compile time (constant folding)
+
+    """
+    if bodyDepth(body) > CLOSURE_DEPTH:
+        # calling nested closures this deep would exhaust the stack
+        return compileProgram(body, slots)
+    const, value = compileNode(body, slots)
+    if const:
+        return lambda frame: value
+    return value
+
+
+def compileNode(body, slots):
+    """
+    returns a pair (const, value)
+    if const is True, value is the (folded) value of the body
+    otherwise value is a function of the variable frame
+
+    """
+    if body.tag == "OMV":
+        i = slots[body.get('name')]
+        return False, lambda frame: frame[i]
+    if not body.tag == "OMA":
+        # any other element like int, float etc. is a constant
+        return True, ParseOMelement(body)
+
+    f, nargs = bodyFunction(body)
+    args = [compileNode(body[1+i], slots) for i in range(nargs)]
+
+    if all(const for const, _ in args):
+        return True, f(*[value for _, value in args])
+
+    if len(args) == 1:
+        a = args[0][1]
+        return False, lambda frame: f(a(frame))
+
+    if len(args) == 2:
+        (ca, a), (cb, b) = args
+        if ca:
+            return False, lambda frame: f(a, b(frame))
+        if cb:
+            return False, lambda frame: f(a(frame), b)
+        return False, lambda frame: f(a(frame), b(frame))
+
+    fs = [(lambda frame, v=value: v) if const else value
+          for const, value in args]
+    return False, lambda frame: f(*[g(frame) for g in fs])
+
+
+# bodies nested deeper than this are compiled into a program
+# run by a loop (see compileProgram) rather than into closures
+CLOSURE_DEPTH = 100
+
+# instructions of a compiled program
+CONST, VAR, APPLY1, APPLY2, APPLYN = range(5)
+
+
+def compileProgram(body, slots):
+    """
+    compiles a function body description in OMS format into a program
+    (postfix list of instructions) and returns a Python function of the
+    variable frame running it, see runProgram
+
+    subexpressions that do not depend on any variable are folded
+
+    """
+    program = []
+    if not body.tag == "OMA":
+        const, value = compileNode(body, slots)
+        return (lambda frame: value) if const else value
+    # each entry holds an OMA element, its arithmetic function, its number
+    # of arguments and for each argument compiled whether it is constant
+    stack = [bodyFrame(body)]
+    while stack:
+        elt, f, nargs, consts = stack[-1]
+        if len(consts) < nargs:
+            arg = elt[1+len(consts)]
+            if arg.tag == "OMA":
+                stack.append(bodyFrame(arg))
+            elif arg.tag == "OMV":
+                program.append((VAR, slots[arg.get('name')]))
+                consts.append(False)
+            else:
+                program.append((CONST, ParseOMelement(arg)))
+                consts.append(True)
+            continue
+        stack.pop()
+        if all(consts):
+            # the arguments are the last constants of the program
+            args = [value for _, value in program[len(program)-nargs:]]
+            del program[len(program)-nargs:]
+            program.append((CONST, f(*args)))
+        elif nargs == 1:
+            program.append((APPLY1, f))
+        elif nargs == 2:
+            program.append((APPLY2, f))
+        else:
+            program.append((APPLYN, (f, nargs)))
+        if stack:
+            stack[-1][3].append(all(consts))
+    if len(program) == 1:
+        value = program[0][1]
+        return lambda frame: value
+    return lambda frame: runProgram(program, frame)
+
+
+def runProgram(program, frame):
+    """
+    runs a program made by compileProgram on the variable frame
+    returns the value of the function body
+
+    """
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    for op, arg in program:
+        if op == CONST:
+            push(arg)
+        elif op == VAR:
+            push(frame[arg])
+        elif op == APPLY1:
+            push(arg(pop()))
+        elif op == APPLY2:
+            b = pop()
+            push(arg(pop(), b))
+        else:
+            f, n = arg
+            args = stack[len(stack)-n:]
+            del stack[len(stack)-n:]
+            push(f(*args))
+    return stack[0]
+
+
+def polynomialBody(body):
+    """
+    returns the list of integer coefficients (lowest degree first) of the
+    function body, with every variable taken to be the same variable x
+    (i.e. the body of the flattened function), or None if the body is not
+    a polynomial with integer coefficients
+
+    """
+    if bodyDepth(body) > CLOSURE_DEPTH:
+        return None
+    try:
+        return polynomialNode(body)
+    except (KeyError, IndexError):
+        return None
+
+
+def polynomialNode(body):
+    """
+    returns the integer coefficients of the polynomial described by body,
+    or None if it is not such a polynomial
+
+    """
+    if body.tag == "OMV":
+        return [0, 1]
+    if not body.tag == "OMA":
+        value = ParseOMelement(body)
+        return [value] if type(value) == int else None
+
+    f_name = body[0].get('name')
+    if f_name == 'unary_minus':
+        p = polynomialNode(body[1])
+        return None if p is None else [-c for c in p]
+    if not f_name in polynomialOps:
+        return None
+    if f_name in naryArg:
+        # plus and times have any number of arguments
+        r = [naryEmpty[f_name]]
+        for child in body[1:]:
+            p = polynomialNode(child)
+            if p is None:
+                return None
+            r = polynomialOps[f_name](r, p)
+            if len(r)-1 > MAX_POLYNOMIAL_DEGREE:
+                return None
+        return r
+    p = polynomialNode(body[1])
+    q = polynomialNode(body[2])
+    if p is None or q is None:
+        return None
+    if f_name == 'power':
+        # only constant, non negative integer exponents
+        if len(q) > 1 or q[0] < 0 or (len(p)-1)*q[0] > MAX_POLYNOMIAL_DEGREE:
+            return None
+        r = [1]
+        for _ in range(q[0]):
+            r = polynomialOps['times'](r, p)
+        return r
+    r = polynomialOps[f_name](p, q)
+    return None if len(r)-1 > MAX_POLYNOMIAL_DEGREE else r
+
+
+def polynomialAdd(p, q, sign=1):
+    """
+    returns the coefficients of p + sign * q
+
+    """
+    r = [0] * max(len(p), len(q))
+    for i, c in enumerate(p):
+        r[i] += c
+    for i, c in enumerate(q):
+        r[i] += sign * c
+    return r
+
+
+def polynomialTimes(p, q):
+    """
+    returns the coefficients of p * q
+
+    """
+    r = [0] * (len(p) + len(q) - 1)
+    for i, a in enumerate(p):
+        for j, b in enumerate(q):
+            r[i+j] += a * b
+    return r
+
+
+# highest degree for which a closed form sum is attempted
+MAX_POLYNOMIAL_DEGREE = 256
+
+polynomialOps = {   'plus'      : polynomialAdd,
+                    'minus'     : lambda p, q: polynomialAdd(p, q, -1),
+                    'times'     : polynomialTimes,
+                    'power'     : None      # handled by polynomialNode
+                }
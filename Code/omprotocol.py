@@ -0,0 +1,312 @@
+"""
+
+Module contains the framing of the messages exchanged by the OpenMath
+server and its clients
+
+every message (frame) is a 4 byte big-endian length followed by that
+many bytes of payload (an OpenMath string, or an "error:" string)
+
+a payload may start with a message header (kind, request id), so that
+several requests are in flight on one connection:
+
+    SINGLE  request id, document
+    BATCH   request id, number of documents, then for each document
+            its length and its bytes
+    ENCODING request id, name of the encoding ("xml" or "binary") of
+            the results sent on the connection from then on
+
+the answer to such a message has the same kind and request id, and
+carries the results in place of the documents; answers may arrive in
+any order. A payload without header (an OpenMath string starts with
+'<' or white space, a binary encoded OpenMath object with the OMOBJ
+token 24) is answered in turn, with a payload without header.
+
+requests may be OpenMath strings or binary encoded OpenMath objects
+(see ombinary) whatever the encoding of the results
+
+payloads are received straight into a buffer allocated once for the
+whole frame, so large messages are not copied chunk by chunk
+
+"""
+
+###############
+#   imports   #
+###############
+
+import asyncio
+import struct
+
+
+# length prefix of every frame
+HEADER = struct.Struct('!I')
+
+# frames announcing a longer payload are refused
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+# buffers given to a single sendmsg (at most IOV_MAX, 1024 on Linux)
+MAX_BUFFERS = 1024
+
+# message header: kind, request id
+MESSAGE = struct.Struct('!BI')
+
+# length prefix of each document of a batch
+COUNT = struct.Struct('!I')
+
+# message kinds
+SINGLE = 1
+BATCH = 2
+ENCODING = 3
+
+# encodings of the results
+ENCODINGS = (b'xml', b'binary')
+
+
+class ProtocolError(Exception):
+    """
+    returns an object to represent a malformed or oversized frame
+
+    """
+    def __init__(self, errortype, context):
+        self.name = errortype
+        self.context = context
+        Exception.__init__(self, "%s: %s" % (errortype, context))
+
+
+##################################
+#   blocking socket functions    #
+##################################
+
+def sendFrame(sock, payload):
+    """
+    sends payload (bytes, or a list of bytes) as one frame on the socket sock
+
+    """
+    parts = payload if isinstance(payload, list) else [payload]
+    buffers = [HEADER.pack(frameSize(parts))] + parts
+    # one write for the whole frame: sending the header alone would hold
+    # the payload back until the header is acknowledged (Nagle's
+    # algorithm), which the peer may delay
+    if not hasattr(sock, 'sendmsg'):
+        sock.sendall(b''.join(buffers))
+        return
+    buffers = [memoryview(b).cast('B') for b in buffers if len(b)]
+    while buffers:
+        sent = sock.sendmsg(buffers[:MAX_BUFFERS])
+        # drop what was sent, the rest goes with the next sendmsg
+        while buffers and sent >= len(buffers[0]):
+            sent -= len(buffers.pop(0))
+        if sent:
+            buffers[0] = buffers[0][sent:]
+
+
+def recvFrame(sock, max_size=MAX_FRAME_SIZE):
+    """
+    receives one frame from the socket sock
+    returns its payload as a bytearray, or None if the connection was
+    closed before a new frame started
+
+    """
+    header = bytearray(HEADER.size)
+    n = recvInto(sock, memoryview(header))
+    if n == 0:
+        return None
+    if n < HEADER.size:
+        raise ProtocolError("truncated_frame", n)
+    (size,) = HEADER.unpack(header)
+    if size > max_size:
+        raise ProtocolError("frame_too_large", size)
+    payload = bytearray(size)
+    if recvInto(sock, memoryview(payload)) < size:
+        raise ProtocolError("truncated_frame", size)
+    return payload
+
+
+def recvInto(sock, view):
+    """
+    fills the memoryview view with bytes received from sock
+    returns the number of bytes received, which is less than the
+    size of view if the connection was closed
+
+    """
+    pos = 0
+    while pos < len(view):
+        n = sock.recv_into(view[pos:])
+        if n == 0:
+            break
+        pos += n
+    return pos
+
+
+########################
+#   message encoding   #
+########################
+
+def encodeMessage(kind, request_id, documents):
+    """
+    returns the list of byte strings forming the payload of a message
+    of kind SINGLE or ENCODING (one document) or BATCH (list of documents)
+
+    """
+    parts = [MESSAGE.pack(kind, request_id)]
+    if not kind == BATCH:
+        parts.append(documents)
+        return parts
+    parts.append(COUNT.pack(len(documents)))
+    for doc in documents:
+        parts.append(COUNT.pack(len(doc)))
+        parts.append(doc)
+    return parts
+
+
+def decodeMessage(payload):
+    """
+    returns (kind, request id, documents) for a payload,
+    kind is None (and request id is None) for a payload without header
+
+    the documents are memoryview slices of payload (no copy)
+    a SINGLE, ENCODING or bare message has one document, not a list
+
+    """
+    view = memoryview(payload)
+    if len(view) == 0 or not view[0] in (SINGLE, BATCH, ENCODING):
+        return None, None, view
+    if len(view) < MESSAGE.size:
+        raise ProtocolError("truncated_message", len(view))
+    kind, request_id = MESSAGE.unpack_from(view)
+    pos = MESSAGE.size
+    if not kind == BATCH:
+        return kind, request_id, view[pos:]
+    try:
+        (count,) = COUNT.unpack_from(view, pos)
+        pos += COUNT.size
+        documents = []
+        for _ in range(count):
+            (size,) = COUNT.unpack_from(view, pos)
+            pos += COUNT.size
+            if pos + size > len(view):
+                raise ProtocolError("truncated_message", request_id)
+            documents.append(view[pos:pos+size])
+            pos += size
+    except struct.error:
+        raise ProtocolError("truncated_message", request_id)
+    return kind, request_id, documents
+
+
+def frameSize(parts):
+    """
+    returns the length of a payload made of the byte strings parts
+
+    """
+    return sum(len(p) for p in parts)
+
+
+#########################
+#   asyncio protocol    #
+#########################
+
+class FrameProtocol(asyncio.BufferedProtocol):
+    """
+    returns an asyncio protocol that splits the received bytes into frames
+
+    when the connection is made, the coroutine handler(protocol) is run
+    it reads frames with read_frame() and sends them with write_frame()
+
+    """
+    def __init__(self, handler, max_size=MAX_FRAME_SIZE, max_pending=64):
+        self.handler = handler
+        self.max_size = max_size
+        self.max_pending = max_pending  # frames queued before reading pauses
+        self.frames = asyncio.Queue()
+        self.transport = None
+        self.task = None
+        self.reading_paused = False
+        self.writing_resumed = None     # future, set while writing is paused
+        self.header = bytearray(HEADER.size)
+        self.expectHeader()
+
+    # connection callbacks
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.task = asyncio.get_running_loop().create_task(self.handler(self))
+
+    def connection_lost(self, exc):
+        self.frames.put_nowait(None)
+        if self.writing_resumed is not None:
+            self.writing_resumed.set_result(None)
+            self.writing_resumed = None
+
+    def eof_received(self):
+        self.frames.put_nowait(None)
+        return False
+
+    # reading
+
+    def expectHeader(self):
+        self.payload = None
+        self.view = memoryview(self.header)
+        self.pos = 0
+
+    def get_buffer(self, sizehint):
+        return self.view[self.pos:]
+
+    def buffer_updated(self, nbytes):
+        self.pos += nbytes
+        if self.pos < len(self.view):
+            return
+        if self.payload is None:
+            # the header is complete, allocate the payload buffer
+            (size,) = HEADER.unpack(self.header)
+            if size > self.max_size:
+                self.frames.put_nowait(ProtocolError("frame_too_large", size))
+                self.transport.pause_reading()
+                return
+            self.payload = bytearray(size)
+            self.view = memoryview(self.payload)
+            self.pos = 0
+            if size > 0:
+                return
+        self.frames.put_nowait(self.payload)
+        self.expectHeader()
+        if self.frames.qsize() >= self.max_pending and not self.reading_paused:
+            self.reading_paused = True
+            self.transport.pause_reading()
+
+    async def read_frame(self):
+        """
+        returns the payload of the next frame (bytearray),
+        or None once the connection has been closed
+        raises ProtocolError if the frame is oversized
+
+        """
+        frame = await self.frames.get()
+        if self.reading_paused and self.frames.qsize() < self.max_pending // 2:
+            self.reading_paused = False
+            self.transport.resume_reading()
+        if isinstance(frame, ProtocolError):
+            raise frame
+        return frame
+
+    # writing
+
+    def pause_writing(self):
+        self.writing_resumed = asyncio.get_running_loop().create_future()
+
+    def resume_writing(self):
+        if self.writing_resumed is not None:
+            self.writing_resumed.set_result(None)
+            self.writing_resumed = None
+
+    async def write_frame(self, payload):
+        """
+        sends payload (bytes, or a list of bytes) as one frame,
+        waits while the transport's write buffer is full
+
+        """
+        parts = payload if isinstance(payload, list) else [payload]
+        self.transport.writelines([HEADER.pack(frameSize(parts))] + parts)
+        if self.writing_resumed is not None:
+            await self.writing_resumed
+
+    def close(self):
+        self.transport.close()
@@ -11,8 +11,10 @@ import xml.etree.ElementTree as ET
 Element = ET.Element
 SubElement = ET.SubElement
 
-from omparse import Matrix, MatrixRow, OMErrorObj
+from omparse import Matrix, MatrixRow, IntegerInterval, OMErrorObj, \
+                   ProgramErrorObj, MAX_DIGITS
 import fractions
+import sys
 
 ##############################################
 #   Python object to OM element converters   #
@@ -24,9 +26,26 @@ import fractions
 
 def OMInt( x ):
     omelt = Element("OMI")
-    omelt.text = str(x)
+    omelt.text = intText(x)
     return omelt
 
+
+def intText(x):
+    """
+    returns the decimal text of the integer x, of any size (the results
+    computed are written whatever the limit of the interpreter on the
+    digits of an integer, only the parts converted at once respect it)
+
+    """
+    limit = sys.get_int_max_str_digits() or MAX_DIGITS
+    if x.bit_length() <= 3 * min(limit, MAX_DIGITS):
+        return str(x)
+    if x < 0:
+        return '-' + intText(-x)
+    k = int(x.bit_length() * 0.30103) // 2   # half the number of digits
+    q, r = divmod(x, 10**k)
+    return intText(q) + intText(r).zfill(k)
+
 ###########################
 #   OpenMath float (OMF)  #
 ###########################
@@ -89,6 +108,7 @@ def OMMatrixRow(x):
     for cell in x.cells:
         omcell = OMelement(cell)
         omelt.insert(i, omcell)
+        i += 1
     return omelt
 
 ####################################
@@ -146,36 +166,85 @@ def OMList(x):
         omelt.insert(n, OMelement(t))
     return omelt
 
+#################################
+#   OpenMath integer interval   #
+#################################
+
+def OMInterval(x):
+    omelt = Element("OMA")
+    oms = Element("OMS")
+    oms.attrib = { 'cd' : 'interval1', 'name' : 'integer_interval' }
+    omelt.insert(1, oms)
+    omelt.insert(2, OMInt(x.first))
+    omelt.insert(3, OMInt(x.last))
+    return omelt
+
 #################
 #   OMelement   #
 #################
 
+# OM element converter of each Python type, see register_encoder
+OMencoders = {  int                 : OMInt,
+                float               : OMFloat,
+                str                 : OMStr,
+                bool                : OMBool,
+                complex             : OMComplex,
+                list                : OMList,
+                fractions.Fraction  : OMRational,
+                Matrix              : OMMatrix,
+                IntegerInterval     : OMInterval,
+                OMErrorObj          : OMError
+             }
+
+# converter found for each type encoded so far (None if unsupported)
+resolvedEncoders = {}
+
+
+def register_encoder(t, encoder, writer=None):
+    """
+    registers encoder (a function returning the OM element for a value)
+    as the OM element converter of the Python type t and of its subclasses
+
+    writer (see OMwriters) writes the OM text of a value of type t
+    without building the element, if not given the element is built
+
+    e.g. register_encoder(decimal.Decimal, lambda x: OMFloat(x))
+
+    """
+    OMencoders[t] = encoder
+    if writer is not None:
+        OMwriters[t] = writer
+    elif t in OMwriters:
+        del OMwriters[t]
+    resolvedEncoders.clear()
+    resolvedWriters.clear()
+
+
+def resolveEncoder(t):
+    """
+    returns the OM element converter for the type t: the one registered
+    for t or else for its nearest base class, None if there is none
+
+    """
+    for base in t.__mro__:
+        if base in OMencoders:
+            return OMencoders[base]
+    return None
+
+
 def OMelement(x):
     """
     dispatches OpenMath encoding method dependently on the type of x
 
     """
-    if isinstance(x, Matrix):
-        return OMMatrix(x)
-    if isinstance(x, OMErrorObj):
-        return OMError(x)
-    t = type (x)
-    if t == int:
-        return OMInt(x)
-    elif t == list:
-        return OMList(x)
-    elif t == str:
-        return OMStr(x)
-    elif t == float:
-        return OMFloat(x)
-    elif t == complex:
-        return OMComplex(x)
-    elif t == bool:
-        return OMBool(x)
-    elif t == fractions.Fraction:
-        return OMRational(x)
-    else:
+    t = type(x)
+    try:
+        encoder = resolvedEncoders[t]
+    except KeyError:
+        encoder = resolvedEncoders[t] = resolveEncoder(t)
+    if encoder is None:
         return ProgramErrorObj("unsupported_python_object", x)
+    return encoder(x)
 
 ################
 #   OMobject   #
@@ -189,3 +258,190 @@ def OMobject(x):
     omobj = Element("OMOBJ")
     omobj.insert(1, OMelement(x))
     return omobj
+
+
+#################################
+#   OM element to text writer   #
+#################################
+
+def OMwrite( obj, write, level=0, pretty=True ):
+    """
+    writes the OM element obj as chunks of text passed to write
+    (e.g. the write method of a file, or the append method of a list)
+    with appropriate indentation if pretty is True, on one line otherwise
+
+    """
+    step = INDENT if pretty else ''
+    writeElement( obj, write, '\n' + level * step if pretty else '', step )
+
+
+def writeElement( obj, write, indent, step ):
+    start = indent + '<' + obj.tag
+    for value,key in obj.attrib.items():
+        start += ' %s=\'%s\'' % (value,key)
+    if obj.text:
+        write( start + '>' + str(obj.text) + '</' + obj.tag + '>' )
+    elif len(obj):
+        write( start + '>' )
+        for child in obj:
+            writeElement( child, write, indent + step, step )
+        write( indent + '</' + obj.tag + '>' )
+    else:
+        write( start + " />" )
+
+
+# indentation step of pretty printing
+INDENT = 4 * ' '
+
+####################################################
+#   Python object to OM text writers (no element)   #
+####################################################
+
+# each writer writes the same text as writing the element built by the
+# corresponding OM element converter, see OMwriteObject
+
+def writeInt(x, write, indent, step):
+    write(indent + '<OMI>' + intText(x) + '</OMI>')
+
+
+def writeFloat(x, write, indent, step):
+    write(indent + "<OMF dec='" + str(x) + "' />")
+
+
+def writeStr(x, write, indent, step):
+    x = str(x)
+    write(indent + ('<OMSTR>' + x + '</OMSTR>' if x else '<OMSTR />'))
+
+
+def writeBool(x, write, indent, step):
+    value = 'true' if x else 'false'
+    write(indent + "<OMS cd='logic1' name='" + value + "' />")
+
+
+def writeApplication(cd, name, args, write, indent, step):
+    """
+    writes the application of the symbol cd.name to the values args
+
+    """
+    write(indent + "<OMA>")
+    inner = indent + step
+    write(inner + "<OMS cd='" + cd + "' name='" + name + "' />")
+    for arg in args:
+        writeValue(arg, write, inner, step)
+    write(indent + "</OMA>")
+
+
+def writeRational(x, write, indent, step):
+    writeApplication('nums1', 'rational', (x.numerator, x.denominator),
+                     write, indent, step)
+
+
+def writeComplex(x, write, indent, step):
+    real= int(x.real) if ((x.real).is_integer()) else x.real
+    imag= int(x.imag) if ((x.imag).is_integer()) else x.imag
+    writeApplication('complex1', 'complex_cartesian', (real, imag),
+                     write, indent, step)
+
+
+def writeList(x, write, indent, step):
+    writeApplication('list1', 'list', x, write, indent, step)
+
+
+def writeInterval(x, write, indent, step):
+    writeApplication('interval1', 'integer_interval', (x.first, x.last),
+                     write, indent, step)
+
+
+def writeMatrixRow(x, write, indent, step):
+    writeApplication('linalg2', 'matrixrow', x.cells, write, indent, step)
+
+
+def writeMatrix(x, write, indent, step):
+    write(indent + "<OMA>")
+    inner = indent + step
+    write(inner + "<OMS cd='linalg2' name='matrix' />")
+    for row in x.rows:
+        writeMatrixRow(row, write, inner, step)
+    write(indent + "</OMA>")
+
+
+def writeError(x, write, indent, step):
+    write(indent + "<OME>")
+    inner = indent + step
+    write(inner + "<OMS cd='error' name='" + x.name + "' />")
+    writeElement(x.context, write, inner, step)
+    write(indent + "</OME>")
+
+
+# OM text writer of each Python type, see register_encoder
+OMwriters = {   int                 : writeInt,
+                float               : writeFloat,
+                str                 : writeStr,
+                bool                : writeBool,
+                complex             : writeComplex,
+                list                : writeList,
+                fractions.Fraction  : writeRational,
+                Matrix              : writeMatrix,
+                IntegerInterval     : writeInterval,
+                OMErrorObj          : writeError
+            }
+
+
+# writer found for each type written so far (None if unsupported)
+resolvedWriters = {}
+
+
+def resolveWriter(t):
+    """
+    returns the OM text writer for the type t: the one registered for t or
+    else for its nearest base class, or a writer of the element built by
+    the OM element converter when one is registered first
+
+    """
+    for base in t.__mro__:
+        if base in OMwriters:
+            return OMwriters[base]
+        if base in OMencoders:
+            encoder = OMencoders[base]
+            return lambda x, write, indent, step: \
+                writeElement(encoder(x), write, indent, step)
+    return None
+
+
+def writeValue(x, write, indent, step):
+    """
+    dispatches the OM text writer dependently on the type of x
+
+    """
+    t = type(x)
+    try:
+        writer = resolvedWriters[t]
+    except KeyError:
+        writer = resolvedWriters[t] = resolveWriter(t)
+    if writer is None:
+        raise ProgramErrorObj("unsupported_python_object", x)
+    writer(x, write, indent, step)
+
+
+def OMwriteObject(x, write, pretty=True):
+    """
+    writes the OM object for x as chunks of text passed to write,
+    the same text as OMwrite(OMobject(x), write) without building
+    the OM elements
+
+    """
+    step = INDENT if pretty else ''
+    indent = '\n' if pretty else ''
+    write(indent + '<OMOBJ>')
+    writeValue(x, write, indent + step, step)
+    write(indent + '</OMOBJ>')
+
+
+def OMtext(x, pretty=True):
+    """
+    returns the OM object for x as a string (pretty printed if pretty)
+
+    """
+    chunks = []
+    OMwriteObject(x, chunks.append, pretty)
+    return ''.join(chunks)
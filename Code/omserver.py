@@ -1,6 +1,26 @@
 """
 
-Multithreaded OpenMath server that evaluates OpenMath strings.
+Asynchronous OpenMath server that evaluates OpenMath strings.
+
+Connections are handled by an asyncio event loop, the evaluation of the
+received OpenMath strings runs on a pool of workers so that the event
+loop is never blocked by a long computation.
+
+Requests and results are sent as length-prefixed frames (see omprotocol).
+Requests tagged with a request id are evaluated concurrently and answered
+as soon as they are done, possibly out of order; a batch request carries
+many OpenMath objects in one frame.
+
+The responses are cached, keyed on the request bytes and on a canonical
+form of the request, so a repeated request is answered without evaluation.
+
+Requests may be OpenMath strings or binary encoded OpenMath objects; the
+results are OpenMath strings unless the client asks for binary encoded
+results with an ENCODING message (see omprotocol).
+
+    python omserver.py [host] [port] [thread|process|inline|auto]
+
+starts a server, CTRL-C (or SIGTERM) shuts it down gracefully.
 
 """
 
@@ -8,99 +28,707 @@ Multithreaded OpenMath server that evaluates OpenMath strings.
 #   imports   #
 ###############
 
-import socket
-import _thread
+import asyncio
+import functools
+import hashlib
+import logging
+import re
+import signal
 import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from openmath import *
+from omprotocol import *
+
 
+log = logging.getLogger("omserver")
 
-########################
-#   thread functions  #
-########################
 
-def client_thread(threadname, connection):
+###########################
+#   evaluation function   #
+###########################
+
+def evaluate(data):
     """
-    handles a client connection
+    evaluates the OpenMath string (or bytes) data
+    returns the result as a pretty printed OpenMath string,
+    or an "error:" string if the evaluation failed
+
+    integers of more than MAX_DIGITS digits are refused (see limitDigits)
 
     """
-    print("handling client: %s" % str(threadname))
     try:
-        while not shutdown:
-            # Receive the data from the connection
-            data = connection.recv(4096).decode()
-
-            # Handle received data
-            if data:
-                print("%s: received data" % str(threadname))
-                # Parse the string as an OpenMath string
+        with limitDigits(MAX_DIGITS):
+            omobj = ParseOMstring(data)
+        # Prettify string to send
+        return OMtext(omobj)
+    except Exception as e:
+        return "error:" + str(e)
+
+
+def evaluateBinary(data):
+    """
+    evaluates the OpenMath string (or binary encoded object) data
+    returns the result as a binary encoded OpenMath object,
+    or an "error:" string (bytes) if the evaluation failed
+
+    integers of more than MAX_DIGITS digits are refused (see limitDigits)
+
+    """
+    try:
+        with limitDigits(MAX_DIGITS):
+            omobj = ParseOMstring(data)
+        return OMbinary(omobj)
+    except Exception as e:
+        return ("error:" + str(e)).encode('utf-8')
+
+
+def evaluateBatch(documents, binary=False):
+    """
+    evaluates each OpenMath string of the list documents
+    returns the list of the results encoded in utf-8,
+    or binary encoded if binary is True
+
+    """
+    if binary:
+        return [evaluateBinary(doc) for doc in documents]
+    return [evaluate(doc).encode('utf-8') for doc in documents]
+
+
+#######################
+#   evaluation pool   #
+#######################
+
+# symbols whose evaluation time grows with the value of their arguments
+EXPENSIVE_SYMBOLS = re.compile(
+    rb'name\s*=\s*["\'](factorial|power|sum|product)["\']')
+
+OMI_VALUE = re.compile(rb'<OMI>\s*-?(\d+)\s*</OMI>')
+
+# the same symbols in a binary encoded OpenMath object
+EXPENSIVE_NAMES = re.compile(rb'factorial|power|sum|product')
+
+
+def isExpensive(data, max_size, max_value):
+    """
+    returns True if the OpenMath string (bytes) data looks expensive to
+    evaluate: it is longer than max_size bytes, or it applies factorial,
+    power, sum or product and contains an integer above max_value
+
+    a binary encoded OpenMath object is expensive as soon as it applies
+    one of these symbols, its integers are not looked at
+
+    """
+    if len(data) > max_size:
+        return True
+    if isBinary(data):
+        return EXPENSIVE_NAMES.search(data) is not None
+    if not EXPENSIVE_SYMBOLS.search(data):
+        return False
+    digits = len(str(max_value))
+    for value in OMI_VALUE.findall(data):
+        if len(value) > digits or int(value) > max_value:
+            return True
+    return False
+
+
+class Evaluator:
+    """
+    returns an evaluation pool running the evaluation of requests
+
+    mode                :   'thread', 'process', 'inline' (in the event
+                            loop) or 'auto' (expensive requests, see
+                            isExpensive, run on processes, the others
+                            on threads)
+    workers             :   number of threads
+    process_workers     :   number of processes
+    max_tasks_per_child :   processes are replaced after this many requests
+    timeout             :   seconds after which a request is answered with
+                            an error (a timed out process pool is replaced)
+    expensive_size      :   see isExpensive
+    expensive_value     :   see isExpensive
+
+    an Executor may be given as mode, all the requests then run on it
+
+    """
+    def __init__(self, mode='auto', workers=None, process_workers=None,
+                 max_tasks_per_child=None, timeout=None,
+                 expensive_size=1024 * 1024, expensive_value=10000):
+        self.mode = mode
+        self.workers = workers
+        self.process_workers = process_workers
+        self.max_tasks_per_child = max_tasks_per_child
+        self.timeout = timeout
+        self.expensive_size = expensive_size
+        self.expensive_value = expensive_value
+        self.threads = None
+        self.processes = None
+        if isinstance(mode, Executor):
+            self.threads = mode
+        elif not mode in ('thread', 'process', 'inline', 'auto'):
+            raise ValueError("unknown evaluation mode: %s" % mode)
+
+    def choosePool(self, documents):
+        """
+        returns the pool on which documents should be evaluated,
+        None for inline evaluation
+
+        """
+        if self.mode == 'inline':
+            return None
+        if self.mode == 'process':
+            return self.processPool()
+        if self.mode == 'auto':
+            if not isinstance(documents, list):
+                documents = [documents]
+            for doc in documents:
+                if isExpensive(doc, self.expensive_size, self.expensive_value):
+                    return self.processPool()
+        return self.threadPool()
+
+    def threadPool(self):
+        """
+        returns the thread pool, started on first use
+
+        """
+        if self.threads is None:
+            self.threads = ThreadPoolExecutor(self.workers)
+        return self.threads
+
+    def processPool(self):
+        """
+        returns the process pool, started on first use
+
+        """
+        if self.processes is None:
+            options = {}
+            if self.max_tasks_per_child:
+                options['max_tasks_per_child'] = self.max_tasks_per_child
+            self.processes = ProcessPoolExecutor(self.process_workers,
+                                                 **options)
+        return self.processes
+
+    def recycle(self, pool):
+        """
+        replaces the process pool pool, killing its workers
+        (the other requests sent to it are evaluated again, see run)
+
+        """
+        if not pool is self.processes:
+            return
+        self.processes = None
+        workers = list((getattr(pool, '_processes', None) or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        for process in workers:
+            process.terminate()
+        log.warning("process pool recycled")
+
+    async def run(self, function, documents):
+        """
+        returns function(documents), evaluated on the chosen pool
+        documents is an OpenMath string or a list of them
+
+        the requests cancelled or killed because their process pool was
+        recycled for another request are evaluated again on the new pool
+
+        """
+        while True:
+            pool = self.choosePool(documents)
+            if pool is None:
+                return function(documents)
+            if pool is self.processes:
+                # ship the raw bytes, memoryviews cannot be pickled
+                if isinstance(documents, list):
+                    documents = [bytes(doc) for doc in documents]
+                else:
+                    documents = bytes(documents)
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(pool, function, documents)
+            try:
+                return await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                self.recycle(pool)
+                return errorResult(documents, "timeout")
+            except BrokenProcessPool:
+                if pool is self.processes:
+                    # this request broke the pool
+                    self.recycle(pool)
+                    return errorResult(documents, "evaluation worker died")
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling() or \
+                   not future.cancelled() or pool is self.processes:
+                    raise   # the request itself was cancelled
+
+    async def offload(self, function, *args):
+        """
+        returns function(*args), computed on the thread pool
+        (in the event loop in 'inline' mode)
+
+        """
+        if self.mode == 'inline':
+            return function(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.threadPool(), function, *args)
+
+    def shutdown(self):
+        if self.threads is not None:
+            self.threads.shutdown(wait=False)
+        if self.processes is not None:
+            self.processes.shutdown(wait=False, cancel_futures=True)
+
+
+def errorResult(documents, message):
+    """
+    returns the error result for documents, shaped as the result
+    of evaluate (one document) or evaluateBatch (list of documents)
+
+    """
+    if isinstance(documents, list):
+        return [("error:" + message).encode('utf-8')] * len(documents)
+    return "error:" + message
+
+
+####################
+#   result cache   #
+####################
+
+# requests up to this size are looked up in the cache from the event
+# loop, the digests of longer ones are computed on a thread
+INLINE_SIZE = 16 * 1024
+
+def canonicalOM(data):
+    """
+    returns a canonical form (bytes) of the OpenMath string data:
+    no comments, no white space around elements or inside values
+    (except strings), attributes sorted by name
+
+    """
+    root = ET.fromstring(data)
+    for node in root.iter():
+        node.tail = None
+        if node.text is not None and not node.tag == 'OMSTR':
+            node.text = node.text.strip() or None
+        if len(node.attrib) > 1:
+            node.attrib = dict(sorted(node.attrib.items()))
+    return ET.tostring(root)
+
+
+def digest(data, variant=b''):
+    return hashlib.blake2b(data, digest_size=16, person=variant).digest()
+
+
+def canonicalDigest(data, variant=b''):
+    """
+    returns the digest of the canonical form of the OpenMath string data,
+    None if it cannot be canonicalised
+
+    """
+    try:
+        return digest(canonicalOM(data), variant)
+    except ET.ParseError:
+        return None
+
+
+def mentionsImpure(data):
+    """
+    returns True if the request data (bytes or memoryview, in either
+    encoding) may apply an impure symbol (see register_impure): its cd
+    and its name both occur in data
+
+    """
+    for cd, name in impureSymbols:
+        if re.search(re.escape(cd.encode('utf-8')), data) and \
+           re.search(re.escape(name.encode('utf-8')), data):
+            return True
+    return False
+
+
+async def inline(function, *args):
+    return function(*args)
+
+
+class ResultCache:
+    """
+    returns a cache of responses (bytes) keyed on requests
+
+    max_bytes           :   bound on the size of the cached entries,
+                            the least recently used entries are evicted
+    ttl                 :   seconds an entry stays valid, None for ever
+    canonical_size      :   requests up to this size are also looked up
+                            by their canonical form (see canonicalOM)
+
+    the requests that may apply an impure symbol are not cached
+
+    """
+    # approximate memory used by an entry besides its response
+    ENTRY_OVERHEAD = 128
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=None,
+                 canonical_size=64 * 1024):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.canonical_size = canonical_size
+        self.entries = OrderedDict()    # key -> (response, expiry time)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def lookup(self, data, variant=b'', run=inline):
+        """
+        returns (response, None) if the request data is cached,
+        otherwise (None, keys) where keys are passed to store
+
+        variant (up to 16 bytes) tells apart the responses to the same
+        request in different encodings
+
+        the digests are computed by the coroutine run(function, *args),
+        which may run them off the event loop (see OMServer.offload);
+        the canonical form is only computed if the bytes are not cached
+
+        """
+        if mentionsImpure(data):
+            # the response may change from one evaluation to the next
+            self.misses += 1
+            return None, []
+        keys = [await run(digest, data, variant)]
+        response = self.get(keys[0])
+        if response is None and len(data) <= self.canonical_size:
+            key = await run(canonicalDigest, data, variant)
+            # if None, cannot be canonicalised, only the bytes are used
+            if key is not None:
+                keys.append(key)
+                response = self.get(key)
+                if response is not None:
+                    # next time the same bytes are found by their digest
+                    self.store(keys[:1], response)
+        if response is None:
+            self.misses += 1
+            return None, keys
+        self.hits += 1
+        return response, None
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        response, expiry = entry
+        if expiry is not None and expiry < time.monotonic():
+            self.remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return response
+
+    def store(self, keys, response):
+        """
+        caches response under each of keys
+
+        """
+        cost = len(response) + self.ENTRY_OVERHEAD
+        if cost > self.max_bytes:
+            return
+        expiry = None if self.ttl is None else time.monotonic() + self.ttl
+        for key in keys:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (response, expiry)
+            self.size += cost
+        while self.size > self.max_bytes:
+            key = next(iter(self.entries))
+            self.remove(key)
+            self.evictions += 1
+
+    def remove(self, key):
+        response, expiry = self.entries.pop(key)
+        self.size -= len(response) + self.ENTRY_OVERHEAD
+
+    def stats(self):
+        """
+        returns the counters of the cache as a dictionary
+
+        """
+        return {'hits'      : self.hits,
+                'misses'    : self.misses,
+                'evictions' : self.evictions,
+                'entries'   : len(self.entries),
+                'bytes'     : self.size}
+
+
+##############
+#   server   #
+##############
+
+class OMServer:
+    """
+    returns an OpenMath server listening on host, port
+
+    backlog             :   size of the queue of pending connections
+    max_connections     :   clients above this number are turned away
+    max_frame_size      :   longest request accepted, in bytes
+    max_in_flight       :   tagged requests evaluated at once per connection
+    cache_size          :   bound on the cached responses in bytes,
+                            0 disables the cache (see ResultCache)
+    cache_ttl           :   seconds a cached response stays valid
+    executor            :   evaluation mode or Executor, see Evaluator
+    **options           :   other options of the Evaluator
+
+    """
+    def __init__(self, host='localhost', port=10000, backlog=128,
+                 max_connections=1024, max_frame_size=MAX_FRAME_SIZE,
+                 max_in_flight=64, cache_size=64 * 1024 * 1024,
+                 cache_ttl=None, executor='auto', **options):
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.max_connections = max_connections
+        self.max_frame_size = max_frame_size
+        self.max_in_flight = max_in_flight
+        self.evaluator = Evaluator(executor, **options)
+        self.cache = ResultCache(cache_size, cache_ttl) if cache_size else None
+        self.server = None
+        self.clients = set()        # tasks handling the open connections
+        self.stopped = None
+
+    async def start(self):
+        """
+        starts listening, returns once the socket is bound
+
+        """
+        self.stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        self.server = await loop.create_server(
+            lambda: FrameProtocol(self.handle_client, self.max_frame_size),
+            self.host, self.port, backlog=self.backlog)
+        # the port may have been chosen by the system (port 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        log.info("OpenMath server listening on %s port %s",
+                 self.host, self.port)
+
+    async def serve_forever(self):
+        """
+        starts the server if needed, returns when it has been stopped
+
+        """
+        if self.server is None:
+            await self.start()
+        await self.stopped.wait()
+
+    async def stop(self, timeout=5):
+        """
+        stops accepting connections, gives the open connections
+        timeout seconds to finish, then closes them
+
+        """
+        if self.server is None:
+            return
+        log.info("OpenMath server shutdown initiated")
+        self.server.close()
+        if self.clients:
+            done, pending = await asyncio.wait(self.clients, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        # only once the connections are closed: wait_closed waits for
+        # them (Python 3.12 and later)
+        await self.server.wait_closed()
+        self.evaluator.shutdown()
+        if self.cache is not None:
+            log.info("result cache: %s", self.cache.stats())
+        log.info("memoized symbols: %s", memo.stats())
+        self.server = None
+        self.stopped.set()
+
+    async def handle_client(self, connection):
+        """
+        handles a client connection (an omprotocol.FrameProtocol)
+
+        """
+        peer = connection.transport.get_extra_info('peername')
+        if len(self.clients) >= self.max_connections:
+            log.warning("%s: too many connections, turned away", peer)
+            await connection.write_frame(b"error:too many connections")
+            connection.close()
+            return
+        task = asyncio.current_task()
+        self.clients.add(task)
+        log.debug("%s: connected", peer)
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        requests = set()            # tasks evaluating tagged requests
+        binary = False              # encoding of the results
+        try:
+            while True:
+                # Receive a request from the connection
                 try:
-                    omobj = ParseOMstring(data)
-                    # Prettify string to send
-                    result = OMprettystring(OMobject(omobj), 0)
-                except Exception as e:
-                    result = "error:" + str(e)
-                # Send result
-                print("%s: sending data back to the client" % str(threadname))
-                connection.sendall(result.encode('utf-8'))
+                    data = await connection.read_frame()
+                    if data is None:
+                        break
+                    kind, request_id, documents = decodeMessage(data)
+                except ProtocolError as e:
+                    await connection.write_frame(
+                        ("error:" + str(e)).encode('utf-8'))
+                    break
+                if kind is None:
+                    # untagged request, answered before reading the next one
+                    result = await self.respond(documents, binary)
+                    await connection.write_frame(result)
+                    continue
+                if kind == ENCODING:
+                    # the results of the next requests use this encoding
+                    name = bytes(documents)
+                    if name in ENCODINGS:
+                        binary = name == b'binary'
+                    else:
+                        name = b"error:unknown_encoding: " + name
+                    await connection.write_frame(
+                        encodeMessage(kind, request_id, name))
+                    continue
+                # tagged request, answered whenever it is done
+                await in_flight.acquire()
+                request = asyncio.ensure_future(self.answer(
+                    connection, kind, request_id, documents, binary,
+                    in_flight))
+                requests.add(request)
+                request.add_done_callback(requests.discard)
+            # let the requests in flight finish before closing
+            if requests:
+                await asyncio.wait(requests)
+        except (ConnectionError, asyncio.CancelledError):
+            for request in requests:
+                request.cancel()
+        finally:
+            # Clean up the connection
+            self.clients.discard(task)
+            connection.close()
+            log.debug("%s: closed connection", peer)
+
+    async def answer(self, connection, kind, request_id, documents, binary,
+                     in_flight):
+        """
+        evaluates a tagged request and sends its answer
+
+        """
+        try:
+            if kind == SINGLE:
+                result = await self.respond(documents, binary)
             else:
-                # No data received
-                print("%s: no data received" % str(threadname))
-                break
-    finally:
-        # Clean up the connection
-        connection.close()
-        print("%s: closed connection" % str(threadname))
+                result = await self.respondBatch(documents, binary)
+            await connection.write_frame(
+                encodeMessage(kind, request_id, result))
+        except ConnectionError:
+            pass
+        finally:
+            in_flight.release()
 
-def keyboard_thread(threadname, keyword):
+    async def respond(self, document, binary=False):
+        """
+        returns the response (bytes) to the OpenMath string document,
+        binary encoded if binary is True, from the cache if possible
+
+        """
+        function = evaluateBinary if binary else evaluate
+        if self.cache is None:
+            return toBytes(await self.evaluate(function, document))
+        response, keys = await self.cache.lookup(
+            document, encodingKey(binary), self.offload)
+        if response is None:
+            response = toBytes(await self.evaluate(function, document))
+            if not response.startswith(b"error:"):
+                self.cache.store(keys, response)
+        return response
+
+    async def respondBatch(self, documents, binary=False):
+        """
+        returns the list of the responses (bytes) to the OpenMath strings
+        of the list documents, binary encoded if binary is True,
+        the ones not cached are evaluated together
+
+        """
+        function = functools.partial(evaluateBatch, binary=binary)
+        if self.cache is None:
+            return await self.evaluate(function, documents)
+        responses = [None] * len(documents)
+        missing = []        # (index, keys) of the documents to evaluate
+        for i, doc in enumerate(documents):
+            responses[i], keys = await self.cache.lookup(
+                doc, encodingKey(binary), self.offload)
+            if keys is not None:
+                missing.append((i, keys))
+        if missing:
+            results = await self.evaluate(
+                function, [documents[i] for i, _ in missing])
+            for (i, keys), response in zip(missing, results):
+                responses[i] = response
+                if not response.startswith(b"error:"):
+                    self.cache.store(keys, response)
+        return responses
+
+    async def evaluate(self, function, documents):
+        """
+        runs function(documents) on the evaluation pool
+
+        """
+        return await self.evaluator.run(function, documents)
+
+    async def offload(self, function, data, *args):
+        """
+        returns function(data, *args), computed off the event loop if
+        data is longer than INLINE_SIZE bytes (see Evaluator.offload)
+
+        """
+        if len(data) <= INLINE_SIZE:
+            return function(data, *args)
+        return await self.evaluator.offload(function, data, *args)
+
+
+def toBytes(response):
+    return response.encode('utf-8') if isinstance(response, str) else response
+
+
+def encodingKey(binary):
     """
-    wait for keyword input from keyboard then shuts down server
+    returns the cache variant of the responses in the encoding binary
 
     """
-    # Read keyboard input
-    key_in = sys.stdin.readline()
-    while key_in and not key_in.strip() == keyword:
-        key_in = sys.stdin.readline()
-    # Set shutdown flag
-    global shutdown
-    shutdown = True
-    print("%s: server shutdown initiated" % threadname)
+    return b'binary' if binary else b''
 
 
 ##################
 #   run server   #
 ##################
 
-# Create a TCP/IP socket
-sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-sock.settimeout(5)
+async def serve(server):
+    """
+    runs server until SIGINT or SIGTERM is received
+
+    """
+    await server.start()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(
+                sig, lambda: asyncio.ensure_future(server.stop()))
+        except (NotImplementedError, RuntimeError):
+            pass    # signal handlers are not supported (e.g. Windows)
+    await server.serve_forever()
 
-# Global flag for to stop all threads
-shutdown = False
 
-# Bind the socket to the port
-server_address = ('localhost', 10000)
-print("starting up OpenMath server on %s port %s" % server_address)
-sock.bind(server_address)
+def run(host='localhost', port=10000, **options):
+    """
+    runs an OpenMath server on host, port (see OMServer for the options)
 
-# Listen for incoming connections
-sock.listen(1)
+    """
+    asyncio.run(serve(OMServer(host, port, **options)))
 
-# Start keyboard thread
-quit_keyword = ":q"
-_thread.start_new_thread(keyboard_thread, ("keyboard", quit_keyword))
-print("type CTRL-D or \":q\" to shutdown server")
 
-# Connection loop
-while not shutdown:
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    args = sys.argv[1:]
+    host = args[0] if len(args) > 0 else 'localhost'
+    port = int(args[1]) if len(args) > 1 else 10000
+    mode = args[2] if len(args) > 2 else 'auto'
     try:
-        # Wait for a connection
-        print('waiting for a connection')
-        connection, client_address = sock.accept()
-        print('connected to', client_address)
-        # Start new thread that handles client
-        _thread.start_new_thread(client_thread, (client_address, connection))
-    except socket.timeout:
-        continue
-
-# Shutdown socket read and write
-sock.shutdown(socket.SHUT_RDWR)
+        run(host, port, executor=mode)
+    except KeyboardInterrupt:
+        pass
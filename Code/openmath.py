@@ -14,36 +14,195 @@ Element = ET.Element
 SubElement = ET.SubElement
 from omparse import *
 from omput import *
+from ombinary import ParseOMbinary, OMbinary, isBinary, \
+                     register_binary_writer
 from os import *
+import builtins
+import hashlib
+import json
+import mmap
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 
 ######################################################
 #   functions for processing OM and Python objects   #
 ######################################################
 
-def ParseOMfile(fname):
+def ParseOMfile(fname, mapped=False):
     """
-    converts a file containing an OM string into a python object
+    converts a file containing an OM string (or a binary encoded
+    OM object) into a python object
+
+    if mapped is True, the file is mapped in memory and parsed from
+    there (see mappedFile)
 
     """
     if not path.isfile(fname):
         return ProgramErrorObj("file_not_found",fname)
+    if mapped:
+        with mappedFile(fname) as data:
+            if isBinary(data):
+                return ParseOMbinary(data)
+            parser = ET.XMLParser()
+            for chunk in mappedChunks(data):
+                parser.feed(chunk)
+            root = parser.close()
+        return ParseOMroot(root)
+    with builtins.open(fname, 'rb') as f:
+        if isBinary(f.read(1)):
+            f.seek(0)
+            return ParseOMbinary(f.read())
     tree = ET.parse(fname)
     root = tree.getroot()
     omobj = ParseOMroot(root)
     return omobj
 
 
+def ParseOMstream(source, mapped=False):
+    """
+    converts an OM file (name or binary file object) into a python object,
+    evaluating it while it is read, in bounded memory (see OMEventParser)
+
+    if mapped is True, the file is mapped in memory and parsed from
+    there (see mappedFile), and may be a binary encoded OM object
+
+    """
+    if mapped:
+        with mappedFile(source) as data:
+            if isBinary(data):
+                return ParseOMbinary(data)
+            return parseEvents(mappedEvents(data))
+    return parseEvents(ET.iterparse(source, events=('start', 'end')))
+
+
+def parseEvents(events):
+    """
+    returns the value of the OM object given by the (event, element)
+    pairs events, see OMEventParser
+
+    """
+    parser = OMEventParser()
+    for event, elem in events:
+        parser.event(event, elem)
+        if parser.done:
+            break
+    return parser.result
+
+
+# size of the pieces of a memory mapped file fed to the XML parser
+# (the events of a piece are kept until they are read, see mappedEvents)
+MAPPED_CHUNK = 1 << 16
+
+
+@contextmanager
+def mappedFile(source):
+    """
+    returns (as a context manager) the content of the file source (name
+    or binary file object) mapped in memory, read only
+
+    the pages of the file are read by the system as they are accessed,
+    without copying the file into a python object: bytes, views and
+    slices of the content must not be kept after the context is left
+
+    """
+    if isinstance(source, str):
+        with builtins.open(source, 'rb') as f, mappedFile(f) as data:
+            yield data
+        return
+    if fstat(source.fileno()).st_size == 0:
+        yield b''       # an empty file cannot be mapped
+        return
+    data = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        yield data
+    finally:
+        try:
+            data.close()
+        except BufferError:
+            pass        # still viewed (by a traceback), unmapped once freed
+
+
+def mappedChunks(data):
+    """
+    yields data (bytes or memory mapped file) in views of MAPPED_CHUNK
+    bytes (no copy), each released once the next one is asked for
+
+    """
+    with memoryview(data) as view:
+        for i in range(0, len(view), MAPPED_CHUNK):
+            with view[i:i+MAPPED_CHUNK] as chunk:
+                yield chunk
+
+
+def mappedEvents(data):
+    """
+    yields the (event, element) pairs of the XML document data (bytes or
+    memory mapped file), parsed a MAPPED_CHUNK bytes at a time
+
+    """
+    xmlparser = ET.XMLPullParser(events=('start', 'end'))
+    for chunk in mappedChunks(data):
+        xmlparser.feed(chunk)
+        yield from xmlparser.read_events()
+    xmlparser.close()
+    yield from xmlparser.read_events()
+
+
+class OMStreamParser:
+    """
+    returns a parser to which an OM string is fed in pieces (e.g. as
+    it is received from a socket), evaluated while it is received
+
+    """
+    def __init__(self):
+        self.xmlparser = ET.XMLPullParser(events=('start', 'end'))
+        self.parser = OMEventParser()
+
+    def feed(self, data):
+        """
+        parses the next piece of the OM string (bytes or string),
+        returns True once the OM object is complete
+
+        """
+        if not self.parser.done:
+            self.xmlparser.feed(data)
+            for event, elem in self.xmlparser.read_events():
+                self.parser.event(event, elem)
+                if self.parser.done:
+                    break
+        return self.parser.done
+
+    def close(self):
+        """
+        returns the python object for the OM string fed so far
+
+        """
+        if not self.parser.done:
+            self.xmlparser.close()
+            for event, elem in self.xmlparser.read_events():
+                self.parser.event(event, elem)
+        return self.parser.result
+
+
 def ParseOMstring(omstring):
     """
-    converts an OM string to a python object
+    converts an OM string (or binary encoded OM object, see ombinary)
+    to a python object
 
     """
+    if not isinstance(omstring, str) and isBinary(omstring):
+        return ParseOMbinary(omstring)
     root = ET.fromstring(omstring)
     omobj = ParseOMroot(root)
     return omobj
 
 
-def process(fileIN, fileOUT):
+def process(fileIN, fileOUT, stream=False, manifest=None, mapped=False):
     """
     processes the openmath contents of fileIN
     >> converts result to openmath format
@@ -52,18 +211,338 @@ def process(fileIN, fileOUT):
     returns the result packaged into a PythonOM object,
     which contains the result in both formats
 
+    if stream is True, the result is written to fileOUT as it is
+    converted and the openmath format is not kept in the PythonOM object
+
+    if a Manifest is given, fileIN is skipped when fileOUT was produced
+    from the same content by the same evaluator (the PythonOM object is
+    then empty, with skipped True), and fileOUT is recorded otherwise
+
+    if mapped is True, fileIN is mapped in memory (see ParseOMfile)
+
     """
+    if manifest is not None:
+        input_hash = fileHash(fileIN)
+        if manifest.unchanged(fileOUT, input_hash):
+            manifest.skipped += 1
+            return PythonOM(None, None, skipped=True)
     # # processes the contents of fileIN, gets result as omobj
     # gets result as python object
-    pythObj= ParseOMfile(fileIN)
+    pythObj= ParseOMfile(fileIN, mapped)
     if isinstance(pythObj,ProgramErrorObj):
+        if manifest is not None:
+            manifest.fail(fileOUT)
         return pythObj
-    # converts result to string in openmath format
-    omstring = OMprettystring(OMobject(pythObj),0)
-    writeToFile(fileOUT, omstring)
+    if stream:
+        omstring = None
+        output_hash = atomicWrite(fileOUT,
+                                  lambda write: OMwriteObject(pythObj, write))
+    else:
+        # converts result to string in openmath format
+        omstring = OMtext(pythObj)
+        output_hash = writeToFile(fileOUT, omstring)
+    if manifest is not None:
+        manifest.record(fileOUT, input_hash, output_hash)
 
     # packages result into a PythonOM object
-    return PythonOM(pythObj,omstring)
+    return PythonOM(pythObj, omstring, output_hash=output_hash)
+
+########################
+#   batch processing   #
+########################
+
+class ProcessResult:
+    """
+    returns the outcome of processing the file name (see process_many):
+    status is 'done', 'skipped' (unchanged input) or 'failed' (error is
+    then the reason), seconds the time spent processing it and
+    output_hash the hash of the output written
+
+    """
+    def __init__(self, name, status, seconds=0.0, error=None,
+                 output_hash=None):
+        self.name = name
+        self.status = status
+        self.seconds = seconds
+        self.error = error
+        self.output_hash = output_hash
+    def __repr__(self):
+        return "ProcessResult(%r, %r, %.6f, %r)" % (self.name, self.status,
+                                                   self.seconds, self.error)
+
+
+def process_many(inputs, out_dir, workers=None, force=False, chunk=16,
+                 mapped=False):
+    """
+    processes each OM file of inputs (file or directory names) into the
+    file of the same name in out_dir, on a pool of workers processes
+
+    yields a ProcessResult for each file as soon as it is processed
+
+    an input whose content has not changed since it was last processed
+    into out_dir by the same evaluator is skipped (unless force is True),
+    see Manifest
+    an input with the name of an earlier input (from another directory)
+    fails, it would overwrite its output; so do the files processed by a
+    worker process that died
+    workers             :   number of processes, None for one per CPU,
+                            0 to process the files in this process
+    chunk               :   number of files sent to a process at once
+    mapped              :   True to map the inputs in memory (see
+                            ParseOMfile)
+
+    """
+    files = inputFiles(inputs)
+    if not path.isdir(out_dir):
+        makedirs(out_dir)
+    with Manifest(out_dir) as manifest:
+        todo = []
+        names = {}              # output name -> input
+        for fileIN in files:
+            name = path.basename(fileIN)
+            fileOUT = path.join(out_dir, name)
+            if name in names:
+                manifest.failed += 1
+                yield ProcessResult(name, 'failed', error=
+                                    "%s: same output as %s"
+                                    % (fileIN, names[name]))
+                continue
+            names[name] = fileIN
+            digest = fileHash(fileIN)
+            if not force and manifest.unchanged(fileOUT, digest):
+                manifest.skipped += 1
+                yield ProcessResult(name, 'skipped')
+                continue
+            todo.append((fileIN, fileOUT, digest))
+        chunks = [todo[i:i+chunk] for i in range(0, len(todo), chunk)]
+        if workers == 0:
+            for part in chunks:
+                results = processChunk(part, mapped)
+                for result in recordResults(results, part, manifest):
+                    yield result
+        elif chunks:
+            with ProcessPoolExecutor(workers) as pool:
+                futures = {pool.submit(processChunk, part, mapped) : part
+                           for part in chunks}
+                for future in as_completed(futures):
+                    part = futures[future]
+                    try:
+                        results = future.result()
+                    except BrokenProcessPool as e:
+                        results = [ProcessResult(path.basename(fileIN),
+                                                 'failed', error=
+                                                 "worker died: %s" % e)
+                                   for fileIN, _, _ in part]
+                    for result in recordResults(results, part, manifest):
+                        yield result
+
+
+def processChunk(part, mapped=False):
+    """
+    processes the files of part, a list of (fileIN, fileOUT, digest)
+    returns the list of their ProcessResult
+
+    """
+    results = []
+    for fileIN, fileOUT, _ in part:
+        name = path.basename(fileIN)
+        start = time.perf_counter()
+        try:
+            result = process(fileIN, fileOUT, stream=True, mapped=mapped)
+        except Exception as e:
+            result = ProgramErrorObj(type(e).__name__, str(e))
+        seconds = time.perf_counter() - start
+        if isinstance(result, ProgramErrorObj):
+            results.append(ProcessResult(name, 'failed', seconds,
+                                         "%s: %s" % (result.name,
+                                                     result.context)))
+        else:
+            results.append(ProcessResult(name, 'done', seconds,
+                                         output_hash=result.output_hash))
+    return results
+
+
+def recordResults(results, part, manifest):
+    """
+    records the outcome of processing the files of part in manifest,
+    returns results
+
+    """
+    for result, (_, fileOUT, digest) in zip(results, part):
+        if result.status == 'done':
+            manifest.record(fileOUT, digest, result.output_hash)
+        else:
+            manifest.fail(fileOUT)
+    return results
+
+
+def inputFiles(inputs):
+    """
+    returns the list of the files named in inputs, with the files of the
+    directories named in inputs (sorted by name)
+
+    """
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    files = []
+    for name in inputs:
+        if path.isdir(name):
+            files.extend(path.join(name, f) for f in sorted(listdir(name))
+                         if path.isfile(path.join(name, f)))
+        else:
+            files.append(name)
+    return files
+
+
+def fileHash(fname):
+    """
+    returns the hash of the content of the file fname (hex string)
+
+    """
+    with builtins.open(fname, 'rb') as f:
+        return hashlib.file_digest(f, 'blake2b').hexdigest()
+
+
+# name of the manifest file of an output directory
+MANIFEST_FILE = '.openmath_manifest'
+
+# changed by hand when outputs must be recomputed although the code
+# of the evaluator is the same (the hash of the code is part of the
+# evaluator version, see evaluatorVersion)
+EVALUATOR_VERSION = '1'
+
+# modules whose code determines the result of processing a file
+# (with this one)
+EVALUATOR_MODULES = ['arith_func', 'linalg_func', 'omparse', 'omput',
+                     'ombinary']
+
+evaluator_version = None
+
+
+def evaluatorVersion():
+    """
+    returns the version of the evaluator: EVALUATOR_VERSION and the hash
+    of the code of the EVALUATOR_MODULES
+
+    """
+    global evaluator_version
+    if evaluator_version is None:
+        h = hashlib.blake2b(digest_size=8)
+        for name in EVALUATOR_MODULES:
+            module = sys.modules.get(name) or __import__(name)
+            with builtins.open(module.__file__, 'rb') as f:
+                h.update(f.read())
+        evaluator_version = EVALUATOR_VERSION + '-' + h.hexdigest()
+    return evaluator_version
+
+
+class Manifest:
+    """
+    returns the manifest of the files processed into the directory
+    out_dir, kept in its file MANIFEST_FILE: for each output file, the
+    hash of its input, the version of the evaluator (see evaluatorVersion)
+    and the hash of the output
+
+    skipped, recomputed and failed count the files processed with it
+    used as a context manager, the manifest is saved on exit
+
+    """
+    def __init__(self, out_dir):
+        self.fname = path.join(out_dir, MANIFEST_FILE)
+        self.version = evaluatorVersion()
+        self.entries = {}
+        self.skipped = 0
+        self.recomputed = 0
+        self.failed = 0
+        if path.isfile(self.fname):
+            try:
+                with builtins.open(self.fname) as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                pass    # unreadable, every input is processed again
+
+    def unchanged(self, fileOUT, input_hash):
+        """
+        returns True if fileOUT is in place and was produced from an
+        input with hash input_hash by this version of the evaluator
+
+        """
+        entry = self.entries.get(path.basename(fileOUT))
+        return entry is not None and entry['input'] == input_hash and \
+               entry['version'] == self.version and \
+               path.isfile(fileOUT) and fileHash(fileOUT) == entry['output']
+
+    def record(self, fileOUT, input_hash, output_hash):
+        self.entries[path.basename(fileOUT)] = {'input'   : input_hash,
+                                                'version' : self.version,
+                                                'output'  : output_hash}
+        self.recomputed += 1
+
+    def fail(self, fileOUT):
+        self.entries.pop(path.basename(fileOUT), None)
+        self.failed += 1
+
+    def save(self):
+        atomicWrite(self.fname, lambda write: write(
+            json.dumps(self.entries, indent=0, sort_keys=True)))
+
+    def stats(self):
+        """
+        returns the counters of the files processed as a dictionary
+
+        """
+        return {'skipped'       : self.skipped,
+                'recomputed'    : self.recomputed,
+                'failed'        : self.failed}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.save()
+
+
+def main(args):
+    """
+    processes OM files from the command line:
+
+        python openmath.py [-j workers] [-f] [-m] out_dir input ...
+
+    -f processes the inputs even if unchanged, -m maps them in memory
+    prints the time spent on each file and a summary
+
+    """
+    workers = None
+    force = False
+    mapped = False
+    while args and args[0].startswith('-'):
+        option = args.pop(0)
+        if option == '-j':
+            workers = int(args.pop(0))
+        elif option == '-f':
+            force = True
+        elif option == '-m':
+            mapped = True
+        else:
+            args = []
+            break
+    if len(args) < 2:
+        print(main.__doc__)
+        return 2
+    counts = {'done' : 0, 'skipped' : 0, 'failed' : 0}
+    start = time.perf_counter()
+    for result in process_many(args[1:], args[0], workers, force,
+                               mapped=mapped):
+        counts[result.status] += 1
+        if result.status == 'failed':
+            print("%-40s failed     %s" % (result.name, result.error))
+        elif result.status == 'done':
+            print("%-40s %8.3f ms" % (result.name, result.seconds * 1000))
+    print("%d recomputed, %d skipped, %d failed in %.3f s"
+          % (counts['done'], counts['skipped'], counts['failed'],
+             time.perf_counter() - start))
+    return 1 if counts['failed'] else 0
+
 
 ##############################
 #   functions for printing   #
@@ -74,7 +553,7 @@ def OMprint( x ):
     prints a python object in OM format using pretty printing
 
     """
-    print( OMprettystring( OMobject( x ), 0 ) )
+    print( OMtext( x ) )
 
 
 def OMstring( x ):
@@ -90,21 +569,9 @@ def OMprettystring( obj, level ):
     returns an OM string with appropriate indentation
 
     """
-    string = '\n' + level * 4 * ' ' + '<' + obj.tag
-    for value,key in obj.attrib.items():
-        string += ' {}=\'{}\''.format(value,key)
-    if obj.text:
-        string += '>'
-        string += str(obj.text)
-        string += '</' + obj.tag + '>'
-    elif obj:
-        string += '>'
-        for child in obj:
-            string += OMprettystring( child, level+1 )
-        string += '\n' + level * 4 * ' ' + '</' + obj.tag + '>'
-    else:
-        string += " />"
-    return string
+    chunks = []
+    OMwrite( obj, chunks.append, level )
+    return ''.join( chunks )
 
 
 #################
@@ -112,15 +579,89 @@ def OMprettystring( obj, level ):
 #################
 
 class PythonOM:
-    def __init__(self,pyth,omstring):
+    def __init__(self,pyth,omstring,skipped=False,output_hash=None):
         self.python= pyth
         self.openmath= omstring
+        self.skipped= skipped           # see process
+        self.output_hash= output_hash   # hash of the file written
+
+
+def writeToFile(filename, string):
+    """
+    writes string to file filename (atomically, see atomicWrite)
+    returns the hash of the content written
+
+    """
+    return atomicWrite(filename, lambda write: write(string))
 
 
-def writeToFile(filename, str):
+def atomicWrite(filename, produce):
     """
-    writes string to file filename
+    calls produce(write), write writing chunks of text to file filename
+    returns the hash of the text written (hex string)
+
+    the text goes to a temporary file renamed to filename once complete,
+    so filename is either left as it was or holds the whole text
+    (never a part of it, if produce fails or the program is interrupted)
+    the text is written in UTF-8 as it is (no newline translation, the
+    hash is the one of the file, see fileHash), the file gets the mode
+    of a file created by open
+
+    """
+    directory = path.dirname(path.abspath(filename))
+    fd, temp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    h = hashlib.blake2b()
+    try:
+        # mkstemp creates the file readable by its owner only
+        os.chmod(temp, 0o666 & ~currentUmask())
+        with builtins.open(fd, 'w', encoding='utf-8', newline='') as f:
+            def write(chunk):
+                h.update(chunk.encode('utf-8'))
+                f.write(chunk)
+            produce(write)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, filename)
+    except BaseException:
+        os.remove(temp)
+        raise
+    return h.hexdigest()
+
+
+def currentUmask():
+    """
+    returns the umask of the process, from /proc/self/status where there
+    is one, otherwise as it was when this module was imported
+
+    """
+    try:
+        with builtins.open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('Umask:'):
+                    return int(line.split()[1], 8)
+    except OSError:
+        pass
+    return importUmask
+
+
+def readUmask():
+    """
+    returns the umask of the process, read by setting it (and back)
+
+    while it is set, the files created by other threads get the wrong
+    mode: only called on import, see currentUmask
 
     """
-    f = open(filename, 'w')
-    f.write(str)
+    mask = os.umask(0o022)
+    os.umask(mask)
+    return mask
+
+importUmask = readUmask()
+
+
+#####################
+#   run from CLI    #
+#####################
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,100 @@
+"""
+
+Module contains unit tests of the binary encoding of OpenMath objects
+(ombinary)
+
+    python -m unittest test_binary
+
+"""
+
+###############
+#   imports   #
+###############
+
+import fractions
+import unittest
+from openmath import *
+from ombinary import *
+
+
+##################
+#   test cases   #
+##################
+
+class TestRoundTrip(unittest.TestCase):
+
+    def assertRoundTrip(self, x):
+        data = OMbinary(x)
+        self.assertTrue(isBinary(data))
+        self.assertEqual(ParseOMbinary(data), x)
+        self.assertEqual(ParseOMstring(data), x)
+
+    def test_integers(self):
+        for x in [0, 1, -1, 127, -128, 128, -129, 2**31 - 1, -2**31,
+                  2**31, -2**31 - 1, 10**100, -10**100, 7**5000]:
+            self.assertRoundTrip(x)
+
+    def test_values(self):
+        for x in [2.5, -0.0, "", "abc", "€ uro", True, False,
+                  fractions.Fraction(-3, 7), complex(1, -2),
+                  [1, [2, "a"], "a", 3.5]]:
+            self.assertRoundTrip(x)
+
+    def test_matrix(self):
+        self.assertRoundTrip(Matrix([[1, 2], [3, 4]]))
+
+    def test_shared_symbols(self):
+        x = [[1, 2], [3, [4]]]
+        data = OMbinary(x)
+        # list1.list is written once, then referenced
+        self.assertEqual(data.count(b'list1'), 1)
+        self.assertEqual(ParseOMbinary(data), x)
+
+
+class TestLayout(unittest.TestCase):
+
+    def test_big_integer_layout(self):
+        data = OMbinary(-12345678901)
+        # OMOBJ, token, length, sign, base (0: decimal), digits,
+        # end of OMOBJ
+        self.assertEqual(data, bytes([TOKEN_OBJECT, TOKEN_BIGINT, 11,
+                                      ord('-'), 0]) + b'12345678901' +
+                               bytes([TOKEN_OBJECT_END]))
+
+    def test_big_integer_hex(self):
+        for base in (0x40, 16):
+            data = bytes([TOKEN_OBJECT, TOKEN_BIGINT, 10, ord('+'), base]) + \
+                   b'ffffffffff' + bytes([TOKEN_OBJECT_END])
+            self.assertEqual(ParseOMbinary(data), 16**10 - 1)
+
+    def test_big_integer_base_ten(self):
+        # written by some implementations
+        data = bytes([TOKEN_OBJECT, TOKEN_BIGINT, 11, ord('-'), 10]) + \
+               b'12345678901' + bytes([TOKEN_OBJECT_END])
+        self.assertEqual(ParseOMbinary(data), -12345678901)
+
+    def test_big_integer_unknown_base(self):
+        data = bytes([TOKEN_OBJECT, TOKEN_BIGINT, 2, ord('+'), 7]) + \
+               b'12' + bytes([TOKEN_OBJECT_END])
+        with self.assertRaises(ProgramErrorObj):
+            ParseOMbinary(data)
+
+    def test_identified_token(self):
+        # an integer with an id is not read as an integer
+        data = bytes([TOKEN_OBJECT, TOKEN_INT | IDENTIFIED, 1, 5,
+                      TOKEN_OBJECT_END])
+        with self.assertRaises(ProgramErrorObj):
+            ParseOMbinary(data)
+
+    def test_truncated(self):
+        data = OMbinary(10**30)
+        with self.assertRaises(ProgramErrorObj):
+            ParseOMbinary(data[:-3])
+
+
+######################
+#   run the tests    #
+######################
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+"""
+
+Module contains unit tests of the load generator of the OpenMath client
+(omclient.load_test), run against a local server
+
+    python -m unittest test_client
+
+"""
+
+###############
+#   imports   #
+###############
+
+import asyncio
+import os
+import socket
+import tempfile
+import threading
+import unittest
+from omclient import load_test, sameOM, percentile
+from omserver import OMServer
+
+
+##################
+#   test cases   #
+##################
+
+PLUS = b'<OMOBJ><OMA><OMS cd="arith1" name="plus"/>' \
+       b'<OMI>1</OMI><OMI>2</OMI></OMA></OMOBJ>'
+
+THREE = b'<OMOBJ>\n    <OMI>3</OMI>\n</OMOBJ>'
+
+
+class ServerThread(threading.Thread):
+    """
+    returns a thread running an OMServer on a free local port in its own
+    event loop (load_test blocks the thread calling it), started by start
+
+    """
+    def __init__(self, **options):
+        threading.Thread.__init__(self, daemon=True)
+        self.server = OMServer('localhost', 0, **options)
+        self.started = threading.Event()
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        await self.server.start()
+        self.started.set()
+        await self.server.serve_forever()
+
+    def start(self):
+        threading.Thread.start(self)
+        self.started.wait(10)
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.server.stop(timeout=1),
+                                         self.loop).result(10)
+        self.join(10)
+
+
+class TestLoad(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.thread = ServerThread(executor='thread')
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.thread.stop()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.corpus = os.path.join(self.directory.name, 'corpus')
+        self.expected = os.path.join(self.directory.name, 'expected')
+        os.makedirs(self.corpus)
+        os.makedirs(self.expected)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, directory, name, content):
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(content)
+
+    def load(self, **options):
+        return load_test(self.corpus, self.expected, 'localhost',
+                         self.thread.server.port, **options)
+
+    def test_ok(self):
+        self.write(self.corpus, 'a.xml', PLUS)
+        self.write(self.expected, 'a.xml', THREE)
+        self.write(self.corpus, 'b.xml', b'<OMOBJ><OMI>5</OMI></OMOBJ>')
+        report = self.load(connections=3, requests=20)
+        self.assertEqual(report['received'], 20)
+        self.assertEqual((report['ok'], report['mismatched'],
+                          report['errors']), (20, 0, 0))
+        self.assertLessEqual(report['p50'], report['p99'])
+        self.assertLessEqual(report['p99'], report['max'])
+
+    def test_mismatch(self):
+        self.write(self.corpus, 'a.xml', PLUS)
+        self.write(self.expected, 'a.xml', b'<OMOBJ><OMI>4</OMI></OMOBJ>')
+        report = self.load(connections=2, requests=4)
+        self.assertEqual((report['ok'], report['mismatched']), (0, 4))
+
+    def test_error_results(self):
+        self.write(self.corpus, 'a.xml', PLUS)
+        self.write(self.corpus, 'b.xml', b'<OMOBJ>')
+        report = self.load(connections=1, requests=4)
+        self.assertEqual((report['received'], report['ok'],
+                          report['errors']), (4, 2, 2))
+
+    def test_rate(self):
+        self.write(self.corpus, 'a.xml', PLUS)
+        report = self.load(connections=2, requests=10, rate=100)
+        self.assertEqual(report['ok'], 10)
+        # the last request is due after 0.09 s
+        self.assertGreaterEqual(report['seconds'], 0.09)
+
+    def test_empty_corpus(self):
+        with self.assertRaises(ValueError):
+            self.load()
+
+    def test_unreachable(self):
+        self.write(self.corpus, 'a.xml', PLUS)
+        # a port nobody listens on
+        with socket.socket() as sock:
+            sock.bind(('localhost', 0))
+            port = sock.getsockname()[1]
+        report = load_test(self.corpus, None, 'localhost', port,
+                           connections=3, requests=5)
+        self.assertEqual((report['received'], report['errors']), (0, 3))
+        self.assertIsNone(report['p50'])
+
+
+class TestReport(unittest.TestCase):
+
+    def test_same_om(self):
+        self.assertTrue(sameOM(THREE, b'<OMOBJ><OMI>3</OMI></OMOBJ>'))
+        self.assertTrue(sameOM(b'<OMS cd="a" name="b"/>',
+                               b'<OMS name="b" cd="a"/>'))
+        self.assertFalse(sameOM(THREE, b'<OMOBJ><OMI>4</OMI></OMOBJ>'))
+        self.assertFalse(sameOM(b'error:x', THREE))
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile(values, 0), 1)
+        self.assertEqual(percentile([7], 95), 7)
+        self.assertEqual(percentile([1, 2, 3], 50), 2)
+        self.assertIsNone(percentile([], 50))
+
+
+######################
+#   run the tests    #
+######################
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+"""
+
+Module contains unit tests of the memoization of symbol applications
+(omparse.MemoCache)
+
+    python -m unittest test_memo
+
+"""
+
+###############
+#   imports   #
+###############
+
+import time
+import unittest
+import unittest.mock
+import omparse
+from openmath import *
+from omparse import MemoCache
+
+
+##################
+#   test cases   #
+##################
+
+def slow(args):
+    time.sleep(2 * omparse.MEMO_MIN_SECONDS)
+    return len(args)
+
+
+def fast(args):
+    return len(args)
+
+
+def sized(args):
+    # as slow for its first argument above 100, as fast otherwise
+    if args[0] > 100:
+        time.sleep(2 * omparse.MEMO_MIN_SECONDS)
+    return args[0] + 1
+
+
+class MemoTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+    def counted(self, f):
+        """
+        returns f, recording its arguments in self.calls
+
+        """
+        def g(args):
+            self.calls.append(list(args))
+            return f(args)
+        return g
+
+    def cache(self, functions, **options):
+        """
+        returns a MemoCache of the symbols test.<name> for functions
+
+        """
+        cache = MemoCache(**options)
+        cache.symbols = {f : ('test', 'f%d' % i)
+                         for i, f in enumerate(functions)}
+        return cache
+
+
+class TestMemo(MemoTestCase):
+
+    def test_hit(self):
+        f = self.counted(slow)
+        cache = self.cache([f])
+        self.assertEqual(cache.apply(f, [1, 2]), 2)
+        self.assertEqual(cache.apply(f, [1, 2]), 2)
+        self.assertEqual(self.calls, [[1, 2]])
+        stats = cache.stats()[('test', 'f0')]
+        self.assertEqual((stats['calls'], stats['hits'], stats['stored']),
+                         (2, 1, 1))
+
+    def test_keys_tell_types(self):
+        f = self.counted(slow)
+        cache = self.cache([f])
+        cache.apply(f, [1])
+        cache.apply(f, [1.0])
+        cache.apply(f, [True])
+        self.assertEqual(len(self.calls), 3)
+
+    def test_unknown_symbol(self):
+        f = self.counted(slow)
+        cache = self.cache([])
+        cache.apply(f, [1])
+        cache.apply(f, [1])
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(cache.stats(), {})
+
+    @unittest.mock.patch.object(omparse, 'MEMO_MIN_SECONDS', 1.0)
+    def test_cheap_not_stored(self):
+        f = self.counted(fast)
+        cache = self.cache([f])
+        cache.apply(f, [1, 2])
+        cache.apply(f, [1, 2])
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(cache.stats()[('test', 'f0')]['stored'], 0)
+
+    def test_large_arguments_stored(self):
+        f = self.counted(fast)
+        cache = self.cache([f])
+        args = ['x' * omparse.MEMO_MIN_BYTES]
+        cache.apply(f, args)
+        cache.apply(f, args)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_no_demotion(self):
+        # many cheap calls do not stop a later costly one being cached
+        f = self.counted(sized)
+        cache = self.cache([f])
+        for i in range(100):
+            cache.apply(f, [i])
+        cache.apply(f, [1000])
+        cache.apply(f, [1000])
+        self.assertEqual(self.calls.count([1000]), 1)
+        self.assertEqual(cache.stats()[('test', 'f0')]['stored'], 1)
+
+    def test_deep_arguments(self):
+        # too deep to be a key: evaluated as usual, not stored
+        f = self.counted(lambda args: 'x')
+        cache = self.cache([f])
+        deep = 1
+        for _ in range(5000):
+            deep = [deep]
+        self.assertEqual(cache.apply(f, [deep]), 'x')
+        self.assertEqual(cache.apply(f, [deep]), 'x')
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(len(cache.entries), 0)
+
+    def test_deep_value(self):
+        deep = 1
+        for _ in range(5000):
+            deep = [deep]
+        f = self.counted(lambda args: deep)
+        cache = self.cache([f])
+        self.assertIs(cache.apply(f, ['x' * omparse.MEMO_MIN_BYTES]), deep)
+
+    def test_errors_not_stored(self):
+        f = self.counted(lambda args: OMErrorObj("domain_error", None))
+        cache = self.cache([f])
+        cache.apply(f, [1])
+        cache.apply(f, [1])
+        self.assertEqual(len(self.calls), 2)
+
+
+class TestEviction(MemoTestCase):
+
+    def test_max_entries(self):
+        f = self.counted(slow)
+        cache = self.cache([f], max_entries=2)
+        cache.apply(f, [1])
+        cache.apply(f, [2])
+        cache.apply(f, [1])         # 1 is now the most recently used
+        cache.apply(f, [3])         # evicts 2
+        self.assertEqual(len(cache.entries), 2)
+        cache.apply(f, [1])
+        cache.apply(f, [2])
+        self.assertEqual(self.calls, [[1], [2], [3], [2]])
+
+    def test_max_bytes(self):
+        f = self.counted(fast)
+        text = 'x' * omparse.MEMO_MIN_BYTES
+        cache = self.cache([f], max_bytes=3 * len(text))
+        for c in 'abcd':
+            cache.apply(f, [c + text])
+        self.assertLessEqual(cache.size, cache.max_bytes)
+        self.assertLess(len(cache.entries), 4)
+        cache.apply(f, ['d' + text])
+        self.assertEqual(len(self.calls), 4)
+
+    def test_too_large_value(self):
+        f = self.counted(lambda args: 'x' * 1000)
+        cache = self.cache([f], max_bytes=100)
+        cache.apply(f, ['a' * omparse.MEMO_MIN_BYTES])
+        self.assertEqual(len(cache.entries), 0)
+        self.assertEqual(cache.size, 0)
+
+    def test_disabled(self):
+        f = self.counted(slow)
+        cache = self.cache([f], max_entries=0)
+        cache.apply(f, [1])
+        cache.apply(f, [1])
+        self.assertEqual(len(self.calls), 2)
+
+
+######################
+#   run the tests    #
+######################
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+"""
+
+Module contains unit tests of the conversion of Python objects into
+OM strings (omput)
+
+    python -m unittest test_output
+
+"""
+
+###############
+#   imports   #
+###############
+
+import decimal
+import os
+import tempfile
+import unittest
+from fractions import Fraction
+import omput
+from omput import OMobject, OMwrite, OMtext, OMelement, register_encoder
+from omput import OMFloat
+from omparse import ProgramErrorObj
+from openmath import ParseOMstring, ParseOMfile, OMprettystring, process
+
+
+##################
+#   test cases   #
+##################
+
+TST = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tst')
+
+VALUES = [ 3, -2**70, 1.5, 'a b', True, 2+3j, Fraction(-1, 3),
+           [1, [2.5, 'x'], []] ]
+
+
+class TestWriter(unittest.TestCase):
+
+    def test_chunks(self):
+        chunks = []
+        OMwrite(OMobject([1, 2, 3]), chunks.append)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(''.join(chunks), OMprettystring(
+            OMobject([1, 2, 3]), 0))
+
+    def test_round_trip(self):
+        for x in VALUES:
+            for pretty in (True, False):
+                chunks = []
+                OMwrite(OMobject(x), chunks.append, pretty=pretty)
+                self.assertEqual(ParseOMstring(''.join(chunks)), x)
+
+    def test_compact(self):
+        chunks = []
+        OMwrite(OMobject([1, 'x']), chunks.append, pretty=False)
+        self.assertNotIn('\n', ''.join(chunks))
+
+    def test_stream(self):
+        # the file written as chunks holds the text built in one go
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ('matrix.xml', 'listnested.xml'):
+                output = os.path.join(directory, name)
+                result = process(os.path.join(TST, name), output, stream=True)
+                with open(output) as f:
+                    self.assertEqual(f.read(), OMprettystring(
+                        OMobject(result.python), 0))
+
+
+class TestText(unittest.TestCase):
+
+    def test_same_as_elements(self):
+        values = VALUES + [ParseOMfile(os.path.join(TST, name))
+                           for name in sorted(os.listdir(TST))
+                           if not name.startswith('prog_err')]
+        for x in values:
+            for pretty in (True, False):
+                chunks = []
+                OMwrite(OMobject(x), chunks.append, pretty=pretty)
+                self.assertEqual(OMtext(x, pretty), ''.join(chunks))
+
+    def test_unsupported(self):
+        with self.assertRaises(ProgramErrorObj):
+            OMtext(object())
+
+
+class Celsius(float):
+    pass
+
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.encoders = dict(omput.OMencoders)
+        self.writers = dict(omput.OMwriters)
+
+    def tearDown(self):
+        omput.OMencoders.clear()
+        omput.OMencoders.update(self.encoders)
+        omput.OMwriters.clear()
+        omput.OMwriters.update(self.writers)
+        omput.resolvedEncoders.clear()
+        omput.resolvedWriters.clear()
+
+    def test_subclass(self):
+        # encoded as the nearest base class in the MRO
+        self.assertEqual(OMtext(Celsius(1.5)), OMtext(1.5))
+        self.assertEqual(OMelement(Celsius(1.5)).tag, 'OMF')
+        self.assertNotEqual(OMtext(True), OMtext(1))
+
+    def test_register(self):
+        self.assertIsInstance(OMelement(decimal.Decimal('0.5')),
+                              ProgramErrorObj)
+        register_encoder(decimal.Decimal, lambda x: OMFloat(float(x)))
+        self.assertEqual(OMtext(decimal.Decimal('0.5')), OMtext(0.5))
+
+    def test_register_clears_caches(self):
+        self.assertEqual(OMtext(Celsius(1.5)), OMtext(1.5))
+        self.assertIn(Celsius, omput.resolvedWriters)
+        register_encoder(Celsius, lambda x: OMFloat(x - 273.15))
+        self.assertEqual(omput.resolvedEncoders, {})
+        self.assertEqual(omput.resolvedWriters, {})
+        self.assertEqual(OMtext(Celsius(273.65)), OMtext(273.65 - 273.15))
+        self.assertEqual(OMelement(Celsius(273.65)).get('dec'),
+                         OMFloat(273.65 - 273.15).get('dec'))
+
+    def test_register_writer(self):
+        def writeCelsius(x, write, indent, step):
+            write(indent + '<OMSTR>celsius</OMSTR>')
+        register_encoder(Celsius, lambda x: OMFloat(x), writeCelsius)
+        self.assertIn('celsius', OMtext(Celsius(1.5)))
+        # registering again without a writer drops it
+        register_encoder(Celsius, lambda x: OMFloat(x))
+        self.assertEqual(OMtext(Celsius(1.5)), OMtext(1.5))
+
+
+######################
+#   run the tests    #
+######################
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,239 @@
+"""
+
+Module contains unit tests of the conversion of OM strings into Python
+objects (omparse, openmath.ParseOMstring and openmath.ParseOMstream)
+
+    python -m unittest test_parse
+
+"""
+
+###############
+#   imports   #
+###############
+
+import io
+import sys
+import unittest
+import xml.etree.ElementTree as ET
+import omparse
+from omparse import eval, evalBody, IntegerInterval, OMErrorObj
+from omparse import Matrix, MatrixRow
+from openmath import ParseOMstring, ParseOMstream
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+##################
+#   test cases   #
+##################
+
+def element(text):
+    """
+    returns the element of the OM string text
+
+    """
+    return ET.fromstring(text)
+
+
+def application(name, *args):
+    """
+    returns the OM string of the arith1 symbol name applied to args
+
+    """
+    return '<OMA><OMS cd="arith1" name="%s"/>%s</OMA>' % (name, ''.join(args))
+
+
+X = '<OMV name="x"/>'
+Y = '<OMV name="y"/>'
+
+BODIES = [  X,
+            '<OMI>5</OMI>',
+            application('plus', X, '<OMI>1</OMI>'),
+            application('times', application('plus', '<OMI>1</OMI>',
+                                             '<OMI>2</OMI>'), X),
+            application('minus', Y, application('power', X, '<OMI>2</OMI>')),
+            application('unary_minus', application('abs', X)),
+            application('plus', X, Y, X, '<OMI>4</OMI>'),
+            application('times', X),
+            application('divide', '<OMF dec="1.5"/>', Y) ]
+
+
+class TestLambda(unittest.TestCase):
+
+    def test_same_as_evalBody(self):
+        vs = [element(X), element(Y)]
+        for text in BODIES:
+            body = element(text)
+            f = eval(vs, body, ())
+            for x, y in [(1, 2), (-3, 7), (0.5, 4)]:
+                self.assertEqual(f(x)(y),
+                                 evalBody(body, {'x' : x, 'y' : y}), text)
+
+    def test_reentrant(self):
+        body = element(application('plus', X, '<OMI>1</OMI>'))
+        f = eval([element(X)], body, ())
+        # the application of f does not disturb one in progress
+        self.assertEqual(f(f(f(1))), 4)
+        g = eval([element(X), element(Y)],
+                 element(application('minus', X, Y)), ())
+        partial = g(10)
+        self.assertEqual(g(1)(2), -1)
+        self.assertEqual(partial(3), 7)
+
+    def test_repeated_name(self):
+        # the last declaration of a name binds it
+        f = eval([element(X), element(X)], element(X), ())
+        self.assertEqual(f(1)(2), 2)
+
+    def test_no_variable(self):
+        self.assertEqual(eval([], element(application(
+            'plus', '<OMI>1</OMI>', '<OMI>2</OMI>')), ()), 3)
+
+    def test_deep_body(self):
+        depth = omparse.CLOSURE_DEPTH + 50
+        text = X
+        for i in range(depth):
+            text = application('plus', text, '<OMI>%d</OMI>' % (i % 3))
+        body = element(text)
+        f = eval([element(X)], body, ())
+        self.assertEqual(f(7), evalBody(body, {'x' : 7}))
+        self.assertEqual(f(7), 7 + sum(i % 3 for i in range(depth)))
+
+
+class TestInterval(unittest.TestCase):
+
+    def test_sequence(self):
+        interval = IntegerInterval(3, 7)
+        self.assertEqual(len(interval), 5)
+        self.assertEqual(list(interval), [3, 4, 5, 6, 7])
+        self.assertIn(7, interval)
+        self.assertNotIn(8, interval)
+        self.assertEqual(len(IntegerInterval(5, 4)), 0)
+
+    def test_indexes(self):
+        interval = IntegerInterval(3, 7)
+        self.assertEqual(interval[0], 3)
+        self.assertEqual(interval[-1], 7)
+        self.assertEqual(interval[-5], 3)
+        with self.assertRaises(IndexError):
+            interval[5]
+        with self.assertRaises(IndexError):
+            interval[-6]
+
+    def test_slices(self):
+        interval = IntegerInterval(3, 7)
+        self.assertEqual(interval[1:3], IntegerInterval(4, 5))
+        self.assertEqual(interval[-2:], IntegerInterval(6, 7))
+        self.assertEqual(interval[:-1], IntegerInterval(3, 6))
+        self.assertEqual(len(interval[4:2]), 0)
+        self.assertEqual(interval[::2], [3, 5, 7])
+        self.assertEqual(interval[::-1], [7, 6, 5, 4, 3])
+
+    def test_large(self):
+        interval = IntegerInterval(1, 10**18)
+        self.assertEqual(len(interval), 10**18)
+        self.assertEqual(interval[-1], 10**18)
+        self.assertEqual(interval[10:12], IntegerInterval(11, 12))
+
+
+class TestNesting(unittest.TestCase):
+
+    def deep(self, depth):
+        text = '<OMI>1</OMI>'
+        for _ in range(depth):
+            text = application('plus', text, '<OMI>1</OMI>')
+        return '<OMOBJ>%s</OMOBJ>' % text
+
+    def test_deeper_than_recursion_limit(self):
+        depth = 2 * sys.getrecursionlimit()
+        document = self.deep(depth)
+        self.assertEqual(ParseOMstring(document), depth + 1)
+        self.assertEqual(ParseOMstream(io.BytesIO(document.encode())),
+                         depth + 1)
+
+    def test_deep_arguments_of_error(self):
+        depth = 2 * sys.getrecursionlimit()
+        document = self.deep(depth).replace('<OMOBJ>',
+            '<OMOBJ><OMA><OMS cd="nosuch" name="x"/>', 1).replace(
+            '</OMOBJ>', '</OMA></OMOBJ>')
+        self.assertIsInstance(ParseOMstring(document), OMErrorObj)
+        self.assertIsInstance(ParseOMstream(io.BytesIO(document.encode())),
+                              OMErrorObj)
+
+
+class TestMatrix(unittest.TestCase):
+
+    def test_buffers(self):
+        m = Matrix([[1, 2, 3], [4, 5, 6]])
+        self.assertEqual((m.shape, m.dtype), ((2, 3), 'int64'))
+        self.assertEqual(m.data.typecode, 'q')
+        self.assertEqual(list(m.data), [1, 2, 3, 4, 5, 6])
+        self.assertEqual(m.cell(1, 0), 4)
+        self.assertEqual(Matrix([[0.5, 1.5]]).dtype, 'float64')
+        # values that do not fit a 64 bit number are kept in a list
+        self.assertEqual(Matrix([[1, 2**64]]).dtype, 'object')
+        self.assertEqual(Matrix([[1, 0.5]]).dtype, 'object')
+        self.assertEqual(Matrix([MatrixRow([1]), MatrixRow([0.5])]).dtype,
+                         'object')
+
+    def test_rows(self):
+        m = Matrix([[1, 2], [3, 4], [3, 4]])
+        self.assertEqual(m.rows, [MatrixRow([1, 2]), MatrixRow([3, 4]),
+                                  MatrixRow([3, 4])])
+        self.assertEqual(m.row(2).tolist(), [3, 4])
+        self.assertEqual(m.tolist(), [[1, 2], [3, 4], [3, 4]])
+        # a row is a view on the buffer of the matrix
+        self.assertIsInstance(m.row(0).data, memoryview)
+
+    def test_equality(self):
+        self.assertEqual(Matrix([[1, 2], [3, 4]]), Matrix([[1, 2], [3, 4]]))
+        self.assertNotEqual(Matrix([[1, 2], [3, 4]]),
+                            Matrix([[1, 2, 3, 4]]))
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_asarray(self):
+        m = Matrix([[1, 2], [3, 4]])
+        a = m.asarray()
+        self.assertEqual(a.shape, (2, 2))
+        a[1, 0] = 7
+        self.assertEqual(m.cell(1, 0), 7)
+
+
+class TestStream(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        def spy(ls):
+            self.calls.append(ls)
+            return 1
+        omparse.omdicts['test1'] = {'spy' : spy}
+
+    def tearDown(self):
+        del omparse.omdicts['test1']
+
+    def test_error_head_skips_arguments(self):
+        spy = '<OMA><OMS cd="test1" name="spy"/></OMA>'
+        document = '<OMOBJ><OMA><OMS cd="nosuch" name="x"/>%s%s</OMA>' \
+                   '</OMOBJ>' % (spy, application('plus', spy, spy))
+        streamed = ParseOMstream(io.BytesIO(document.encode()))
+        self.assertIsInstance(streamed, OMErrorObj)
+        self.assertEqual(streamed, ParseOMstring(document))
+        self.assertEqual(self.calls, [])
+
+    def test_same_as_string(self):
+        document = '<OMOBJ>%s</OMOBJ>' % application('plus',
+            '<OMA><OMS cd="test1" name="spy"/></OMA>', '<OMI>2</OMI>')
+        self.assertEqual(ParseOMstream(io.BytesIO(document.encode())), 3)
+        self.assertEqual(ParseOMstring(document), 3)
+        self.assertEqual(len(self.calls), 2)
+
+
+######################
+#   run the tests    #
+######################
+
+if __name__ == '__main__':
+    unittest.main()
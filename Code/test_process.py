@@ -0,0 +1,261 @@
+"""
+
+Module contains unit tests of the processing of OM files (openmath):
+process_many, its manifest, the atomic writing of the outputs and the
+reading of memory mapped inputs
+
+    python -m unittest test_process
+
+"""
+
+###############
+#   imports   #
+###############
+
+import os
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+import openmath
+# not "from openmath import *", which brings os.open in place of open
+from openmath import process_many, atomicWrite, fileHash, Manifest, \
+     ParseOMfile, ParseOMstream, OMbinary, ProgramErrorObj
+
+
+##################
+#   test cases   #
+##################
+
+PLUS = '<OMOBJ><OMA><OMS cd="arith1" name="plus"/>' \
+       '<OMI>1</OMI><OMI>2</OMI></OMA></OMOBJ>'
+
+
+def crash(part, mapped=False):
+    # processChunk of a worker process that dies
+    os._exit(1)
+
+
+class FilesTestCase(unittest.TestCase):
+    """
+    runs each test in a new directory
+
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = self.directory.name
+        self.out_dir = os.path.join(self.root, 'out')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, text=PLUS):
+        """
+        writes text to the file name of the test directory,
+        returns its path
+
+        """
+        fname = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        with open(fname, 'w') as f:
+            f.write(text)
+        return fname
+
+    def read(self, fname):
+        with open(fname) as f:
+            return f.read()
+
+    def run_many(self, inputs, **options):
+        """
+        returns the dictionary name -> ProcessResult of processing inputs
+
+        """
+        return {result.name : result
+                for result in process_many(inputs, self.out_dir, **options)}
+
+
+class TestBatch(FilesTestCase):
+
+    def test_process(self):
+        inputs = [self.write('a.xml'), self.write('b.xml', '<OMOBJ>')]
+        results = self.run_many(inputs, workers=0)
+        self.assertEqual(results['a.xml'].status, 'done')
+        self.assertEqual(results['b.xml'].status, 'failed')
+        self.assertIn('<OMI>3</OMI>',
+                      self.read(os.path.join(self.out_dir, 'a.xml')))
+
+    def test_pool(self):
+        inputs = [self.write('%d.xml' % i) for i in range(5)]
+        results = self.run_many(inputs, workers=2, chunk=2)
+        self.assertEqual(sorted(results), ['%d.xml' % i for i in range(5)])
+        self.assertTrue(all(r.status == 'done' for r in results.values()))
+
+    def test_duplicate_names(self):
+        first = self.write('a/x.xml')
+        second = self.write('b/x.xml', '<OMOBJ><OMI>5</OMI></OMOBJ>')
+        results = list(process_many([first, second], self.out_dir,
+                                    workers=0))
+        self.assertEqual([r.status for r in results], ['failed', 'done'])
+        self.assertIn(second, results[0].error)
+        # the output of the first input is not overwritten
+        self.assertIn('<OMI>3</OMI>',
+                      self.read(os.path.join(self.out_dir, 'x.xml')))
+
+    def test_worker_died(self):
+        inputs = [self.write('%d.xml' % i) for i in range(3)]
+        processChunk = openmath.processChunk
+        openmath.processChunk = crash
+        try:
+            results = self.run_many(inputs, workers=1, chunk=2)
+        finally:
+            openmath.processChunk = processChunk
+        self.assertEqual(len(results), 3)
+        for result in results.values():
+            self.assertEqual(result.status, 'failed')
+            self.assertIn('worker died', result.error)
+
+
+class TestManifest(FilesTestCase):
+
+    def statuses(self, inputs, **options):
+        results = self.run_many(inputs, workers=0, **options)
+        return {name : r.status for name, r in results.items()}
+
+    def test_skip_unchanged(self):
+        inputs = [self.write('a.xml'), self.write('b.xml')]
+        self.assertEqual(self.statuses(inputs),
+                         {'a.xml' : 'done', 'b.xml' : 'done'})
+        self.assertEqual(self.statuses(inputs),
+                         {'a.xml' : 'skipped', 'b.xml' : 'skipped'})
+        self.assertEqual(self.statuses(inputs, force=True),
+                         {'a.xml' : 'done', 'b.xml' : 'done'})
+
+    def test_recompute_changed_input(self):
+        inputs = [self.write('a.xml'), self.write('b.xml')]
+        self.statuses(inputs)
+        self.write('b.xml', '<OMOBJ><OMI>5</OMI></OMOBJ>')
+        self.assertEqual(self.statuses(inputs),
+                         {'a.xml' : 'skipped', 'b.xml' : 'done'})
+
+    def test_recompute_changed_output(self):
+        inputs = [self.write('a.xml')]
+        self.statuses(inputs)
+        with open(os.path.join(self.out_dir, 'a.xml'), 'a') as f:
+            f.write(' ')
+        self.assertEqual(self.statuses(inputs), {'a.xml' : 'done'})
+        os.remove(os.path.join(self.out_dir, 'a.xml'))
+        self.assertEqual(self.statuses(inputs), {'a.xml' : 'done'})
+
+    def test_recompute_new_version(self):
+        inputs = [self.write('a.xml')]
+        self.statuses(inputs)
+        version = openmath.evaluator_version
+        openmath.evaluator_version = 'other'
+        try:
+            self.assertEqual(self.statuses(inputs), {'a.xml' : 'done'})
+        finally:
+            openmath.evaluator_version = version
+
+    def test_failed_not_recorded(self):
+        inputs = [self.write('a.xml', '<OMOBJ>')]
+        self.assertEqual(self.statuses(inputs), {'a.xml' : 'failed'})
+        self.assertEqual(self.statuses(inputs), {'a.xml' : 'failed'})
+
+    def test_unreadable_manifest(self):
+        inputs = [self.write('a.xml')]
+        self.statuses(inputs)
+        self.write(os.path.join('out', openmath.MANIFEST_FILE), '{')
+        self.assertEqual(Manifest(self.out_dir).entries, {})
+        self.assertEqual(self.statuses(inputs), {'a.xml' : 'done'})
+
+
+class TestAtomicWrite(FilesTestCase):
+
+    def test_hash_and_content(self):
+        fname = os.path.join(self.root, 'f.xml')
+        text = 'a\r\nb\n\u20ac'
+        digest = atomicWrite(fname, lambda write: write(text))
+        self.assertEqual(digest, fileHash(fname))
+        with open(fname, 'rb') as f:
+            self.assertEqual(f.read(), text.encode('utf-8'))
+
+    def test_mode(self):
+        fname = os.path.join(self.root, 'f.xml')
+        mask = os.umask(0o027)
+        try:
+            atomicWrite(fname, lambda write: write('a'))
+        finally:
+            os.umask(mask)
+        self.assertEqual(os.stat(fname).st_mode & 0o777, 0o640)
+
+    def test_failure_keeps_file(self):
+        fname = self.write('f.xml', 'old')
+        def produce(write):
+            write('new, but ')
+            raise RuntimeError('interrupted')
+        with self.assertRaises(RuntimeError):
+            atomicWrite(fname, produce)
+        self.assertEqual(self.read(fname), 'old')
+        # the temporary file is removed
+        self.assertEqual(os.listdir(self.root), ['f.xml'])
+
+
+class TestMapped(FilesTestCase):
+    """
+    the inputs read from memory have the values of the inputs read
+    as usual
+
+    """
+    def assertSameValue(self, fname):
+        for parse in (ParseOMfile, ParseOMstream):
+            self.assertEqual(parse(fname, mapped=True), parse(fname))
+
+    def test_text(self):
+        self.assertSameValue(self.write('a.xml'))
+
+    def test_several_chunks(self):
+        items = '<OMI>1</OMI>' * (2 * openmath.MAPPED_CHUNK // 12)
+        fname = self.write('a.xml', '<OMOBJ><OMA><OMS cd="list1" '
+                           'name="list"/>' + items + '</OMA></OMOBJ>')
+        self.assertGreater(os.path.getsize(fname), 2 * openmath.MAPPED_CHUNK)
+        self.assertSameValue(fname)
+
+    def test_binary(self):
+        fname = os.path.join(self.root, 'a.bin')
+        with open(fname, 'wb') as f:
+            f.write(OMbinary([7**5000, "abc", 2.5]))
+        # read as a stream only if mapped
+        for value in (ParseOMfile(fname), ParseOMfile(fname, mapped=True),
+                      ParseOMstream(fname, mapped=True)):
+            self.assertEqual(value, [7**5000, "abc", 2.5])
+
+    def test_empty(self):
+        fname = self.write('a.xml', '')
+        for parse in (ParseOMfile, ParseOMstream):
+            with self.assertRaises(ET.ParseError):
+                parse(fname, mapped=True)
+
+    def test_parse_error(self):
+        fname = self.write('a.xml', '<OMOBJ><OMI>1')
+        for parse in (ParseOMfile, ParseOMstream):
+            with self.assertRaises(ET.ParseError):
+                parse(fname, mapped=True)
+
+    def test_missing(self):
+        result = ParseOMfile(os.path.join(self.root, 'a.xml'), mapped=True)
+        self.assertIsInstance(result, ProgramErrorObj)
+
+    def test_process_mapped(self):
+        inputs = [self.write('a.xml'), self.write('b.xml', '<OMOBJ>')]
+        results = self.run_many(inputs, workers=0, mapped=True)
+        self.assertEqual(results['a.xml'].status, 'done')
+        self.assertEqual(results['b.xml'].status, 'failed')
+        self.assertIn('<OMI>3</OMI>',
+                      self.read(os.path.join(self.out_dir, 'a.xml')))
+
+
+######################
+#   run the tests    #
+######################
+
+if __name__ == '__main__':
+    unittest.main()
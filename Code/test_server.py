@@ -0,0 +1,345 @@
+"""
+
+Module contains unit tests of the OpenMath server (omserver) and of
+the framing of its messages (omprotocol)
+
+    python -m unittest test_server
+
+"""
+
+###############
+#   imports   #
+###############
+
+import asyncio
+import socket
+import threading
+import time
+import unittest
+import omparse
+import omserver
+from omprotocol import *
+from omserver import OMServer
+
+
+##################
+#   test cases   #
+##################
+
+PLUS = b'<OMOBJ><OMA><OMS cd="arith1" name="plus"/>' \
+       b'<OMI>1</OMI><OMI>2</OMI></OMA></OMOBJ>'
+
+
+class ServerTestCase(unittest.IsolatedAsyncioTestCase):
+    """
+    runs an OMServer on a free local port for each test
+
+    """
+    options = {'executor' : 'thread'}
+
+    async def asyncSetUp(self):
+        self.server = OMServer('localhost', 0, **self.options)
+        await self.server.start()
+
+    async def asyncTearDown(self):
+        await self.server.stop(timeout=1)
+
+    async def connect(self):
+        return await asyncio.open_connection(self.server.host,
+                                             self.server.port)
+
+    def send(self, writer, payload):
+        """
+        sends payload (bytes, or a list of bytes) as a frame
+
+        """
+        parts = payload if isinstance(payload, list) else [payload]
+        writer.write(HEADER.pack(frameSize(parts)) + b''.join(parts))
+
+    async def receive(self, reader):
+        """
+        returns the payload of the next frame
+
+        """
+        (size,) = HEADER.unpack(await asyncio.wait_for(
+            reader.readexactly(HEADER.size), 30))
+        return await reader.readexactly(size)
+
+    async def request(self, reader, writer, payload):
+        """
+        sends payload as a frame, returns the payload of the answer
+
+        """
+        self.send(writer, payload)
+        return await self.receive(reader)
+
+
+class TestServer(ServerTestCase):
+
+    async def test_evaluate(self):
+        reader, writer = await self.connect()
+        answer = await self.request(reader, writer, PLUS)
+        self.assertIn(b'<OMI>3</OMI>', answer)
+        writer.close()
+
+    async def test_tagged_and_batch(self):
+        reader, writer = await self.connect()
+        kind, request_id, answer = decodeMessage(await self.request(
+            reader, writer, encodeMessage(SINGLE, 7, PLUS)))
+        self.assertEqual((kind, request_id), (SINGLE, 7))
+        self.assertIn(b'<OMI>3</OMI>', bytes(answer))
+        kind, request_id, answers = decodeMessage(await self.request(
+            reader, writer, encodeMessage(BATCH, 8, [PLUS, b'<OMOBJ>'])))
+        self.assertEqual((kind, request_id, len(answers)), (BATCH, 8, 2))
+        self.assertIn(b'<OMI>3</OMI>', bytes(answers[0]))
+        self.assertTrue(bytes(answers[1]).startswith(b'error:'))
+        writer.close()
+
+    async def test_bad_batch(self):
+        # the batch announces more bytes than the frame holds
+        reader, writer = await self.connect()
+        payload = b''.join(encodeMessage(BATCH, 9, [PLUS]))
+        answer = await self.request(reader, writer, payload[:-4])
+        self.assertTrue(answer.startswith(b'error:truncated_message'))
+        self.assertEqual(await reader.read(), b'')
+        writer.close()
+
+    async def test_out_of_order(self):
+        # a tagged request is answered as soon as it is done
+        def pause(ls):
+            time.sleep(0.5)
+            return 1
+        omparse.omdicts['test1'] = {'pause' : pause}
+        try:
+            reader, writer = await self.connect()
+            self.send(writer, encodeMessage(SINGLE, 1,
+                b'<OMOBJ><OMA><OMS cd="test1" name="pause"/></OMA></OMOBJ>'))
+            self.send(writer, encodeMessage(SINGLE, 2, PLUS))
+            answers = [decodeMessage(await self.receive(reader))
+                       for _ in range(2)]
+            writer.close()
+        finally:
+            del omparse.omdicts['test1']
+        self.assertEqual([a[1] for a in answers], [2, 1])
+        self.assertIn(b'<OMI>3</OMI>', bytes(answers[0][2]))
+        self.assertIn(b'<OMI>1</OMI>', bytes(answers[1][2]))
+
+    async def test_digit_limit(self):
+        reader, writer = await self.connect()
+        digits = omserver.MAX_DIGITS
+        accepted = b'<OMOBJ><OMI>' + b'7' * digits + b'</OMI></OMOBJ>'
+        refused = b'<OMOBJ><OMI>' + b'7' * (digits + 1) + b'</OMI></OMOBJ>'
+        self.assertIn(b'7' * digits,
+                      await self.request(reader, writer, accepted))
+        self.assertTrue((await self.request(reader, writer, refused))
+                        .startswith(b'error:'))
+        writer.close()
+
+    async def test_stop_with_idle_client(self):
+        # a client that stays connected is closed after the timeout
+        reader, writer = await self.connect()
+        await self.request(reader, writer, PLUS)
+        start = time.monotonic()
+        await asyncio.wait_for(self.server.stop(timeout=0.2), 5)
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(await reader.read(), b'')
+        writer.close()
+
+
+class TestLimits(ServerTestCase):
+
+    options = {'executor' : 'thread', 'max_connections' : 1,
+               'max_frame_size' : 64}
+
+    async def test_too_many_connections(self):
+        reader, writer = await self.connect()
+        await self.request(reader, writer, b'<OMOBJ><OMI>1</OMI></OMOBJ>')
+        other_reader, other_writer = await self.connect()
+        self.assertEqual(await self.receive(other_reader),
+                         b'error:too many connections')
+        self.assertEqual(await other_reader.read(), b'')
+        other_writer.close()
+        writer.close()
+
+    async def test_oversized_frame(self):
+        # only the header is sent: the server refuses the frame from it
+        reader, writer = await self.connect()
+        writer.write(HEADER.pack(65))
+        answer = await self.receive(reader)
+        self.assertTrue(answer.startswith(b'error:frame_too_large'))
+        self.assertEqual(await reader.read(), b'')
+        writer.close()
+
+
+SLOW = b'<OMOBJ><OMA><OMS cd="integer1" name="factorial"/>' \
+       b'<OMI>1000000</OMI></OMA></OMOBJ>'
+
+
+class TestRecycle(ServerTestCase):
+    """
+    a request timing out on the process pool does not take down the
+    requests queued behind it
+
+    """
+    options = {'executor' : 'process', 'process_workers' : 1, 'timeout' : 1}
+
+    async def test_timeout_spares_queued_requests(self):
+        reader, writer = await self.connect()
+        self.send(writer, encodeMessage(SINGLE, 1, SLOW))
+        await asyncio.sleep(0.3)
+        for request_id in (2, 3, 4):
+            self.send(writer, encodeMessage(SINGLE, request_id, PLUS))
+        answers = {}
+        for _ in range(4):
+            kind, request_id, answer = decodeMessage(
+                await self.receive(reader))
+            answers[request_id] = bytes(answer)
+        self.assertEqual(answers[1], b'error:timeout')
+        for request_id in (2, 3, 4):
+            self.assertIn(b'<OMI>3</OMI>', answers[request_id])
+        writer.close()
+
+
+class TestCache(ServerTestCase):
+
+    async def test_canonical_hit(self):
+        reader, writer = await self.connect()
+        await self.request(reader, writer, PLUS)
+        spaced = PLUS.replace(b'><', b'>\n  <')
+        self.assertIn(b'<OMI>3</OMI>',
+                      await self.request(reader, writer, spaced))
+        self.assertIn(b'<OMI>3</OMI>',
+                      await self.request(reader, writer, spaced))
+        self.assertEqual(self.server.cache.stats()['hits'], 2)
+        writer.close()
+
+    async def test_impure_not_cached(self):
+        calls = []
+        def counter(ls):
+            calls.append(ls)
+            return len(calls)
+        omparse.omdicts['test1'] = {'counter' : counter}
+        omparse.register_impure('test1', 'counter')
+        try:
+            request = b'<OMOBJ><OMA><OMS cd="test1" name="counter"/>' \
+                      b'</OMA></OMOBJ>'
+            reader, writer = await self.connect()
+            self.assertIn(b'<OMI>1</OMI>',
+                          await self.request(reader, writer, request))
+            self.assertIn(b'<OMI>2</OMI>',
+                          await self.request(reader, writer, request))
+            writer.close()
+        finally:
+            del omparse.omdicts['test1']
+            omparse.impureSymbols.discard(('test1', 'counter'))
+            omparse.memoExcluded.discard(('test1', 'counter'))
+            omparse.memo.clear()
+        self.assertEqual(self.server.cache.stats()['hits'], 0)
+
+    async def test_large_request_keyed_off_loop(self):
+        threads = []
+        canonicalOM = omserver.canonicalOM
+        def recorded(data):
+            threads.append(threading.current_thread())
+            return canonicalOM(data)
+        omserver.canonicalOM = recorded
+        try:
+            document = b'<OMOBJ><OMA><OMS cd="list1" name="list"/>' + \
+                       b'<OMI>1</OMI>' * 2000 + b'</OMA></OMOBJ>'
+            self.assertGreater(len(document), omserver.INLINE_SIZE)
+            reader, writer = await self.connect()
+            await self.request(reader, writer, PLUS)
+            await self.request(reader, writer, document)
+            writer.close()
+        finally:
+            omserver.canonicalOM = canonicalOM
+        self.assertEqual(threads[0], threading.current_thread())
+        self.assertNotEqual(threads[1], threading.current_thread())
+
+
+class PartialSocket:
+    """
+    returns a socket sending at most 3 bytes at a time, recording the
+    number of buffers given to each sendmsg
+
+    """
+    def __init__(self):
+        self.data = b''
+        self.calls = []
+
+    def sendmsg(self, buffers):
+        self.calls.append(len(buffers))
+        data = b''.join(buffers)[:3]
+        self.data += data
+        return len(data)
+
+
+class TestFraming(unittest.TestCase):
+
+    def test_batch_round_trip(self):
+        documents = [b'a', b'', b'bc' * 1000]
+        payload = b''.join(encodeMessage(BATCH, 3, documents))
+        kind, request_id, decoded = decodeMessage(payload)
+        self.assertEqual((kind, request_id), (BATCH, 3))
+        self.assertEqual([bytes(d) for d in decoded], documents)
+
+    def test_bare_payload(self):
+        kind, request_id, document = decodeMessage(PLUS)
+        self.assertIsNone(kind)
+        self.assertEqual(bytes(document), PLUS)
+
+    def test_socket_round_trip(self):
+        payload = encodeMessage(BATCH, 5, [b'a', b'', b'bc' * 200000])
+        left, right = socket.socketpair()
+        with left, right:
+            sender = threading.Thread(target=sendFrame,
+                                      args=(left, payload))
+            sender.start()
+            received = recvFrame(right)
+            sender.join()
+        self.assertEqual(bytes(received), b''.join(payload))
+
+    def test_truncated_frame(self):
+        for data in (HEADER.pack(10) + b'abc', HEADER.pack(10)[:2]):
+            left, right = socket.socketpair()
+            with left, right:
+                left.sendall(data)
+                left.shutdown(socket.SHUT_WR)
+                with self.assertRaises(ProtocolError):
+                    recvFrame(right)
+
+    def test_closed_between_frames(self):
+        left, right = socket.socketpair()
+        with left, right:
+            sendFrame(left, b'abc')
+            left.shutdown(socket.SHUT_WR)
+            self.assertEqual(recvFrame(right), b'abc')
+            self.assertIsNone(recvFrame(right))
+
+    def test_frame_too_large(self):
+        left, right = socket.socketpair()
+        with left, right:
+            sendFrame(left, b'abcdef')
+            with self.assertRaises(ProtocolError):
+                recvFrame(right, max_size=5)
+
+    def test_single_write(self):
+        sock = PartialSocket()
+        payload = [b'abc', b'', bytearray(b'de'), memoryview(b'fgh')[1:]]
+        sendFrame(sock, payload)
+        self.assertEqual(sock.data, HEADER.pack(7) + b'abcdegh')
+        # all the buffers are given to each write
+        self.assertEqual(sock.calls[0], 4)
+
+    def test_truncated_batch(self):
+        payload = b''.join(encodeMessage(BATCH, 1, [b'abcdef']))
+        with self.assertRaises(ProtocolError):
+            decodeMessage(payload[:-2])
+
+
+######################
+#   run the tests    #
+######################
+
+if __name__ == '__main__':
+    unittest.main()